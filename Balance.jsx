@@ -29,6 +29,10 @@ const Balance = () => {
       }
     };
     fetchBalanceData();
+
+    // Refresh when a deposit or transfer changes the balance
+    window.addEventListener('balance-changed', fetchBalanceData);
+    return () => window.removeEventListener('balance-changed', fetchBalanceData);
   }, []);
 
   if (loading) {
@@ -28,6 +28,10 @@ const Dashboard = () => {
     };
 
     fetchDashboardData();
+
+    // Refresh when a deposit or transfer changes the balance
+    window.addEventListener('balance-changed', fetchDashboardData);
+    return () => window.removeEventListener('balance-changed', fetchDashboardData);
   }, [navigate]);
 
   if (loading) {
@@ -1,7 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
+import { useLocation } from 'react-router-dom';
 
 const FlashMessage = () => {
+  const location = useLocation();
   const [messages, setMessages] = useState([]);
+  const eventSourceRef = useRef(null);
+  const pollRef = useRef(null);
 
   const fetchFlashMessages = async () => {
     try {
@@ -17,13 +21,45 @@ const FlashMessage = () => {
     }
   };
 
-  // 🌟 FIX: UNCOMMENTED BLOCK FOR FETCHING AND POLLING
+  // Pick up anything flashed by the request that led to this page
   useEffect(() => {
-    fetchFlashMessages(); 
-    const PULLING_INTERVAL = 3000; 
-    const intervalId = setInterval(fetchFlashMessages, PULLING_INTERVAL);
+    fetchFlashMessages();
+  }, [location.pathname]);
 
-    return () => clearInterval(intervalId); // Cleanup function to stop the interval
+  const stopPolling = () => {
+    clearInterval(pollRef.current);
+    pollRef.current = null;
+  };
+
+  // Flashes and balance changes are pushed over one event stream instead of polling.
+  // The server refuses it for logged-out users, or when all of its stream slots are
+  // taken, so poll in the meantime and try again after each navigation.
+  useEffect(() => {
+    const current = eventSourceRef.current;
+    if (current && current.readyState !== EventSource.CLOSED) return;
+
+    stopPolling();
+    const source = new EventSource('/api/events', { withCredentials: true });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED && !pollRef.current) {
+        pollRef.current = setInterval(fetchFlashMessages, 3000);
+      }
+    };
+    source.addEventListener('flash', (event) => {
+      const data = JSON.parse(event.data);
+      setMessages(prevMessages => [...prevMessages, ...data.messages]);
+    });
+    source.addEventListener('balance', (event) => {
+      window.dispatchEvent(new CustomEvent('balance-changed', { detail: JSON.parse(event.data) }));
+    });
+    eventSourceRef.current = source;
+  }, [location.pathname]);
+
+  useEffect(() => {
+    return () => {
+      stopPolling();
+      eventSourceRef.current && eventSourceRef.current.close(); // Cleanup on unmount
+    };
   }, []);
 
   // Block for auto-hiding the messages
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import Navbar from './Navbar';
 
@@ -12,13 +12,20 @@ const Transactions = () => {
   });
   
   const [transactions, setTransactions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [userAccount, setUserAccount] = useState('');
   const [errors, setErrors] = useState({});
   const [message, setMessage] = useState("");
   const [localErrorMessage, setLocalErrorMessage] = useState({ text: '', type: '' }); 
+  const sentinelRef = useRef(null);
 
   useEffect(() => {
     fetchTransactions();
+
+    // Show incoming transfers as soon as they are posted
+    window.addEventListener('balance-changed', fetchTransactions);
+    return () => window.removeEventListener('balance-changed', fetchTransactions);
   }, []);
 
   const fetchTransactions = async () => {
@@ -27,6 +34,7 @@ const Transactions = () => {
       if (response.ok) {
         const data = await response.json();
         setTransactions(data.transactions);
+        setNextCursor(data.next_cursor);
         setUserAccount(data.my_account);
       } else if (response.status === 401) {
         navigate('/login'); 
@@ -36,6 +44,38 @@ const Transactions = () => {
     }
   };
 
+  // Load the next page of history once the bottom of the table scrolls into view
+  const loadMoreTransactions = useCallback(async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const response = await fetch(`/api/transactions?before=${encodeURIComponent(nextCursor)}`);
+      if (response.ok) {
+        const data = await response.json();
+        setTransactions(prev => [...prev, ...data.transactions]);
+        setNextCursor(data.next_cursor);
+      } else if (response.status === 401) {
+        navigate('/login');
+      }
+    } catch (error) {
+      console.error("Error fetching more transactions:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [nextCursor, loadingMore, navigate]);
+
+  useEffect(() => {
+    const sentinel = sentinelRef.current;
+    if (!sentinel || !nextCursor) return;
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) loadMoreTransactions();
+    });
+    observer.observe(sentinel);
+
+    return () => observer.disconnect();
+  }, [nextCursor, loadMoreTransactions]);
+
   const validate = () => {
     const newErrors = {};
     if (!formData.accountNumber.trim()) {
@@ -236,6 +276,9 @@ const Transactions = () => {
                   ))}
                 </tbody>
               </table>
+              <div ref={sentinelRef} className="py-3 text-sm text-gray-500">
+                {loadingMore ? 'Loading more...' : nextCursor ? '' : 'End of history'}
+              </div>
             </div>
           ) : (
             <p className="text-gray-500 italic mt-4">No transactions found.</p>
@@ -1,12 +1,17 @@
 import os 
 from flask import Flask
-from flask_mysqldb import MySQL
+from .avatars import avatars
+from .cache import recipients
+from .db import db
+from .events import hub
+from .idempotency import idempotency
+from .passwords import passwords
+from .statements import statements
+from .user_context import users
 
 import hashlib
 
-mysql = MySQL()  
-
-def create_app():
+def create_app(async_api=None):
     app = Flask(
     __name__,
     static_folder="../static",    
@@ -21,10 +26,121 @@ def create_app():
     app.config["MYSQL_PASSWORD"] = "password"
     app.config["MYSQL_DB"] = "finance"
 
-    mysql.init_app(app)  
+    # Connection pool sizing, per worker process
+    app.config["MYSQL_POOL_MIN_SIZE"] = 2
+    app.config["MYSQL_POOL_MAX_SIZE"] = 10
+    app.config["MYSQL_POOL_MAX_LIFETIME"] = 1800
+    app.config["MYSQL_POOL_TIMEOUT"] = 5.0
+
+    # Apply pending schema migrations on startup (or run `flask migrate-db`)
+    app.config["AUTO_MIGRATE"] = False
+
+    # "local" keeps event streams inside one process; `flask serve` needs a
+    # redis:// URL to run several workers
+    app.config["EVENTS_BACKEND"] = "local"
+    # Open /api/events streams per worker; further tabs get a 503 and poll.
+    # None: one less than SERVER_THREADS under `flask serve`, since each
+    # stream holds one of them, and no limit elsewhere
+    app.config["EVENTS_MAX_STREAMS"] = None
+
+    # Account number -> name lookups for the transfer form; misses are cached
+    # too, but only briefly
+    app.config["RECIPIENT_CACHE_BACKEND"] = "local"
+    app.config["RECIPIENT_CACHE_TTL"] = 300
+    app.config["RECIPIENT_CACHE_NEGATIVE_TTL"] = 30
+
+    # scrypt cost for new password hashes; older hashes are upgraded on login.
+    # `flask benchmark-passwords` shows what each setting costs.
+    app.config["PASSWORD_SCRYPT_N"] = 2 ** 14
+    app.config["PASSWORD_HASH_WORKERS"] = os.cpu_count() or 2
+
+    # Keep sessions server-side and only an opaque id in the cookie: "sql"
+    # (shared by every worker; `flask prune-sessions` clears expired rows),
+    # "local" (one process only), a redis:// URL, or "cookie" for Flask's
+    # signed-cookie sessions
+    app.config["SESSION_BACKEND"] = "sql"
+
+    # Seconds to keep each user's row across requests (0 = once per request).
+    # Every worker has its own copy, so balances may lag by up to this long.
+    app.config["USER_CACHE_TTL"] = 0
+
+    db.init_app(app)
+    hub.init_app(app)
+    recipients.init_app(app)
+    passwords.init_app(app)
+    users.init_app(app)
+    avatars.init_app(app)
+
+    # Responses to POSTs with an Idempotency-Key are replayed to retries for
+    # IDEMPOTENCY_TTL seconds: "sql" (the idempotency_keys table; `flask
+    # prune-idempotency-keys` clears expired rows), a redis:// URL, or
+    # "local" (one process only, for development)
+    app.config["IDEMPOTENCY_BACKEND"] = "sql"
+    app.config["IDEMPOTENCY_TTL"] = 24 * 3600
+    idempotency.init_app(app)
+
+    # Per-query and per-endpoint timings at /metrics, readable from
+    # METRICS_ALLOWED_IPS or with "Authorization: Bearer <METRICS_TOKEN>". Set
+    # PROFILE_SAMPLE_RATE to e.g. 0.01 to cProfile that share of requests
+    # into PROFILE_DIR.
+    app.config["METRICS_ENABLED"] = True
+    app.config["METRICS_ALLOWED_IPS"] = ("127.0.0.1", "::1")
+    app.config["METRICS_TOKEN"] = None
+    app.config["PROFILE_SAMPLE_RATE"] = 0.0
+
+    # `flask serve` runs gunicorn with SERVER_WORKERS preforked workers (by
+    # default 2 * CPUs + 1, or one while a *_BACKEND above is "local"), each
+    # recycled after about SERVER_MAX_REQUESTS requests
+    app.config["SERVER_MAX_REQUESTS"] = 10000
+
+    # Let the proxy send static files: None, "x-sendfile" or "x-accel-redirect"
+    app.config["STATIC_SENDFILE"] = None
+
+    # Statement imports run on this many background threads per worker;
+    # uploads over IMPORT_MAX_SIZE bytes are refused
+    app.config["IMPORT_WORKERS"] = 1
+    app.config["IMPORT_MAX_SIZE"] = 50 * 1024 * 1024
+    statements.init_app(app)
+
+    # Journal deposits and transfers and post them to the ledger in the
+    # background, instead of updating both balances in the request
+    app.config["JOURNAL_ENABLED"] = False
+
+    # Seconds between folds of rollup_deltas into daily_rollups (0 = only
+    # `flask compact-rollups`)
+    app.config["ROLLUP_COMPACT_INTERVAL"] = 60
+
+    # `flask archive-transactions` moves whole months older than this many
+    # days into the compressed transactions_archive table
+    app.config["ARCHIVE_AFTER_DAYS"] = 365
+
+    from . import (
+        analytics, archive, assets, bench, export, instrumentation, journal, schema, serve, sessions, stats,
+        transfers,
+    )
+    analytics.init_app(app, db)
+    archive.init_app(app, db)
+    assets.init_app(app)
+    bench.init_app(app, db)
+    export.init_app(app, db)
+    instrumentation.init_app(app, db, recipients, hub)
+    journal.init_app(app, db)
+    schema.init_app(app, db)
+    serve.init_app(app, db)
+    sessions.init_app(app, db)
+    stats.init_app(app, db)
+    transfers.init_app(app, db)
 
     from .routes import main,api  
     app.register_blueprint(main)
     app.register_blueprint(api)
 
+    # Serve the hot /api endpoints on asyncio with aiomysql; everything else
+    # still goes to the Flask views. Run it with
+    # `uvicorn --factory app.asgi:create_asgi_app`.
+    app.config["ASYNC_API"] = False if async_api is None else async_api
+    if app.config["ASYNC_API"]:
+        from .asgi import AsyncAPI
+        app.asgi_app = AsyncAPI(app)
+
     return app
@@ -0,0 +1,313 @@
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import click
+from flask import current_app
+
+from .db import db
+from .history import ALL_TRANSACTIONS
+
+PERIODS = ("day", "week", "month")
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 10 * 366
+DEFAULT_TOP = 5
+MAX_TOP = 50
+COMPACT_BATCH_SIZE = 50000
+
+# Named lock held while compacting, so one process folds each delta
+COMPACT_LOCK = "rollup_compactor"
+
+# One row per account, day and counterparty ('' for deposits and withdrawals).
+# Writes append to rollup_deltas instead, so two transfers into the same
+# account never wait on each other's rollup row; compact() folds them in.
+RECORD_DELTA = """
+    INSERT INTO rollup_deltas (account_number, day, counterparty, income, outflow)
+    VALUES (%s, COALESCE(DATE(%s), CURDATE()), %s, %s, %s)
+"""
+
+# Both sides of every row in ``{ledger}``, as rollup rows. Used by rebuild().
+LEDGER_ROLLUPS = """
+    SELECT account_number, day, counterparty, SUM(income), SUM(outflow) FROM (
+        SELECT account_number, DATE(created_at) AS day, COALESCE(recipient_account, '') AS counterparty,
+               CASE WHEN type = 'deposit' THEN amount ELSE 0 END AS income,
+               CASE WHEN type = 'deposit' THEN 0 ELSE ABS(amount) END AS outflow
+        FROM {ledger} sent
+        UNION ALL
+        SELECT recipient_account, DATE(created_at), account_number, ABS(amount), 0
+        FROM {ledger} received
+        WHERE type = 'transfer' AND recipient_account IS NOT NULL
+    ) sides
+    GROUP BY account_number, day, counterparty
+"""
+
+RANGE_TOTALS = """
+    SELECT day, SUM(income), SUM(outflow) FROM (
+        SELECT day, income, outflow FROM daily_rollups
+        WHERE account_number = %s AND day BETWEEN %s AND %s
+        UNION ALL
+        SELECT day, income, outflow FROM rollup_deltas
+        WHERE account_number = %s AND day BETWEEN %s AND %s
+    ) r
+    GROUP BY day
+"""
+
+RANGE_COUNTERPARTIES = """
+    SELECT counterparty, SUM(income), SUM(outflow) FROM (
+        SELECT counterparty, income, outflow FROM daily_rollups
+        WHERE account_number = %s AND day BETWEEN %s AND %s AND counterparty <> ''
+        UNION ALL
+        SELECT counterparty, income, outflow FROM rollup_deltas
+        WHERE account_number = %s AND day BETWEEN %s AND %s AND counterparty <> ''
+    ) r
+    GROUP BY counterparty
+    ORDER BY SUM(income) + SUM(outflow) DESC
+    LIMIT %s
+"""
+
+_start_lock = threading.Lock()
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            account_number VARCHAR(20) NOT NULL,
+            day DATE NOT NULL,
+            counterparty VARCHAR(20) NOT NULL DEFAULT '',
+            income DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            outflow DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            PRIMARY KEY (account_number, day, counterparty)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_deltas (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            account_number VARCHAR(20) NOT NULL,
+            day DATE NOT NULL,
+            counterparty VARCHAR(20) NOT NULL DEFAULT '',
+            income DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            outflow DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            KEY idx_deltas_account_day (account_number, day)
+        ) ENGINE=InnoDB
+    """)
+
+
+def ledger_deltas(entries):
+    """Rollup deltas for ledger rows given as ``(account, recipient, amount, type, created_at)``.
+
+    ``created_at`` may be None for rows stamped by MySQL, which then uses today.
+    """
+    deltas = []
+    for account_number, recipient, amount, kind, created_at in entries:
+        amount = abs(amount)
+        if kind == "deposit":
+            deltas.append((account_number, created_at, "", amount, 0))
+        elif kind == "transfer" and recipient:
+            deltas.append((account_number, created_at, recipient, 0, amount))
+            deltas.append((recipient, created_at, account_number, amount, 0))
+        else:
+            deltas.append((account_number, created_at, recipient or "", 0, amount))
+    return deltas
+
+
+def record(cursor, entries):
+    """Adds ledger rows to the rollups. Run it in the transaction that inserts them."""
+    cursor.executemany(RECORD_DELTA, ledger_deltas(entries))
+
+
+def forget_account(cursor, account_number):
+    """Drops every rollup row of or against an account, like its deleted ledger rows."""
+    for table in ("daily_rollups", "rollup_deltas"):
+        cursor.execute(f"DELETE FROM {table} WHERE account_number = %s", (account_number,))
+        cursor.execute(f"DELETE FROM {table} WHERE counterparty = %s", (account_number,))
+
+
+def compact(connection, batch_size=COMPACT_BATCH_SIZE):
+    """Folds up to ``batch_size`` of the oldest deltas into daily_rollups; returns how many.
+
+    Returns None if another process holds the compaction lock.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (COMPACT_LOCK,))
+        if cursor.fetchone()[0] != 1:
+            return None
+        try:
+            cursor.execute(
+                "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM rollup_deltas ORDER BY id LIMIT %s) oldest",
+                (batch_size,),
+            )
+            last_id, count = cursor.fetchone()
+            if not count:
+                return 0
+            cursor.execute("""
+                INSERT INTO daily_rollups (account_number, day, counterparty, income, outflow)
+                SELECT account_number, day, counterparty, SUM(income), SUM(outflow)
+                FROM rollup_deltas WHERE id <= %s
+                GROUP BY account_number, day, counterparty
+                ON DUPLICATE KEY UPDATE income = income + VALUES(income), outflow = outflow + VALUES(outflow)
+            """, (last_id,))
+            cursor.execute("DELETE FROM rollup_deltas WHERE id <= %s", (last_id,))
+            connection.commit()
+            return count
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (COMPACT_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def rebuild(connection):
+    """Recomputes every rollup from the ledger with one set-based INSERT; returns the row count.
+
+    MySQL does the grouping, so the ledger never has to be pulled into Python.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM rollup_deltas")
+        cursor.execute("DELETE FROM daily_rollups")
+        cursor.execute(f"""
+            INSERT INTO daily_rollups (account_number, day, counterparty, income, outflow)
+            {LEDGER_ROLLUPS.format(ledger=ALL_TRANSACTIONS)}
+        """)
+        count = cursor.rowcount
+        connection.commit()
+        return count
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def range_args(args, today=None):
+    """Reads ``start``, ``end``, ``period`` and ``top`` from the query string. Raises ValueError."""
+    end = date.fromisoformat(args["end"]) if args.get("end") else (today or date.today())
+    start = date.fromisoformat(args["start"]) if args.get("start") else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    period = args.get("period", "day")
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    if start > end or (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError("Invalid date range")
+    top = max(0, min(args.get("top", DEFAULT_TOP, type=int), MAX_TOP))
+    return start, end, period, top
+
+
+def bucket_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, period):
+    if period == "week":
+        return day + timedelta(days=7)
+    if period == "month":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def summarize(cursor, account_number, start, end, period, top):
+    """Income, outflow and net per period from ``start`` to ``end``, plus the top counterparties.
+
+    Reads only the rollups and the deltas not compacted yet, so the cost
+    grows with the number of days in the range, not with the ledger.
+    """
+    cursor.execute(RANGE_TOTALS, (account_number, start, end) * 2)
+    buckets = {}
+    day = bucket_start(start, period)
+    while day <= end:
+        buckets[day] = [Decimal(0), Decimal(0)]
+        day = next_bucket(day, period)
+    for day, income, outflow in cursor.fetchall():
+        bucket = buckets[bucket_start(day, period)]
+        bucket[0] += income
+        bucket[1] += outflow
+
+    counterparties = []
+    if top:
+        cursor.execute(RANGE_COUNTERPARTIES, (account_number, start, end) * 2 + (top,))
+        counterparties = cursor.fetchall()
+
+    total_income = sum(income for income, _ in buckets.values())
+    total_outflow = sum(outflow for _, outflow in buckets.values())
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "buckets": [
+            {"start": day.isoformat(), "income": float(income), "outflow": float(outflow),
+             "net": float(income - outflow)}
+            for day, (income, outflow) in buckets.items()
+        ],
+        "totals": {"income": float(total_income), "outflow": float(total_outflow),
+                   "net": float(total_income - total_outflow)},
+        "top_counterparties": [
+            {"account": account, "received": float(income), "sent": float(outflow)}
+            for account, income, outflow in counterparties
+        ],
+    }
+
+
+def start(app):
+    """Starts this process's compaction thread unless ``ROLLUP_COMPACT_INTERVAL`` is 0."""
+    if not app.config["ROLLUP_COMPACT_INTERVAL"]:
+        return
+    state = app.extensions["rollups"]
+    if state["pid"] == os.getpid():
+        return
+    with _start_lock:
+        if state["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_run, args=(app,), name="rollup-compactor", daemon=True)
+        thread.start()
+        state["pid"] = os.getpid()
+
+
+def _run(app):
+    interval = app.config["ROLLUP_COMPACT_INTERVAL"]
+    # Spread the workers out; only one of them gets the lock each round anyway
+    time.sleep(random.uniform(0, interval))
+    while True:
+        try:
+            with app.app_context():
+                compacted = compact(db.connection)
+        except Exception:
+            app.logger.exception("compacting rollups failed")
+            compacted = None
+        if compacted != COMPACT_BATCH_SIZE:
+            time.sleep(interval)
+
+
+def init_app(app, db):
+    app.config.setdefault("ROLLUP_COMPACT_INTERVAL", 60)
+    app.extensions["rollups"] = {"pid": None}
+
+    app.before_request(lambda: start(current_app._get_current_object()))
+
+    @app.cli.command("compact-rollups")
+    def compact_rollups_command():
+        """Fold every pending rollup delta into daily_rollups."""
+        total = 0
+        while True:
+            compacted = compact(db.connection)
+            if compacted is None:
+                raise click.ClickException("Another process is compacting; try again shortly.")
+            total += compacted
+            if compacted < COMPACT_BATCH_SIZE:
+                break
+        click.echo(f"Compacted {total} rollup deltas.")
+
+    @app.cli.command("rebuild-rollups")
+    def rebuild_rollups_command():
+        """Recompute the analytics rollups from the transactions ledger."""
+        count = rebuild(db.connection)
+        click.echo(f"Rebuilt {count} rollup rows.")
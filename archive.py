@@ -0,0 +1,110 @@
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask import current_app
+
+from .history import ARCHIVE_TABLE
+
+ARCHIVE_CHUNK_SIZE = 5000
+
+# Moves the archived_before of every account with rows in the chunk up to the cutoff
+RECORD_HORIZONS = """
+    INSERT INTO account_stats (account_number, archived_before)
+    SELECT account_number, %s FROM (
+        SELECT account_number FROM transactions WHERE id > %s AND id <= %s AND created_at < %s
+        UNION
+        SELECT recipient_account FROM transactions
+        WHERE id > %s AND id <= %s AND created_at < %s AND recipient_account IS NOT NULL
+    ) moved
+    ON DUPLICATE KEY UPDATE archived_before = GREATEST(
+        COALESCE(archived_before, VALUES(archived_before)), VALUES(archived_before))
+"""
+
+
+def create_tables(cursor):
+    # Same columns and indexes as transactions, so history reads it the same way
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} LIKE transactions")
+    cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archived_months (
+            month DATE PRIMARY KEY,
+            row_count BIGINT NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+
+
+def cutoff(after_days, today=None):
+    """Start of the oldest month that stays hot: months ending before ``after_days`` ago are archived."""
+    return datetime.combine((today or date.today()) - timedelta(days=after_days), time()).replace(day=1)
+
+
+def archived_before():
+    """A time every archived row is older than, for ``history.iter_history``."""
+    return datetime.combine(date.today() - timedelta(days=current_app.config["ARCHIVE_AFTER_DAYS"]), time())
+
+
+def archive(connection, before, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Moves every transactions row older than ``before`` to the archive table.
+
+    Walks the primary key in chunks of ``chunk_size`` ids, so no index on
+    created_at is needed and each transaction stays short; every chunk is
+    copied, counted per month, recorded in the accounts' archived_before
+    and deleted in one commit. Returns ``{month: rows moved}``.
+    """
+    moved = {}
+    last_id = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(
+                "SELECT MAX(id) FROM (SELECT id FROM transactions WHERE id > %s ORDER BY id LIMIT %s) chunk",
+                (last_id, chunk_size),
+            )
+            upper = cursor.fetchone()[0]
+            if upper is None:
+                return moved
+
+            cursor.execute("""
+                SELECT DATE_FORMAT(created_at, '%%Y-%%m-01'), COUNT(*) FROM transactions
+                WHERE id > %s AND id <= %s AND created_at < %s
+                GROUP BY 1
+            """, (last_id, upper, before))
+            months = cursor.fetchall()
+            if months:
+                cursor.execute(f"""
+                    INSERT INTO {ARCHIVE_TABLE}
+                    SELECT * FROM transactions WHERE id > %s AND id <= %s AND created_at < %s
+                """, (last_id, upper, before))
+                cursor.execute(RECORD_HORIZONS, (before,) + (last_id, upper, before) * 2)
+                cursor.execute(
+                    "DELETE FROM transactions WHERE id > %s AND id <= %s AND created_at < %s",
+                    (last_id, upper, before),
+                )
+                cursor.executemany("""
+                    INSERT INTO archived_months (month, row_count) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE row_count = row_count + VALUES(row_count)
+                """, months)
+            connection.commit()
+
+            for month, count in months:
+                moved[month] = moved.get(month, 0) + count
+            last_id = upper
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def init_app(app, db):
+    app.config.setdefault("ARCHIVE_AFTER_DAYS", 365)
+
+    @app.cli.command("archive-transactions")
+    def archive_transactions_command():
+        """Move months older than ARCHIVE_AFTER_DAYS to the compressed archive table."""
+        before = cutoff(current_app.config["ARCHIVE_AFTER_DAYS"])
+        moved = archive(db.connection, before)
+        for month, count in sorted(moved.items()):
+            click.echo(f"{month}: archived {count} rows")
+        click.echo(f"Archived {sum(moved.values())} rows older than {before:%Y-%m-%d}.")
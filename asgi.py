@@ -0,0 +1,700 @@
+import asyncio
+import contextvars
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiomysql
+from werkzeug.wrappers import Request, Response
+
+from .archive import archived_before
+from .avatars import avatar_url
+from .cache import MISSING, recipients
+from .db import PoolTimeout
+from .events import HEARTBEAT_INTERVAL, hub, sse
+from .history import (
+    ACCOUNT_ARCHIVED_BEFORE, HISTORY_COLUMNS, history_query, needs_archive, page_args, stream_history,
+)
+from .instrumentation import COUNT_BUCKETS, record_query, registry
+from .routes import publish_transfer
+from .sessions import LocalStore, ServerSideSession, ServerSideSessionInterface, SQLStore
+from .stats import ACCOUNT_TOTALS, JOURNALED_ACCOUNT_TOTALS, spending_split
+from .transfers import (
+    MAX_ATTEMPTS, ROLLBACK, AccountNotFound, TransferError, deposit_amount, deposit_steps, retry_delay,
+    transfer_request, transfer_steps,
+)
+from .user_context import users
+from .versions import account_etag, version_query
+
+UNAUTHORIZED = {"success": False, "message": "Unauthorized"}, 401
+
+
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body has been read in full already, chunked or not
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _headers(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+def flash(session, message, category):
+    flashes = session.get("_flashes", [])
+    flashes.append((category, message))
+    session["_flashes"] = flashes
+
+
+class Call:
+    """One request to an async endpoint: its session, connection and query count."""
+
+    def __init__(self, api, request, session):
+        self.api = api
+        self.request = request
+        self.session = session
+        self.user = MISSING
+        self.queries = 0
+        self.conn = None
+
+    async def connection(self):
+        if self.conn is None:
+            self.conn = await self.api.acquire()
+        return self.conn
+
+    async def execute(self, cursor, sql, params=None):
+        started = time.perf_counter()
+        try:
+            if isinstance(params, list):
+                return await cursor.executemany(sql, params)
+            return await cursor.execute(sql, params)
+        finally:
+            self.queries += 1
+            if self.api.metrics:
+                record_query(sql, time.perf_counter() - started, cursor.rowcount)
+
+
+class AsyncAPI:
+    """ASGI entry point that serves the hot /api endpoints on asyncio.
+
+    The endpoints below keep the JSON contracts of their Flask views but talk
+    to MySQL through aiomysql, so one worker can keep hundreds of requests in
+    flight instead of one per thread. Sessions and flashes go through the
+    Flask app's session interface, so both sides share the login cookie.
+    /api/events streams are served here too, so an open tab holds no thread.
+    Server-side sessions are read and written without blocking the loop: the
+    sessions table through aiomysql, Redis on a thread.
+    Every other request, including the whole ``main`` blueprint, is handed to
+    the Flask app on one of ``ASYNC_WSGI_THREADS`` threads.
+    """
+
+    def __init__(self, app):
+        app.config.setdefault("ASYNC_MYSQL_POOL_MIN_SIZE", 5)
+        app.config.setdefault("ASYNC_MYSQL_POOL_MAX_SIZE", 50)
+        app.config.setdefault("ASYNC_WSGI_THREADS", app.config["MYSQL_POOL_MAX_SIZE"])
+
+        self.app = app
+        # Threads start on first use, so a preloading master forks none
+        self.executor = ThreadPoolExecutor(app.config["ASYNC_WSGI_THREADS"], thread_name_prefix="wsgi")
+        self.metrics = app.config["METRICS_ENABLED"]
+        self.routes = {
+            ("GET", "/api/dashboard"): ("api.api_dashboard", self.dashboard),
+            ("POST", "/api/deposit"): ("api.api_deposit", self.deposit),
+            ("GET", "/api/transactions"): ("api.api_transactions", self.history),
+            ("POST", "/api/transactions"): ("api.api_transactions", self.transfer),
+            ("GET", "/api/recipient_name"): ("api.api_recipient_name", self.recipient_name),
+            ("GET", "/api/balance"): ("api.api_balance_stats", self.balance),
+            ("GET", "/api/profile"): ("api.api_profile", self.profile),
+            ("GET", "/api/flash"): ("api.api_get_flash_messages", self.flash_messages),
+            ("GET", "/api/session_status"): ("api.api_session_status", self.session_status),
+        }
+        if app.config["JOURNAL_ENABLED"]:
+            # Journaled writes and their poster thread stay on the Flask side
+            del self.routes[("POST", "/api/deposit")]
+            del self.routes[("POST", "/api/transactions")]
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http":
+            if scope["method"] == "GET" and scope["path"] == "/api/events":
+                return await self.events(scope, receive, send)
+            route = self.routes.get((scope["method"], scope["path"]))
+            # Retry-safe writes go through the Flask views, which keep the idempotency store
+            if route is not None and not any(name == b"idempotency-key" for name, _ in scope["headers"]):
+                return await self._dispatch(*route, scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def wsgi(self, scope, receive, send):
+        """Runs the Flask app on ``self.executor`` and streams its response back.
+
+        Each request gets a thread of its own, so a long response such as an
+        export does not hold up the requests behind it.
+        """
+        environ = _environ(scope, await _read_body(receive))
+        loop = asyncio.get_running_loop()
+        gone = threading.Event()
+        watcher = asyncio.ensure_future(_disconnected(receive))
+        watcher.add_done_callback(lambda _: gone.set())
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            start = {}
+
+            def start_response(status, headers, exc_info=None):
+                start["status"] = int(status.split(" ", 1)[0])
+                start["headers"] = _headers(headers)
+
+            body = self.app(environ, start_response)
+            try:
+                sent = False
+                for chunk in body:
+                    if gone.is_set():
+                        return
+                    if not sent:
+                        emit({"type": "http.response.start", **start})
+                        sent = True
+                    if chunk:
+                        emit({"type": "http.response.body", "body": chunk, "more_body": True})
+                if not sent:
+                    emit({"type": "http.response.start", **start})
+                emit({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+
+        try:
+            await loop.run_in_executor(self.executor, contextvars.copy_context().run, run)
+        finally:
+            watcher.cancel()
+
+    async def events(self, scope, receive, send):
+        """Async twin of the /api/events view: waiting for events costs no thread."""
+        request = Request(_environ(scope, await _read_body(receive)))
+        interface = self.app.session_interface
+        user = None
+
+        with self.app.app_context():
+            session = interface.open_session(self.app, request)
+            call = Call(self, request, session)
+            try:
+                await self.load_session(call)
+                if "user" not in session:
+                    payload, status = UNAUTHORIZED
+                    response = Response(self.app.json.dumps(payload), status, mimetype="application/json")
+                else:
+                    user = session["user"]
+                    flashes = session.pop("_flashes") if "_flashes" in session else []
+                    pending = [{"message": message, "type": category} for category, message in flashes]
+                    initial = "retry: 5000\n\n" + (sse("flash", {"messages": pending}) if pending else "")
+                    response = Response(
+                        initial,
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                    )
+                await self.save_session(call, response)
+            except PoolTimeout:
+                user = None
+                payload = {"success": False, "message": "Server busy"}
+                response = Response(self.app.json.dumps(payload), 503, mimetype="application/json")
+            finally:
+                # The stream itself needs no connection
+                if call.conn is not None:
+                    await self.release(call.conn)
+            subscription = hub.subscribe(user, asyncio.get_running_loop()) if user is not None else None
+
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": _headers(response.headers.items())})
+        if subscription is None:
+            await send({"type": "http.response.body", "body": response.get_data()})
+            return
+
+        watcher = asyncio.ensure_future(_disconnected(receive))
+        try:
+            await send({"type": "http.response.body", "body": response.get_data(), "more_body": True})
+            while True:
+                getter = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait(
+                    (getter, watcher), timeout=HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                )
+                if watcher in done:
+                    getter.cancel()
+                    return
+                if getter in done:
+                    message = json.loads(getter.result())
+                    chunk = sse(message["event"], message["data"])
+                else:
+                    getter.cancel()
+                    chunk = ": keepalive\n\n"
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        finally:
+            watcher.cancel()
+            subscription.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.pool()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._pool is not None:
+                    self._pool.close()
+                    await self._pool.wait_closed()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def pool(self):
+        # Created inside the serving event loop, after any fork
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    config = self.app.config
+                    kwargs = {
+                        "host": config["MYSQL_HOST"],
+                        "port": config["MYSQL_PORT"],
+                        "user": config["MYSQL_USER"] or "",
+                        "password": config["MYSQL_PASSWORD"] or "",
+                        "charset": config["MYSQL_CHARSET"],
+                        "connect_timeout": config["MYSQL_CONNECT_TIMEOUT"],
+                        "autocommit": False,
+                        "minsize": config["ASYNC_MYSQL_POOL_MIN_SIZE"],
+                        "maxsize": config["ASYNC_MYSQL_POOL_MAX_SIZE"],
+                        "pool_recycle": config["MYSQL_POOL_MAX_LIFETIME"] or -1,
+                    }
+                    if config["MYSQL_DB"]:
+                        kwargs["db"] = config["MYSQL_DB"]
+                    if config["MYSQL_UNIX_SOCKET"]:
+                        kwargs["unix_socket"] = config["MYSQL_UNIX_SOCKET"]
+                    self._pool = await aiomysql.create_pool(**kwargs)
+        return self._pool
+
+    async def acquire(self):
+        pool = await self.pool()
+        timeout = self.app.config["MYSQL_POOL_TIMEOUT"]
+        try:
+            return await asyncio.wait_for(pool.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No database connection free after {timeout}s")
+
+    async def release(self, conn):
+        # Same rule as the sync pool: nothing uncommitted survives the request
+        try:
+            await conn.rollback()
+        except Exception:
+            conn.close()
+        self._pool.release(conn)
+
+    async def run_sync(self, func, *args):
+        """Runs a blocking helper (event publishing, cache invalidation) on a thread."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, func, *args)
+
+    async def _dispatch(self, endpoint, handler, scope, receive, send):
+        started = time.perf_counter()
+        request = Request(_environ(scope, await _read_body(receive)))
+        interface = self.app.session_interface
+
+        # Same ETags and 304s as the versions.conditional Flask views
+        conditional = scope["method"] == "GET" and getattr(self.app.view_functions[endpoint], "conditional", False)
+        etag = None
+
+        with self.app.app_context():
+            session = interface.open_session(self.app, request)
+            call = Call(self, request, session)
+            try:
+                try:
+                    await self.load_session(call)
+                    if conditional and "user" in session:
+                        etag = await self.current_etag(call, endpoint)
+                    if etag and request.if_none_match.contains_weak(etag):
+                        payload, status = "", 304
+                    else:
+                        payload, status = await handler(call)
+                except PoolTimeout:
+                    payload, status = {"success": False, "message": "Server busy"}, 503
+                except Exception:
+                    self.app.logger.exception("%s failed", endpoint)
+                    payload, status = {"success": False}, 500
+
+                await self._push_flashes(session)
+                body = payload if isinstance(payload, str) else self.app.json.dumps(payload)
+                response = Response(body, status, mimetype="application/json")
+                if etag and status in (200, 304):
+                    response.set_etag(etag, weak=True)
+                    response.headers["Cache-Control"] = "private, no-cache"
+                await self.save_session(call, response)
+            finally:
+                if call.conn is not None:
+                    await self.release(call.conn)
+
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": _headers(response.headers.items()),
+        })
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+        if self.metrics:
+            labels = (("endpoint", endpoint), ("method", scope["method"]))
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            registry.observe("http_request_queries", (("endpoint", endpoint),), call.queries, COUNT_BUCKETS)
+
+    async def load_session(self, call):
+        """Reads a server-side session up front, so touching it later never blocks the loop."""
+        session = call.session
+        if not isinstance(session, ServerSideSession) or session.sid is None:
+            return
+        try:
+            payload = await self.session_store(call, "load", session.sid)
+        except Exception:
+            # Carry on as logged out; an unmodified session is never written back
+            session.load(None)
+            raise
+        session.load(payload)
+
+    async def save_session(self, call, response):
+        interface = self.app.session_interface
+        if not isinstance(interface, ServerSideSessionInterface):
+            # Signed-cookie sessions need no I/O
+            interface.save_session(self.app, call.session, response)
+            return
+        for operation, *args in interface.changes(self.app, call.session, response):
+            await self.session_store(call, operation, *args)
+
+    async def session_store(self, call, operation, *args):
+        store = call.session.store
+        if isinstance(store, LocalStore):
+            return getattr(store, operation)(*args)
+        if not isinstance(store, SQLStore):
+            return await self.run_sync(getattr(store, operation), *args)
+
+        # SQLStore's statements, on this request's aiomysql connection
+        conn = await call.connection()
+        if operation != "load":
+            await conn.rollback()
+        async with conn.cursor() as cursor:
+            await call.execute(cursor, *store.statement(operation, *args))
+            row = await cursor.fetchone() if operation == "load" else None
+        if operation != "load":
+            await conn.commit()
+        return row[0] if row else None
+
+    async def _push_flashes(self, session):
+        # Same delivery as routes.push_flashes
+        flashes = session.get("_flashes") if "user" in session else None
+        if flashes:
+            messages = [{"message": message, "type": category} for category, message in flashes]
+            if await self.run_sync(hub.publish, session["user"], "flash", {"messages": messages}):
+                session.pop("_flashes", None)
+
+    async def current_user(self, call, *fields):
+        """Async twin of ``users.current``; shares its cross-request cache."""
+        email = call.session.get("user")
+        if email is None:
+            return None
+
+        if call.user is MISSING:
+            user = users.cached(email)
+            if user is MISSING:
+                conn = await call.connection()
+                async with conn.cursor() as cursor:
+                    await call.execute(cursor, users.query(), (email,))
+                    user = users.remember(email, await cursor.fetchone())
+            call.user = user
+            if user is not None and call.session.get("user_account_number") != user["account_number"]:
+                call.session["user_account_number"] = user["account_number"]
+        return call.user
+
+    async def session_account(self, call):
+        """Async twin of ``users.account_number``."""
+        if "user" in call.session and "user_account_number" in call.session:
+            return call.session["user_account_number"]
+        user = await self.current_user(call, "account_number")
+        return user["account_number"] if user else None
+
+    async def current_etag(self, call, endpoint):
+        account_number = await self.session_account(call)
+        if account_number is None:
+            return None
+        conn = await call.connection()
+        async with conn.cursor() as cursor:
+            await call.execute(cursor, version_query(), (account_number,))
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return account_etag(row[0], account_number, endpoint, call.request.query_string)
+
+    async def find_recipient(self, call, account_number):
+        value = recipients.get(account_number)
+        if value is MISSING:
+            conn = await call.connection()
+            async with conn.cursor() as cursor:
+                await call.execute(cursor, "SELECT name, email FROM users WHERE account_number = %s", (account_number,))
+                row = await cursor.fetchone()
+            value = {"name": row[0], "email": row[1]} if row else None
+            recipients.store(account_number, value)
+        return value
+
+    async def run_steps(self, call, make_steps, attempts=MAX_ATTEMPTS):
+        """Async twin of ``transfers.run_steps``, on the request's aiomysql connection."""
+        conn = await call.connection()
+        for attempt in range(1, attempts + 1):
+            try:
+                async with conn.cursor() as cursor:
+                    steps = make_steps()
+                    reply = None
+                    pending = False
+                    while True:
+                        try:
+                            step = steps.send(reply)
+                        except StopIteration as done:
+                            if pending:
+                                await conn.commit()
+                            return done.value
+                        if step is ROLLBACK:
+                            await conn.rollback()
+                            reply, pending = None, False
+                            continue
+                        pending = True
+                        await call.execute(cursor, *step)
+                        reply = cursor.rowcount, await cursor.fetchall()
+            except aiomysql.OperationalError as e:
+                await conn.rollback()
+                delay = retry_delay(e, attempt, attempts)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def dashboard(self, call):
+        if "user" not in call.session:
+            return UNAUTHORIZED
+
+        user = await self.current_user(call, "name", "balance")
+        if not user:
+            return {"success": False, "message": "User not found"}, 404
+
+        return {"success": True, "name": user["name"], "balance": float(user["balance"])}, 200
+
+    async def deposit(self, call):
+        session = call.session
+        if "user" not in session:
+            flash(session, "Unauthorized access.", "danger")
+            return {"success": False}, 401
+
+        data = call.request.get_json(silent=True) or {}
+
+        try:
+            amount = deposit_amount(data.get("amount"))
+            account_number = await self.session_account(call)
+
+            if not await self.run_steps(call, lambda: deposit_steps(account_number, amount)):
+                raise AccountNotFound("User not found.")
+
+            users.invalidate(session["user"])
+            await self.run_sync(hub.publish, session["user"], "balance", {"type": "deposit", "amount": amount})
+
+            flash(session, f"Successfully deposited ${amount:.2f}!", "success")
+            return {"success": True}, 200
+
+        except TransferError as e:
+            flash(session, str(e), "danger")
+            return {"success": False}, e.status
+        except PoolTimeout:
+            raise
+        except Exception as e:
+            flash(session, f"Error processing deposit: {str(e)}", "danger")
+            return {"success": False}, 500
+
+    async def history(self, call):
+        if "user" not in call.session:
+            return UNAUTHORIZED
+
+        user = await self.current_user(call, "account_number")
+        if not user:
+            flash(call.session, "User not found.", "danger")
+            return {"success": False}, 404
+        account_number = user["account_number"]
+
+        try:
+            limit, before = page_args(call.request.args)
+        except ValueError:
+            return {"success": False, "message": "Invalid cursor"}, 400
+
+        conn = await call.connection()
+        async with conn.cursor() as cursor:
+            await call.execute(cursor, *history_query(account_number, limit + 1, before))
+            rows = await cursor.fetchall()
+            if needs_archive(rows, limit + 1, HISTORY_COLUMNS, archived_before()):
+                # Same per-account check as history.iter_history
+                await call.execute(cursor, ACCOUNT_ARCHIVED_BEFORE, (account_number,))
+                horizon = await cursor.fetchone()
+                if needs_archive(rows, limit + 1, HISTORY_COLUMNS, horizon[0] if horizon else None):
+                    await call.execute(cursor, *history_query(account_number, limit + 1, before, archived=True))
+                    rows = await cursor.fetchall()
+
+        return "".join(stream_history(rows, limit, my_account=account_number)), 200
+
+    async def transfer(self, call):
+        session = call.session
+        if "user" not in session:
+            return UNAUTHORIZED
+
+        user = await self.current_user(call, "account_number", "transaction_pin")
+        if not user:
+            flash(session, "User not found.", "danger")
+            return {"success": False}, 404
+        account_number = user["account_number"]
+
+        data = call.request.get_json(silent=True) or {}
+
+        try:
+            recipient_account, amount = transfer_request(data, account_number, user["transaction_pin"])
+
+            recipient = await self.find_recipient(call, recipient_account)
+            if not recipient:
+                raise AccountNotFound()
+
+            await self.run_steps(call, lambda: transfer_steps(account_number, recipient_account, amount))
+            await self.run_sync(
+                publish_transfer, session["user"], recipient["email"], account_number, recipient_account, amount
+            )
+
+            flash(session, "Transaction successful!", "success")
+            return {"success": True}, 200
+
+        except TransferError as e:
+            flash(session, str(e), "danger")
+            return {"success": False}, e.status
+        except PoolTimeout:
+            raise
+        except Exception as e:
+            flash(session, f"A database error occurred: {str(e)}", "danger")
+            return {"success": False}, 500
+
+    async def recipient_name(self, call):
+        if "user" not in call.session:
+            return UNAUTHORIZED
+
+        account_number = call.request.args.get("account_number")
+        if not account_number:
+            return {"success": False, "message": "Account number is required"}, 400
+
+        result = await self.find_recipient(call, account_number)
+        if result:
+            return {"success": True, "name": result["name"]}, 200
+        return {"success": False, "message": "Account not found"}, 404
+
+    async def balance(self, call):
+        if "user" not in call.session:
+            return UNAUTHORIZED
+
+        user = await self.current_user(call, "account_number", "balance")
+        if not user:
+            return {"success": False, "message": "User not found"}, 404
+
+        conn = await call.connection()
+        async with conn.cursor() as cursor:
+            totals_query = JOURNALED_ACCOUNT_TOTALS if self.app.config["JOURNAL_ENABLED"] else ACCOUNT_TOTALS
+            await call.execute(cursor, totals_query, (user["account_number"],))
+            totals = await cursor.fetchone() or (0, 0)
+
+        total_deposit = float(totals[0])
+        total_withdrawal = float(totals[1])
+        spent_percent, saved_percent = spending_split(total_deposit, total_withdrawal)
+        return {
+            "success": True,
+            "balance": float(user["balance"]),
+            "total_deposit": total_deposit,
+            "total_withdrawal": total_withdrawal,
+            "spent_percent": spent_percent,
+            "saved_percent": saved_percent,
+        }, 200
+
+    async def profile(self, call):
+        if "user" not in call.session:
+            return UNAUTHORIZED
+
+        user = await self.current_user(call, "name", "email", "account_number", "balance", "profile_pic_url")
+        if not user:
+            return {"success": False, "message": "User not found"}, 404
+
+        size = call.request.args.get("size", type=int)
+
+        return {
+            "success": True,
+            "user": {
+                "name": user["name"],
+                "email": user["email"],
+                "account_number": user["account_number"],
+                "balance": float(user["balance"]),
+                "profile_pic_url": avatar_url(user["profile_pic_url"], size) or "/default-profile.png",
+            },
+        }, 200
+
+    async def flash_messages(self, call):
+        flashes = call.session.pop("_flashes") if "_flashes" in call.session else []
+        messages = [{"message": message, "type": category} for category, message in flashes]
+        return {"success": True, "messages": messages}, 200
+
+    async def session_status(self, call):
+        if "user" in call.session:
+            return {"logged_in": True}, 200
+        return {"logged_in": False}, 401
+
+
+def create_asgi_app():
+    """Factory for ASGI servers, e.g. ``uvicorn --factory app.asgi:create_asgi_app``."""
+    from . import create_app
+
+    return create_app(async_api=True).asgi_app
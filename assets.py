@@ -0,0 +1,191 @@
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import Response, abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+MANIFEST = "manifest.json"
+COMPRESSIBLE = {".js", ".mjs", ".jsx", ".css", ".html", ".svg", ".json", ".map", ".txt"}
+MIN_COMPRESS_SIZE = 1024
+
+# name.<hash>.ext from build-assets, or <content hash>-<size>.ext avatars
+HASHED_NAME = re.compile(r"(\.[0-9a-f]{10}\.[^.]+$|^[0-9a-f]{32}-\d+\.[^.]+$)")
+
+# Preferred first; each maps to the suffix of its precompressed file
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_manifest = {"mtime": None, "entries": {}}
+
+
+@functools.lru_cache(maxsize=4096)
+def _digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def file_etag(path, stat):
+    """Strong ETag from the file's SHA-256, recomputed only when size or mtime change."""
+    return _digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def pick_variant(path, accept_encoding):
+    """Returns ``(encoding, path)`` of the best precompressed copy the client accepts."""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return encoding, path + suffix
+    return None, path
+
+
+def serve_static(filename):
+    """Replaces Flask's static view with ETags, immutable caching and precompressed files.
+
+    Hashed names are cached for a year as immutable; anything else must be
+    revalidated, which costs a 304 at most. Files are sent by ``send_file``,
+    so If-Modified-Since and Range requests work as with Flask's own view.
+    With ``STATIC_SENDFILE`` set the response only names the file and the
+    front proxy sends the bytes.
+    """
+    config = current_app.config
+    folder = current_app.static_folder
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path) or filename.endswith((".br", ".gz")):
+        abort(404)
+
+    encoding, served = pick_variant(path, request.headers.get("Accept-Encoding", ""))
+    stat = os.stat(served)
+    etag = file_etag(served, stat)
+
+    headers = {
+        "ETag": f'"{etag}"',
+        "Vary": "Accept-Encoding",
+        "Cache-Control": (
+            f"public, max-age={config['STATIC_IMMUTABLE_MAX_AGE']}, immutable"
+            if HASHED_NAME.search(os.path.basename(filename)) else "no-cache"
+        ),
+    }
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    mode = config["STATIC_SENDFILE"]
+    if mode in ("x-accel-redirect", "x-sendfile"):
+        # The proxy answers Range requests itself
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if mode == "x-accel-redirect":
+            relative = os.path.relpath(served, folder).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = config["STATIC_ACCEL_PREFIX"].rstrip("/") + "/" + relative
+        else:
+            headers["X-Sendfile"] = served
+        return Response(mimetype=mimetype, headers=headers)
+
+    response = send_file(served, mimetype=mimetype, conditional=True, etag=etag, last_modified=stat.st_mtime)
+    response.headers.update(headers)
+    response.headers.pop("Expires", None)
+    if encoding and response.status_code != 304:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def manifest():
+    path = os.path.join(current_app.static_folder, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _manifest["mtime"] != mtime:
+        with open(path) as f:
+            _manifest["entries"] = json.load(f)
+        _manifest["mtime"] = mtime
+    return _manifest["entries"]
+
+
+def asset_url(name):
+    """URL of the hashed build of static file ``name``, or of ``name`` itself before a build."""
+    return url_for("static", filename=manifest().get(name, name))
+
+
+def build(source, destination):
+    """Copies every file in ``source`` to a content-hashed name with .gz/.br variants.
+
+    Returns the manifest, which maps each original relative path to its hashed one.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    entries = {}
+    for root, dirs, files in os.walk(source):
+        for name in files:
+            if name == MANIFEST or name.endswith((".br", ".gz")) or name.startswith("."):
+                continue
+            original = os.path.join(root, name)
+            relative = os.path.relpath(original, source).replace(os.sep, "/")
+            with open(original, "rb") as f:
+                data = f.read()
+
+            if HASHED_NAME.search(name):
+                # Already content-addressed (avatars, earlier builds): only compress
+                hashed = relative
+            else:
+                stem, ext = os.path.splitext(relative)
+                hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+                entries[relative] = hashed
+            target = os.path.join(destination, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                with open(target, "wb") as f:
+                    f.write(data)
+
+            if os.path.splitext(name)[1] in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+                if not os.path.exists(target + ".gz"):
+                    with open(target + ".gz", "wb") as f:
+                        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None and not os.path.exists(target + ".br"):
+                    with open(target + ".br", "wb") as f:
+                        f.write(brotli.compress(data, quality=11))
+
+    with open(os.path.join(destination, MANIFEST), "w") as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    return entries
+
+
+def init_app(app):
+    # None (bytes go through the worker), "x-sendfile" (Apache, lighttpd) or
+    # "x-accel-redirect" (nginx, with an internal location at STATIC_ACCEL_PREFIX)
+    app.config.setdefault("STATIC_SENDFILE", None)
+    app.config.setdefault("STATIC_ACCEL_PREFIX", "/_static/")
+    app.config.setdefault("STATIC_IMMUTABLE_MAX_AGE", 365 * 24 * 3600)
+
+    if app.static_folder:
+        app.view_functions["static"] = serve_static
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    @app.cli.command("build-assets")
+    @click.option("--source", default=None, help="Build output to publish (default: the static folder).")
+    def build_assets_command(source):
+        """Write content-hashed, precompressed copies of the static files."""
+        destination = current_app.static_folder
+        entries = build(source or destination, destination)
+        click.echo(f"Published {len(entries)} files; manifest at {os.path.join(destination, MANIFEST)}.")
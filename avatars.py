@@ -0,0 +1,215 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from PIL import Image, ImageOps, features
+
+from .db import db
+from .events import hub
+from .user_context import users
+
+CHUNK_SIZE = 64 * 1024
+IMAGE_FORMATS = {"PNG", "JPEG", "GIF"}
+
+# Matches the URLs avatar_url() hands out: <prefix>/<content hash>-<size>.<ext>
+AVATAR_URL = re.compile(r"^(?P<prefix>.*/)(?P<digest>[0-9a-f]{32})-(?P<size>\d+)\.(?P<ext>webp|jpg)$")
+
+# Uploads used to store absolute URLs pointing at the development server
+LEGACY_ORIGIN = "http://localhost:5000/"
+
+
+class Upload:
+    __slots__ = ("path", "digest")
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.digest = digest
+
+
+def receive(stream, directory, max_size):
+    """Copies an uploaded file to a temp file in ``directory`` chunk by chunk.
+
+    Returns an ``Upload`` carrying the SHA-256 based content hash. Raises
+    ValueError if the file is over ``max_size`` bytes or is not an image.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f"File too large (max {max_size // (1024 * 1024)}MB)")
+                digest.update(chunk)
+                f.write(chunk)
+
+        # Only reads the header; the full decode happens on the worker pool
+        try:
+            with Image.open(path) as image:
+                if image.format not in IMAGE_FORMATS:
+                    raise ValueError("Invalid image file")
+        except (OSError, Image.DecompressionBombError):
+            raise ValueError("Invalid image file")
+    except Exception:
+        os.remove(path)
+        raise
+    return Upload(path, digest.hexdigest()[:32])
+
+
+def make_thumbnails(source, directory, digest, sizes, image_format):
+    """Decodes ``source`` once and writes a square thumbnail per size; returns the paths."""
+    ext = "webp" if image_format == "WEBP" else "jpg"
+    paths = []
+    with Image.open(source) as image:
+        # Lets the JPEG decoder downscale while decoding instead of afterwards
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for size in sorted(sizes, reverse=True):
+            path = os.path.join(directory, f"{digest}-{size}.{ext}")
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            partial = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            thumbnail.save(partial, image_format, quality=82)
+            os.replace(partial, path)
+            paths.append(path)
+    return paths
+
+
+class AvatarProcessor:
+    """Turns uploaded profile pictures into small content-addressed thumbnails.
+
+    The request thread only streams the upload to disk and hashes it. Decoding,
+    resizing and encoding run on a pool of ``AVATAR_WORKERS`` threads (Pillow
+    releases the GIL while it does so), which then points the user at the new
+    files. Identical uploads share their files, and since a file name never
+    changes content the URLs can be cached forever.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("AVATAR_FOLDER", os.path.abspath(os.path.join(app.root_path, "..", "static", "avatars")))
+        app.config.setdefault("AVATAR_URL_PATH", "/static/avatars")
+        app.config.setdefault("AVATAR_SIZES", (64, 256))
+        app.config.setdefault("AVATAR_FORMAT", "WEBP" if features.check("webp") else "JPEG")
+        app.config.setdefault("AVATAR_WORKERS", 2)
+        app.extensions["avatars"] = {"executor": None, "pid": None}
+
+        @app.cli.command("prune-avatars")
+        @click.option("--min-age", default=3600, help="Keep files younger than this many seconds.")
+        def prune_avatars_command(min_age):
+            """Delete avatar files that no user points at any more."""
+            removed = prune(db.connection, current_app.config["AVATAR_FOLDER"], min_age)
+            click.echo(f"Removed {removed} unused avatar files.")
+
+    def _executor(self):
+        state = current_app.extensions["avatars"]
+        if state["executor"] is None or state["pid"] != os.getpid():
+            with self._lock:
+                if state["executor"] is None or state["pid"] != os.getpid():
+                    state["executor"] = ThreadPoolExecutor(
+                        max_workers=current_app.config["AVATAR_WORKERS"], thread_name_prefix="avatar"
+                    )
+                    state["pid"] = os.getpid()
+        return state["executor"]
+
+    def url(self, digest, size):
+        config = current_app.config
+        ext = "webp" if config["AVATAR_FORMAT"] == "WEBP" else "jpg"
+        return f"{config['AVATAR_URL_PATH']}/{digest}-{size}.{ext}"
+
+    def submit(self, upload, email, old_url):
+        """Schedules ``upload`` for ``email``; returns ``(url, ready)``.
+
+        ``ready`` is True when the same image was processed before and the
+        user already points at it, so there is nothing left to wait for.
+        """
+        config = current_app.config
+        url = self.url(upload.digest, max(config["AVATAR_SIZES"]))
+        done = all(
+            os.path.exists(os.path.join(config["AVATAR_FOLDER"], os.path.basename(self.url(upload.digest, size))))
+            for size in config["AVATAR_SIZES"]
+        )
+        if done:
+            os.remove(upload.path)
+            set_picture(email, url, old_url)
+            return url, True
+
+        self._executor().submit(self._process, current_app._get_current_object(), upload, email, url, old_url)
+        return url, False
+
+    def _process(self, app, upload, email, url, old_url):
+        config = app.config
+        try:
+            make_thumbnails(upload.path, config["AVATAR_FOLDER"], upload.digest,
+                            config["AVATAR_SIZES"], config["AVATAR_FORMAT"])
+            with app.app_context():
+                set_picture(email, url, old_url)
+                hub.publish(email, "profile", {"profile_pic_url": url})
+        except Exception:
+            app.logger.exception("processing avatar %s for %s failed", upload.digest, email)
+        finally:
+            try:
+                os.remove(upload.path)
+            except OSError:
+                pass
+
+
+def set_picture(email, url, old_url):
+    cursor = db.cursor()
+    cursor.execute("UPDATE users SET profile_pic_url = %s, version = version + 1 WHERE email = %s", (url, email))
+    db.connection.commit()
+    cursor.close()
+    users.invalidate(email)
+
+    # Pictures from before content hashing were one file per upload
+    if old_url and "/profile_pics/" in old_url:
+        legacy = os.path.join(current_app.config["AVATAR_FOLDER"], "..", "profile_pics", os.path.basename(old_url))
+        try:
+            os.remove(legacy)
+        except OSError:
+            pass
+
+
+def avatar_url(stored, size=None):
+    """Returns the URL of the smallest thumbnail at least ``size`` px wide, or ``stored`` as is."""
+    if stored and stored.startswith(LEGACY_ORIGIN):
+        stored = stored[len(LEGACY_ORIGIN) - 1:]
+    match = AVATAR_URL.match(stored or "")
+    if not match or not size:
+        return stored
+    sizes = sorted(current_app.config["AVATAR_SIZES"])
+    chosen = next((s for s in sizes if s >= size), sizes[-1])
+    return f"{match['prefix']}{match['digest']}-{chosen}.{match['ext']}"
+
+
+def prune(connection, directory, min_age):
+    cursor = connection.cursor()
+    cursor.execute("SELECT profile_pic_url FROM users WHERE profile_pic_url IS NOT NULL")
+    in_use = {match["digest"] for (url,) in cursor.fetchall() if (match := AVATAR_URL.match(url))}
+    cursor.close()
+
+    removed = 0
+    cutoff = time.time() - min_age
+    for entry in os.scandir(directory) if os.path.isdir(directory) else ():
+        if entry.name[:32] in in_use or entry.stat().st_mtime > cutoff:
+            continue
+        os.remove(entry.path)
+        removed += 1
+    return removed
+
+
+avatars = AvatarProcessor()
@@ -0,0 +1,339 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+
+from . import analytics
+from .instrumentation import registry
+from .passwords import make_hash
+
+BENCH_PASSWORD = "bench-password"
+BENCH_PIN = "0000"
+OPENING_BALANCE = 1000000
+SEED_CHUNK_SIZE = 1000
+
+# Operation -> (weight, endpoint name used by the /metrics query histogram)
+DEFAULT_MIX = {
+    "login": (5, "api.api_login"),
+    "dashboard": (25, "api.api_dashboard"),
+    "balance": (20, "api.api_balance_stats"),
+    "history": (25, "api.api_transactions"),
+    "transfer": (10, "api.api_transactions"),
+    "flash": (15, "api.api_get_flash_messages"),
+}
+
+
+def seed(connection, users, transactions, password_hash):
+    """Creates ``users`` throwaway accounts with ``transactions`` deposits each.
+
+    Returns ``(prefix, account_numbers)``; ``cleanup(connection, prefix)``
+    removes them again. Each account gets enough balance that benchmark
+    transfers never run out.
+    """
+    prefix = "BN" + uuid.uuid4().hex[:6]
+    numbers = [f"{prefix}{i:06d}" for i in range(users)]
+    now = datetime.now().replace(microsecond=0)
+
+    cursor = connection.cursor()
+    try:
+        for start in range(0, users, SEED_CHUNK_SIZE):
+            chunk = numbers[start:start + SEED_CHUNK_SIZE]
+            cursor.executemany("""
+                INSERT INTO users (name, account_number, transaction_pin, email, password_hash, balance)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, [(f"Bench {n}", n, BENCH_PIN, f"{n.lower()}@bench.invalid", password_hash, OPENING_BALANCE)
+                  for n in chunk])
+
+            ledger = []
+            totals = []
+            for number in chunk:
+                amounts = [round(random.uniform(1, 500), 2) for _ in range(transactions)]
+                ledger.extend(
+                    (number, amount, now - timedelta(minutes=random.randint(0, 60 * 24 * 365)))
+                    for amount in amounts
+                )
+                totals.append((number, sum(amounts)))
+            for offset in range(0, len(ledger), SEED_CHUNK_SIZE):
+                cursor.executemany("""
+                    INSERT INTO transactions (account_number, amount, type, created_at)
+                    VALUES (%s, %s, 'deposit', %s)
+                """, ledger[offset:offset + SEED_CHUNK_SIZE])
+                analytics.record(cursor, [(number, None, amount, "deposit", created_at)
+                                          for number, amount, created_at in ledger[offset:offset + SEED_CHUNK_SIZE]])
+            cursor.executemany(
+                "INSERT INTO account_stats (account_number, total_deposit, total_withdrawal) VALUES (%s, %s, 0)",
+                totals,
+            )
+            connection.commit()
+        return prefix, numbers
+    except Exception:
+        connection.rollback()
+        cleanup(connection, prefix)
+        raise
+    finally:
+        cursor.close()
+
+
+def cleanup(connection, prefix):
+    pattern = prefix + "%"
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM transactions WHERE account_number LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM transactions_archive WHERE account_number LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM account_stats WHERE account_number LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM rollup_deltas WHERE account_number LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM daily_rollups WHERE account_number LIKE %s", (pattern,))
+        # Entries still pending would otherwise be posted against accounts that are gone
+        cursor.execute("DELETE FROM ledger_journal WHERE account_number LIKE %s OR recipient_account LIKE %s",
+                       (pattern, pattern))
+        # Sessions of the workers' logins; the emails are the account numbers in lower case
+        cursor.execute("DELETE FROM sessions WHERE data LIKE %s", (f'%"user":"{prefix.lower()}%',))
+        cursor.execute("DELETE FROM users WHERE account_number LIKE %s", (pattern,))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Worker(threading.Thread):
+    """Logs in as one seeded account and issues weighted random requests until told to stop."""
+
+    def __init__(self, app, number, accounts, mix, deadline, budget):
+        super().__init__(daemon=True)
+        self.client = app.test_client()
+        self.number = number
+        self.accounts = accounts
+        self.ops = list(mix)
+        self.weights = [mix[op][0] for op in self.ops]
+        self.deadline = deadline
+        self.budget = budget
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def run(self):
+        self.call("login")
+        while time.monotonic() < self.deadline and self.budget.take():
+            self.call(random.choices(self.ops, self.weights)[0])
+
+    def call(self, op):
+        started = time.perf_counter()
+        response = getattr(self, op)()
+        response.get_data()
+        response.close()
+        self.latencies[op].append(time.perf_counter() - started)
+        if response.status_code >= 500 or (op != "transfer" and response.status_code >= 400):
+            self.errors[op] += 1
+
+    def login(self):
+        return self.client.post("/api/login", json={
+            "email": f"{self.number.lower()}@bench.invalid", "password": BENCH_PASSWORD,
+        })
+
+    def dashboard(self):
+        return self.client.get("/api/dashboard")
+
+    def balance(self):
+        return self.client.get("/api/balance")
+
+    def history(self):
+        return self.client.get("/api/transactions?limit=50")
+
+    def transfer(self):
+        recipient = random.choice(self.accounts)
+        while recipient == self.number and len(self.accounts) > 1:
+            recipient = random.choice(self.accounts)
+        return self.client.post("/api/transactions", json={
+            "recipient_account": recipient,
+            "amount": round(random.uniform(0.01, 5), 2),
+            "transaction_pin": BENCH_PIN,
+        })
+
+    def flash(self):
+        return self.client.get("/api/flash")
+
+
+class Budget:
+    """Shared countdown of requests left; ``None`` means run until the deadline."""
+
+    def __init__(self, total):
+        self.left = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.left is None:
+            return True
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def run(app, accounts, mix=DEFAULT_MIX, concurrency=8, duration=30.0, requests=None):
+    """Drives ``app`` in process with ``concurrency`` logged-in clients and returns a report.
+
+    Requests go through the full WSGI stack and the real database, so the
+    query counts from the instrumentation hooks are included per operation.
+    """
+    before = registry.totals("http_request_queries")
+    budget = Budget(requests)
+    deadline = time.monotonic() + duration
+    workers = [
+        Worker(app, accounts[i % len(accounts)], accounts, mix, deadline, budget)
+        for i in range(concurrency)
+    ]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+    after = registry.totals("http_request_queries")
+
+    def queries_per_request(endpoint):
+        labels = (("endpoint", endpoint),)
+        total, count = after.get(labels, (0.0, 0))
+        old_total, old_count = before.get(labels, (0.0, 0))
+        return round((total - old_total) / (count - old_count), 2) if count > old_count else None
+
+    ops = {}
+    for op in mix:
+        samples = sorted(value for worker in workers for value in worker.latencies[op])
+        ops[op] = {
+            "count": len(samples),
+            "errors": sum(worker.errors[op] for worker in workers),
+            "p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "p99": percentile(samples, 0.99),
+            "requests_per_second": len(samples) / elapsed if elapsed else 0.0,
+            # history and transfer share one endpoint, so this is their combined mean
+            "queries_per_request": queries_per_request(mix[op][1]),
+        }
+    total = sum(op["count"] for op in ops.values())
+    return {
+        "settings": {"concurrency": concurrency, "mix": {op: mix[op][0] for op in mix}},
+        "requests": total,
+        "seconds": elapsed,
+        "requests_per_second": total / elapsed if elapsed else 0.0,
+        "ops": ops,
+    }
+
+
+def compare(baseline, report, tolerance):
+    """Returns the ways ``report`` is worse than ``baseline``; an empty list means no regression."""
+    problems = []
+    if baseline["settings"] != report["settings"]:
+        problems.append(f"settings differ from the baseline: {baseline['settings']}")
+        return problems
+
+    if report["requests_per_second"] < baseline["requests_per_second"] * (1 - tolerance):
+        problems.append(
+            f"throughput fell from {baseline['requests_per_second']:.1f} "
+            f"to {report['requests_per_second']:.1f} req/s"
+        )
+    for op, old in baseline["ops"].items():
+        new = report["ops"].get(op)
+        if not new or not new["count"]:
+            continue
+        for key in ("p95", "p99"):
+            if old[key] and new[key] > old[key] * (1 + tolerance):
+                problems.append(f"{op} {key} rose from {old[key] * 1000:.1f} to {new[key] * 1000:.1f} ms")
+        # Query counts are deterministic, so any increase is a real regression
+        if old["queries_per_request"] is not None and new["queries_per_request"] is not None \
+                and new["queries_per_request"] > old["queries_per_request"] + 0.05:
+            problems.append(
+                f"{op} went from {old['queries_per_request']} to {new['queries_per_request']} queries per request"
+            )
+        if new["errors"] > old["errors"]:
+            problems.append(f"{op} had {new['errors']} errors, baseline {old['errors']}")
+    return problems
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in DEFAULT_MIX:
+            raise click.BadParameter(f"unknown operation {op!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[op] = (int(weight or DEFAULT_MIX[op][0]), DEFAULT_MIX[op][1])
+    return mix
+
+
+def init_app(app, db):
+    app.config.setdefault("BENCH_BASELINE", os.path.join(app.root_path, "bench-baseline.json"))
+
+    @app.cli.command("bench")
+    @click.option("--users", default=200, type=click.IntRange(min=2), help="Throwaway accounts to seed.")
+    @click.option("--transactions", default=50, help="Ledger rows seeded per account.")
+    @click.option("--concurrency", default=8, help="Logged-in clients issuing requests at once.")
+    @click.option("--duration", default=30.0, help="Seconds to run for.")
+    @click.option("--requests", "request_count", default=None, type=int,
+                  help="Stop after this many requests instead of at the deadline.")
+    @click.option("--mix", default=None, help="Weights such as dashboard=25,history=25,transfer=10.")
+    @click.option("--baseline", default=None, help="Baseline JSON file (default: BENCH_BASELINE).")
+    @click.option("--save-baseline", is_flag=True, help="Store this run as the new baseline.")
+    @click.option("--compare", "check", is_flag=True, help="Fail if this run regresses against the baseline.")
+    @click.option("--tolerance", default=0.2, help="Allowed slowdown before --compare fails, as a fraction.")
+    @click.option("--output", default=None, help="Also write the report to this JSON file.")
+    def bench_command(users, transactions, concurrency, duration, request_count, mix, baseline,
+                      save_baseline, check, tolerance, output):
+        """Seed throwaway accounts and load-test the /api endpoints."""
+        config = current_app.config
+        baseline = baseline or config["BENCH_BASELINE"]
+        mix = parse_mix(mix) if mix else DEFAULT_MIX
+        if not config["METRICS_ENABLED"]:
+            click.echo("METRICS_ENABLED is off, so queries per request are not reported.", err=True)
+
+        password_hash = make_hash(
+            BENCH_PASSWORD, config["PASSWORD_SCRYPT_N"], config["PASSWORD_SCRYPT_R"], config["PASSWORD_SCRYPT_P"]
+        )
+        click.echo(f"Seeding {users} accounts with {transactions} transactions each...")
+        prefix, accounts = seed(db.connection, users, transactions, password_hash)
+        try:
+            report = run(current_app._get_current_object(), accounts, mix, concurrency, duration, request_count)
+        finally:
+            cleanup(db.connection, prefix)
+
+        click.echo(f"{report['requests']} requests in {report['seconds']:.1f}s, "
+                   f"{report['requests_per_second']:.1f} req/s at concurrency {concurrency}")
+        click.echo(f"{'operation':<10} {'count':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for op, stats in report["ops"].items():
+            queries = "-" if stats["queries_per_request"] is None else f"{stats['queries_per_request']:.2f}"
+            click.echo(
+                f"{op:<10} {stats['count']:>7} {stats['errors']:>6} {stats['p50'] * 1000:>8.1f} "
+                f"{stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f} {queries:>8}"
+            )
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
+
+        if check:
+            if not os.path.exists(baseline):
+                raise click.ClickException(f"No baseline at {baseline}; run with --save-baseline first")
+            with open(baseline) as f:
+                problems = compare(json.load(f), report, tolerance)
+            for problem in problems:
+                click.echo(problem, err=True)
+            if problems:
+                raise click.ClickException(f"{len(problems)} regressions against {baseline}")
+            click.echo(f"No regressions against {baseline}.")
+
+        if save_baseline:
+            with open(baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            click.echo(f"Saved baseline to {baseline}.")
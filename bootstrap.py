@@ -0,0 +1,42 @@
+BOOTSTRAP_LIMIT = 10
+
+# Every section /api/bootstrap can return, with the fields it is made of
+SECTIONS = {
+    "session": ("logged_in",),
+    "profile": ("name", "email", "account_number", "balance", "profile_pic_url"),
+    "balance": (),
+    "stats": ("total_deposit", "total_withdrawal", "spent_percent", "saved_percent"),
+    "transactions": ("items", "next_cursor"),
+    "flashes": (),
+}
+
+# Sections that only make sense for a logged-in user
+USER_SECTIONS = ("profile", "balance", "stats", "transactions")
+
+
+def parse_fields(text):
+    """Turns ``fields=profile.name,stats,flashes`` into ``{section: fields}``. Raises ValueError.
+
+    A bare section selects all of its fields; ``section.field`` selects one.
+    An empty or missing value selects everything.
+    """
+    if not text:
+        return {section: set(fields) for section, fields in SECTIONS.items()}
+
+    wanted = {}
+    for item in text.split(","):
+        section, _, field = item.strip().partition(".")
+        if section not in SECTIONS:
+            raise ValueError(f"Unknown section: {section}")
+        if not field:
+            wanted[section] = set(SECTIONS[section])
+        elif field in SECTIONS[section]:
+            wanted.setdefault(section, set()).add(field)
+        else:
+            raise ValueError(f"Unknown field: {section}.{field}")
+    return wanted
+
+
+def pick(values, fields):
+    """Only the selected ``fields`` of a section's ``values``."""
+    return {key: value for key, value in values.items() if key in fields}
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app
+
+MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe LRU cache whose entries also expire after their own TTL."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """Keeps entries in Redis so every worker shares them, and their invalidations."""
+
+    def __init__(self, url, prefix):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self._prefix + key)
+        return MISSING if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._redis.set(self._prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self._redis.delete(self._prefix + key)
+
+
+class RecipientCache:
+    """Caches ``account_number -> {"name", "email"}`` lookups, including misses.
+
+    Unknown accounts are cached as ``None`` for a shorter TTL, so someone typing
+    account numbers into the transfer form does not hit MySQL on every blur.
+    Registration and deletion must call ``invalidate``. With the local backend
+    that only reaches the current process; other workers catch up once the
+    entry expires, which is why the negative TTL is kept short.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RECIPIENT_CACHE_BACKEND", "local")
+        app.config.setdefault("RECIPIENT_CACHE_SIZE", 10000)
+        app.config.setdefault("RECIPIENT_CACHE_TTL", 300)
+        app.config.setdefault("RECIPIENT_CACHE_NEGATIVE_TTL", 30)
+
+        setting = app.config["RECIPIENT_CACHE_BACKEND"]
+        if setting == "local":
+            backend = LRUCache(app.config["RECIPIENT_CACHE_SIZE"])
+        elif setting.startswith(("redis://", "rediss://", "unix://")):
+            backend = RedisCache(setting, "recipient:")
+        else:
+            raise ValueError(f"Unknown RECIPIENT_CACHE_BACKEND: {setting}")
+        app.extensions["recipient_cache"] = {"backend": backend, "stats": Counter()}
+
+    @property
+    def _state(self):
+        return current_app.extensions["recipient_cache"]
+
+    def lookup(self, account_number, loader):
+        """Returns the cached entry for ``account_number``, calling ``loader`` on a miss."""
+        value = self.get(account_number)
+        if value is MISSING:
+            value = loader(account_number)
+            self.store(account_number, value)
+        return value
+
+    def get(self, account_number):
+        """Returns the cached entry, or ``MISSING``; for callers that load asynchronously."""
+        state = self._state
+        value = state["backend"].get(account_number)
+        if value is MISSING:
+            state["stats"]["misses"] += 1
+        else:
+            state["stats"]["hits" if value is not None else "negative_hits"] += 1
+        return value
+
+    def store(self, account_number, value):
+        ttl = current_app.config["RECIPIENT_CACHE_TTL" if value is not None else "RECIPIENT_CACHE_NEGATIVE_TTL"]
+        self._state["backend"].set(account_number, value, ttl)
+
+    def invalidate(self, account_number):
+        state = self._state
+        state["backend"].delete(account_number)
+        state["stats"]["invalidations"] += 1
+
+    def metrics(self):
+        state = self._state
+        counts = state["stats"]
+        lookups = counts["hits"] + counts["negative_hits"] + counts["misses"]
+        metrics = {
+            "hits": counts["hits"],
+            "negative_hits": counts["negative_hits"],
+            "misses": counts["misses"],
+            "invalidations": counts["invalidations"],
+            "hit_ratio": (counts["hits"] + counts["negative_hits"]) / lookups if lookups else 0.0,
+        }
+        if isinstance(state["backend"], LRUCache):
+            metrics["size"] = len(state["backend"])
+        return metrics
+
+
+recipients = RecipientCache()
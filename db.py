@@ -0,0 +1,269 @@
+import collections
+import os
+import threading
+import time
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import current_app, g
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of MySQLdb connections.
+
+    Connections older than ``max_lifetime`` seconds are closed and replaced on
+    their way in or out, and an idle connection is pinged before it is handed
+    out again if it has been sitting for longer than ``ping_interval``.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, max_lifetime=1800,
+                 timeout=5.0, ping_interval=5.0):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.pid = os.getpid()
+
+        self._idle = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = collections.Counter()
+        self._wait_max = 0.0
+
+    def fill(self):
+        """Opens connections until the pool holds ``min_size`` of them."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._new_entry()
+            except Exception:
+                self._forget()
+                raise
+            self.release(entry)
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._stats["wait_time"] += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        try:
+            if entry is None:
+                return self._new_entry()
+            if self._expired(entry):
+                self._stats["recycled"] += 1
+                self._close(entry)
+                return self._new_entry()
+            if time.monotonic() - entry.last_used > self.ping_interval:
+                try:
+                    entry.conn.ping()
+                except MySQLdb.Error:
+                    self._stats["failed_health_checks"] += 1
+                    self._close(entry)
+                    return self._new_entry()
+            return entry
+        except Exception:
+            self._forget()
+            raise
+
+    def release(self, entry, discard=False):
+        if discard or self._expired(entry):
+            if not discard:
+                self._stats["recycled"] += 1
+            self._close(entry)
+            self._forget()
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop())
+                self._size -= 1
+
+    def metrics(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                "checkouts": checkouts,
+                "created": self._stats["created"],
+                "recycled": self._stats["recycled"],
+                "failed_health_checks": self._stats["failed_health_checks"],
+                "timeouts": self._stats["timeouts"],
+                "wait_time_total": self._stats["wait_time"],
+                "wait_time_avg": self._stats["wait_time"] / checkouts if checkouts else 0.0,
+                "wait_time_max": self._wait_max,
+            }
+
+    def _new_entry(self):
+        entry = _Entry(self._connect())
+        with self._cond:
+            self._stats["created"] += 1
+        return entry
+
+    def _expired(self, entry):
+        return self.max_lifetime and time.monotonic() - entry.created_at > self.max_lifetime
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+class Database:
+    """Hands each app context one pooled connection and returns it on teardown.
+
+    ``db.connection`` and ``db.cursor()`` are drop-in replacements for the
+    ``mysql.connection`` API of flask_mysqldb. Anything left uncommitted when
+    the context ends is rolled back before the connection goes back to the pool.
+    """
+
+    def __init__(self, app=None):
+        self._pool_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MYSQL_HOST", "localhost")
+        app.config.setdefault("MYSQL_USER", None)
+        app.config.setdefault("MYSQL_PASSWORD", None)
+        app.config.setdefault("MYSQL_DB", None)
+        app.config.setdefault("MYSQL_PORT", 3306)
+        app.config.setdefault("MYSQL_UNIX_SOCKET", None)
+        app.config.setdefault("MYSQL_CONNECT_TIMEOUT", 10)
+        app.config.setdefault("MYSQL_CHARSET", "utf8mb4")
+        app.config.setdefault("MYSQL_CURSORCLASS", None)
+        app.config.setdefault("MYSQL_SS_CURSORCLASS", None)
+        app.config.setdefault("MYSQL_POOL_MIN_SIZE", 1)
+        app.config.setdefault("MYSQL_POOL_MAX_SIZE", 10)
+        app.config.setdefault("MYSQL_POOL_MAX_LIFETIME", 1800)
+        app.config.setdefault("MYSQL_POOL_TIMEOUT", 5.0)
+        app.config.setdefault("MYSQL_POOL_PING_INTERVAL", 5.0)
+
+        app.extensions["db_pool"] = None
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def pool(self):
+        # A pool inherited through fork() shares sockets with the parent, so a
+        # worker process always builds its own instead of touching those.
+        pool = current_app.extensions["db_pool"]
+        if pool is None or pool.pid != os.getpid():
+            with self._pool_lock:
+                pool = current_app.extensions["db_pool"]
+                if pool is None or pool.pid != os.getpid():
+                    pool = self.create_pool(current_app.config)
+                    current_app.extensions["db_pool"] = pool
+        return pool
+
+    def create_pool(self, config):
+        kwargs = {
+            "host": config["MYSQL_HOST"],
+            "port": config["MYSQL_PORT"],
+            "connect_timeout": config["MYSQL_CONNECT_TIMEOUT"],
+            "charset": config["MYSQL_CHARSET"],
+        }
+        if config["MYSQL_USER"]:
+            kwargs["user"] = config["MYSQL_USER"]
+        if config["MYSQL_PASSWORD"]:
+            kwargs["passwd"] = config["MYSQL_PASSWORD"]
+        if config["MYSQL_DB"]:
+            kwargs["db"] = config["MYSQL_DB"]
+        if config["MYSQL_UNIX_SOCKET"]:
+            kwargs["unix_socket"] = config["MYSQL_UNIX_SOCKET"]
+        if config["MYSQL_CURSORCLASS"]:
+            kwargs["cursorclass"] = config["MYSQL_CURSORCLASS"]
+
+        pool = ConnectionPool(
+            lambda: MySQLdb.connect(**kwargs),
+            min_size=config["MYSQL_POOL_MIN_SIZE"],
+            max_size=config["MYSQL_POOL_MAX_SIZE"],
+            max_lifetime=config["MYSQL_POOL_MAX_LIFETIME"],
+            timeout=config["MYSQL_POOL_TIMEOUT"],
+            ping_interval=config["MYSQL_POOL_PING_INTERVAL"],
+        )
+        pool.fill()
+        return pool
+
+    @property
+    def connection(self):
+        entry = g.get("_db_entry")
+        if entry is None:
+            entry = self.pool.acquire()
+            g._db_entry = entry
+        return entry.conn
+
+    def cursor(self):
+        return self.connection.cursor()
+
+    def streaming_cursor(self, connection=None):
+        """An unbuffered cursor: rows stay on the server until fetched, and the
+        connection can run nothing else until the last one has been read."""
+        cursorclass = current_app.config["MYSQL_SS_CURSORCLASS"] or MySQLdb.cursors.SSCursor
+        return (connection or self.connection).cursor(cursorclass)
+
+    def metrics(self):
+        return self.pool.metrics()
+
+    def teardown(self, exc):
+        entry = g.pop("_db_entry", None)
+        if entry is None:
+            return
+        pool = current_app.extensions["db_pool"]
+        try:
+            entry.conn.rollback()
+        except MySQLdb.Error:
+            pool.release(entry, discard=True)
+            return
+        pool.release(entry)
+
+
+db = Database()
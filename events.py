@@ -0,0 +1,229 @@
+import asyncio
+import json
+import queue
+import threading
+from collections import defaultdict
+
+from flask import current_app
+
+HEARTBEAT_INTERVAL = 15
+
+
+class Subscription:
+    def __init__(self, backend, channel):
+        self._backend = backend
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def put(self, payload):
+        self.queue.put(payload)
+
+    def get(self, timeout=None):
+        """Returns the next payload, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._backend.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """A subscription read by a coroutine on ``loop``; payloads may arrive from any thread."""
+
+    def __init__(self, backend, channel, loop):
+        self._backend = backend
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, payload):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, payload)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def subscription(backend, channel, loop=None):
+    return Subscription(backend, channel) if loop is None else AsyncSubscription(backend, channel, loop)
+
+
+class LocalBackend:
+    """Delivers events to subscribers in this process only.
+
+    Good enough for a single worker and for tests; use a shared backend such as
+    ``RedisBackend`` once requests are spread over several processes.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(payload)
+        return len(subscribers)
+
+    def subscribe(self, channel, loop=None):
+        subscriber = subscription(self, channel, loop)
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+class RedisBackend:
+    """Fans events out through Redis pub/sub so every worker sees them."""
+
+    def __init__(self, url, prefix="events:"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def publish(self, channel, payload):
+        return self._redis.publish(self._prefix + channel, payload)
+
+    def subscribe(self, channel, loop=None):
+        subscriber = subscription(self, channel, loop)
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self._prefix + channel: lambda message: subscriber.put(message["data"].decode())})
+        subscriber.thread = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        subscriber.pubsub = pubsub
+        return subscriber
+
+    def unsubscribe(self, subscription):
+        subscription.thread.stop()
+        subscription.pubsub.close()
+
+
+class StreamSlots:
+    """Counts this worker's open streams against ``limit`` (0 = no limit)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.open = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def claim(self):
+        with self._lock:
+            if self.limit and self.open >= self.limit:
+                self.refused += 1
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventHub:
+    """Per-user event channels for the /api/events stream.
+
+    Set ``EVENTS_BACKEND`` to ``"local"`` (the default) or to a ``redis://`` URL.
+    Each stream served by a Flask view holds a request thread for as long as
+    the tab stays open, so at most ``EVENTS_MAX_STREAMS`` are open per worker
+    at a time. 0 means no limit; None (the default) leaves one of the
+    worker's threads free under ``flask serve`` and sets no limit otherwise.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENTS_BACKEND", "local")
+        app.config.setdefault("EVENTS_MAX_STREAMS", None)
+        setting = app.config["EVENTS_BACKEND"]
+        if setting == "local":
+            backend = LocalBackend()
+        elif setting.startswith(("redis://", "rediss://", "unix://")):
+            backend = RedisBackend(setting)
+        else:
+            raise ValueError(f"Unknown EVENTS_BACKEND: {setting}")
+        app.extensions["event_hub"] = backend
+        self.limit_streams(app, app.config["EVENTS_MAX_STREAMS"] or 0)
+
+    def limit_streams(self, app, limit):
+        app.extensions["event_streams"] = StreamSlots(limit)
+
+    @property
+    def backend(self):
+        return current_app.extensions["event_hub"]
+
+    def publish(self, user, event, data):
+        """Sends ``event`` to every open stream of ``user`` and returns how many received it.
+
+        Publishing is best effort: a failing backend is logged and reported as
+        zero receivers rather than failing the request that caused the event.
+        """
+        payload = json.dumps({"event": event, "data": data})
+        try:
+            return self.backend.publish(user, payload)
+        except Exception as e:
+            current_app.logger.warning("event publish failed: %s", e)
+            return 0
+
+    def claim_stream(self):
+        """Takes one of this worker's stream slots.
+
+        Returns the function that gives it back, or None when every slot is taken.
+        """
+        slots = current_app.extensions["event_streams"]
+        if not slots.claim():
+            current_app.logger.warning("refused an event stream: all %d slots of this worker are open", slots.limit)
+            return None
+        return slots.release
+
+    def metrics(self):
+        slots = current_app.extensions["event_streams"]
+        return {"open": slots.open, "limit": slots.limit, "refused": slots.refused}
+
+    def subscribe(self, user, loop=None):
+        """Opens a subscription to ``user``'s events; pass ``loop`` to read it from a coroutine."""
+        return self.backend.subscribe(user, loop)
+
+    def stream(self, user, initial=()):
+        """Generates an SSE body for ``user``: ``initial`` events first, then whatever is published.
+
+        The subscription is only opened once the body starts streaming, so a
+        response that is never sent leaves nothing behind.
+        """
+        backend = self.backend
+
+        def generate():
+            subscription = backend.subscribe(user)
+            try:
+                yield "retry: 5000\n\n"
+                for event, data in initial:
+                    yield sse(event, data)
+                while True:
+                    payload = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                    if payload is None:
+                        yield ": keepalive\n\n"
+                        continue
+                    message = json.loads(payload)
+                    yield sse(message["event"], message["data"])
+            finally:
+                subscription.close()
+
+        return generate()
+
+
+hub = EventHub()
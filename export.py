@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime, time, timedelta
+
+import click
+
+from .archive import archived_before
+from .history import ARCHIVE_TABLE
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_COLUMNS = ("id", "date", "type", "direction", "counterparty", "amount", "balance")
+EARLIEST = date(1970, 1, 1)
+FETCH_BATCH = 1000
+FLUSH_SIZE = 64 * 1024
+
+EXPORT_ROW_COLUMNS = "id, created_at, type, account_number, recipient_account, amount"
+
+
+def export_args(args, today=None):
+    """Reads ``format``, ``start`` and ``end`` (inclusive) from the query string. Raises ValueError."""
+    fmt = args.get("format", "csv")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    end = date.fromisoformat(args["end"]) if args.get("end") else (today or date.today())
+    start = date.fromisoformat(args["start"]) if args.get("start") else EARLIEST
+    if start > end:
+        raise ValueError("Invalid date range")
+    return fmt, start, end
+
+
+def _ledgers(start, horizon):
+    # Every archived row is older than ``horizon``; None means there is no archive
+    if horizon is not None and datetime.combine(start, time()) < horizon:
+        return ("transactions", ARCHIVE_TABLE)
+    return ("transactions",)
+
+
+def export_query(account_number, start, end, horizon=None):
+    """Both sides of the account's rows from ``start`` to ``end``, oldest first."""
+    since = datetime.combine(start, time())
+    until = datetime.combine(end + timedelta(days=1), time())
+    branches = []
+    params = ()
+    for table in _ledgers(start, horizon):
+        branches.append(f"""
+        SELECT {EXPORT_ROW_COLUMNS} FROM {table}
+        WHERE account_number = %s AND created_at >= %s AND created_at < %s
+        UNION ALL
+        SELECT {EXPORT_ROW_COLUMNS} FROM {table}
+        WHERE recipient_account = %s AND account_number <> %s AND created_at >= %s AND created_at < %s""")
+        params += (account_number, since, until, account_number, account_number, since, until)
+    return f"{' UNION ALL'.join(branches)}\n        ORDER BY created_at, id", params
+
+
+def opening_balance(cursor, account_number, start, horizon=None):
+    """The balance before ``start``: today's balance less every change since.
+
+    Returns None if the account does not exist.
+    """
+    cursor.execute("SELECT balance FROM users WHERE account_number = %s", (account_number,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    since = datetime.combine(start, time())
+    branches = []
+    params = ()
+    for table in _ledgers(start, horizon):
+        branches.append(f"""
+        SELECT CASE WHEN type = 'deposit' THEN ABS(amount) ELSE -ABS(amount) END AS change_amount FROM {table}
+        WHERE account_number = %s AND created_at >= %s
+        UNION ALL
+        SELECT ABS(amount) FROM {table}
+        WHERE recipient_account = %s AND account_number <> %s AND created_at >= %s""")
+        params += (account_number, since, account_number, account_number, since)
+    cursor.execute(f"SELECT COALESCE(SUM(change_amount), 0) FROM ({' UNION ALL'.join(branches)}) changes", params)
+    return row[0] - cursor.fetchone()[0]
+
+
+def start_snapshot(cursor):
+    """Starts a read-only transaction that sees the database as of this moment."""
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+
+
+def export_rows(cursor, account_number, balance):
+    """Yields the rows of an executed ``export_query`` as tuples in EXPORT_COLUMNS order.
+
+    ``balance`` is the opening balance; every row carries the balance after it.
+    """
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            return
+        for row_id, created_at, kind, sender, recipient, amount in rows:
+            amount = abs(amount)
+            if recipient == account_number and sender != account_number:
+                direction, counterparty = "in", sender
+            elif kind == "deposit":
+                direction, counterparty = "in", None
+            else:
+                direction, counterparty, amount = "out", recipient, -amount
+            balance += amount
+            yield row_id, created_at, kind, direction, counterparty, amount, balance
+
+
+def encode_csv(rows):
+    """CSV text for ``rows``, in pieces of about FLUSH_SIZE characters."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def encode_ndjson(rows):
+    """One JSON object per row, in pieces of about FLUSH_SIZE characters."""
+    lines = []
+    size = 0
+    for row in rows:
+        item = dict(zip(EXPORT_COLUMNS, row))
+        item["date"] = str(item["date"])
+        item["amount"] = str(item["amount"])
+        item["balance"] = str(item["balance"])
+        line = json.dumps(item) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    yield "".join(lines)
+
+
+def gzip_chunks(chunks):
+    """Compresses a stream of text pieces on the fly into one gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(connection, streaming_cursor, account_number, fmt, start, end, horizon=None):
+    """Returns the account's statement from ``start`` to ``end`` as an iterator of CSV or NDJSON text.
+
+    Everything is read inside one consistent snapshot, so the balance column
+    reconciles with the ledger even while money keeps moving. Rows come
+    from the unbuffered ``streaming_cursor`` as they are written out, so
+    memory use does not grow with the size of the export. The snapshot
+    stays open until the connection rolls back. Raises LookupError if the
+    account does not exist.
+    """
+    cursor = connection.cursor()
+    try:
+        start_snapshot(cursor)
+        balance = opening_balance(cursor, account_number, start, horizon)
+    finally:
+        cursor.close()
+    if balance is None:
+        connection.rollback()
+        raise LookupError(account_number)
+
+    streaming_cursor.execute(*export_query(account_number, start, end, horizon))
+    rows = export_rows(streaming_cursor, account_number, balance)
+    return encode_ndjson(rows) if fmt == "ndjson" else encode_csv(rows)
+
+
+def init_app(app, db):
+    @app.cli.command("export-transactions")
+    @click.option("--account", required=True, help="Account number to export.")
+    @click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="csv")
+    @click.option("--start", type=click.DateTime(["%Y-%m-%d"]), default=None)
+    @click.option("--end", type=click.DateTime(["%Y-%m-%d"]), default=None)
+    def export_transactions_command(account, fmt, start, end):
+        """Write an account's statement to stdout as CSV or NDJSON."""
+        start = start.date() if start else EARLIEST
+        end = end.date() if end else date.today()
+        try:
+            chunks = export(db.connection, db.streaming_cursor(), account, fmt, start, end, archived_before())
+        except LookupError:
+            raise click.ClickException(f"Account {account} not found")
+        for chunk in chunks:
+            sys.stdout.write(chunk)
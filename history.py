@@ -0,0 +1,165 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+FETCH_BATCH = 100
+
+HISTORY_COLUMNS = "account_number, recipient_account, amount, type, created_at, id"
+
+# Cold rows moved there by `flask archive-transactions`; same columns and indexes
+ARCHIVE_TABLE = "transactions_archive"
+
+# Every ledger row, hot or archived, for the jobs that scan the whole ledger
+ALL_TRANSACTIONS = f"(SELECT * FROM transactions UNION ALL SELECT * FROM {ARCHIVE_TABLE})"
+
+# A time every archived row of the account is older than; NULL if it has none
+ACCOUNT_ARCHIVED_BEFORE = "SELECT archived_before FROM account_stats WHERE account_number = %s"
+
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Turns a ``before`` token back into a ``(created_at, id)`` pair."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        created_at, row_id = raw.split("|", 1)
+        return created_at, int(row_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def page_args(args):
+    """Reads ``limit`` and ``before`` from the query string. Raises ValueError on a bad cursor."""
+    limit = args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    before = args.get("before")
+    return limit, decode_cursor(before) if before else None
+
+
+def history_query(account_number, limit, before=None, columns=HISTORY_COLUMNS, archived=False):
+    """Builds the keyset query for one page of an account's history.
+
+    Sent and received rows are read as two ``UNION ALL`` branches so each one
+    walks its own ``(account, created_at, id)`` index instead of MySQL falling
+    back to a full scan for the ``OR``. ``columns`` must include ``created_at``
+    and ``id``, which the outer ORDER BY uses. With ``archived`` the same two
+    branches also read the archive table.
+    """
+    keyset = ""
+    keyset_params = ()
+    if before:
+        created_at, row_id = before
+        keyset = "AND (created_at < %s OR (created_at = %s AND id < %s))"
+        keyset_params = (created_at, created_at, row_id)
+
+    branches = []
+    params = ()
+    for table in ("transactions", ARCHIVE_TABLE) if archived else ("transactions",):
+        branches.append(f"""
+        (SELECT {columns} FROM {table}
+         WHERE account_number = %s {keyset}
+         ORDER BY created_at DESC, id DESC LIMIT %s)
+        UNION ALL
+        (SELECT {columns} FROM {table}
+         WHERE recipient_account = %s AND account_number <> %s {keyset}
+         ORDER BY created_at DESC, id DESC LIMIT %s)""")
+        params += (
+            (account_number, *keyset_params, limit)
+            + (account_number, account_number, *keyset_params, limit)
+        )
+
+    sql = f"""{" UNION ALL".join(branches)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """
+    return sql, params + (limit,)
+
+
+def needs_archive(rows, limit, columns, archived_before):
+    """True unless ``rows`` from the hot table fill the page and are all newer than the archive.
+
+    ``archived_before`` is a time no archived row is as new as; None means
+    there is no archive to read.
+    """
+    if archived_before is None:
+        return False
+    if len(rows) < limit:
+        return True
+    created_at = [column.strip() for column in columns.split(",")].index("created_at")
+    return rows[-1][created_at] < archived_before
+
+
+def account_archived_before(cursor, account_number):
+    """Like ``archive.archived_before`` but for one account's rows; None if it has none archived."""
+    cursor.execute(ACCOUNT_ARCHIVED_BEFORE, (account_number,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def iter_history(cursor, account_number, limit, before=None, columns=HISTORY_COLUMNS, archived_before=None):
+    """Yields at most ``limit`` rows of an account's history, newest first.
+
+    Rows are ordered by ``(created_at, id)`` so a page can be resumed from the
+    last row of the previous one without an OFFSET scan. The hot table is read
+    first; only a page that reaches back past ``archived_before``, and past
+    the account's own archived rows, is read again with the archive merged in.
+    """
+    cursor.execute(*history_query(account_number, limit, before, columns))
+    if archived_before is not None:
+        rows = cursor.fetchall()
+        # Most short pages belong to accounts that have nothing archived
+        if (not needs_archive(rows, limit, columns, archived_before)
+                or not needs_archive(rows, limit, columns, account_archived_before(cursor, account_number))):
+            yield from rows
+            return
+        cursor.execute(*history_query(account_number, limit, before, columns, archived=True))
+
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        yield from rows
+
+
+def history_item(row):
+    return {
+        "account_number": row[0],
+        "recipient_account": row[1],
+        "amount": float(row[2]),
+        "type": row[3],
+        "date": str(row[4]),
+        "id": row[5]
+    }
+
+
+def stream_history(rows, limit, **fields):
+    """Encodes a page of history rows as one JSON document, piece by piece.
+
+    ``rows`` should hold up to ``limit + 1`` rows; the extra row only tells us
+    whether a ``next_cursor`` has to be handed out.
+    """
+    yield '{"success": true'
+    for key, value in fields.items():
+        yield f", {json.dumps(key)}: {json.dumps(value)}"
+    yield ', "transactions": ['
+
+    last = None
+    count = 0
+    has_more = False
+    for row in rows:
+        if count == limit:
+            has_more = True
+            break
+        if count:
+            yield ", "
+        yield json.dumps(history_item(row))
+        last = row
+        count += 1
+
+    next_cursor = encode_cursor(last[4], last[5]) if has_more else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
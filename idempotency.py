@@ -0,0 +1,272 @@
+import functools
+import hashlib
+import struct
+import threading
+import time
+
+import click
+from flask import current_app, g, jsonify, make_response, request, session
+
+from .cache import MISSING, LRUCache
+from .db import db
+
+MAX_KEY_LENGTH = 255
+PRUNE_BATCH_SIZE = 10000
+
+# A stored response: request fingerprint, HTTP status, then the body
+RECORD_HEADER = struct.Struct(">8sH")
+
+LOAD_RECORD = "SELECT fingerprint, status, body FROM idempotency_keys WHERE id = %s"
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id BINARY(16) NOT NULL PRIMARY KEY,
+            fingerprint BINARY(8) NULL,
+            status SMALLINT UNSIGNED NULL,
+            body MEDIUMBLOB NULL,
+            expires_at DATETIME NOT NULL,
+            KEY idx_idempotency_keys_expires_at (expires_at)
+        ) ENGINE=InnoDB
+    """)
+
+
+class InFlight(Exception):
+    pass
+
+
+class LocalStore:
+    """Finished responses in a bounded LRU, plus an event per request still running.
+
+    Only for development: other processes do not see it, and a full LRU
+    forgets keys before their TTL is up.
+    """
+
+    def __init__(self, max_size):
+        self._done = LRUCache(max_size)
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, wait, lease):
+        deadline = time.monotonic() + wait
+        while True:
+            with self._lock:
+                record = self._done.get(key)
+                if record is not MISSING:
+                    return record
+                event = self._running.get(key)
+                if event is None:
+                    self._running[key] = threading.Event()
+                    return None
+            if not event.wait(deadline - time.monotonic()):
+                raise InFlight()
+
+    def finish(self, key, record, ttl):
+        with self._lock:
+            if record is not None:
+                self._done.set(key, record, ttl)
+            self._running.pop(key).set()
+
+
+class RedisStore:
+    """Shares keys between workers; an unfinished claim expires after its lease."""
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, url, prefix):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def claim(self, key, wait, lease):
+        name = self._prefix + key.hex()
+        deadline = time.monotonic() + wait
+        while True:
+            if self._redis.set(name, b"", nx=True, ex=max(1, int(lease))):
+                return None
+            raw = self._redis.get(name)
+            if raw:
+                fingerprint, status = RECORD_HEADER.unpack_from(raw)
+                return fingerprint, status, raw[RECORD_HEADER.size:]
+            if time.monotonic() >= deadline:
+                raise InFlight()
+            time.sleep(self.POLL_INTERVAL)
+
+    def finish(self, key, record, ttl):
+        name = self._prefix + key.hex()
+        if record is None:
+            self._redis.delete(name)
+            return
+        fingerprint, status, body = record
+        self._redis.set(name, RECORD_HEADER.pack(fingerprint, status) + body, ex=max(1, int(ttl)))
+
+
+class SQLStore:
+    """Keys in the idempotency_keys table, shared by every worker and kept across restarts.
+
+    A row with no status is a claim by a request still running; it can be
+    taken over once its lease is up, as can a finished record past its TTL.
+    Uses the request's own connection: the claim is committed before the
+    view runs, and the record after anything the view left open has been
+    rolled back, as the request teardown would have done.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, db):
+        self._db = db
+
+    def claim(self, key, wait, lease):
+        connection = self._db.connection
+        deadline = time.monotonic() + wait
+        cursor = connection.cursor()
+        try:
+            while True:
+                cursor.execute(
+                    "INSERT IGNORE INTO idempotency_keys (id, expires_at) VALUES (%s, NOW() + INTERVAL %s SECOND)",
+                    (key, int(lease)),
+                )
+                claimed = cursor.rowcount == 1
+                if not claimed:
+                    cursor.execute("""
+                        UPDATE idempotency_keys
+                        SET fingerprint = NULL, status = NULL, body = NULL, expires_at = NOW() + INTERVAL %s SECOND
+                        WHERE id = %s AND expires_at <= NOW()
+                    """, (int(lease), key))
+                    claimed = cursor.rowcount == 1
+                if claimed:
+                    connection.commit()
+                    return None
+
+                cursor.execute(LOAD_RECORD, (key,))
+                row = cursor.fetchone()
+                # Ends the snapshot, so the next poll sees the first request finish
+                connection.commit()
+                if row and row[1] is not None:
+                    return bytes(row[0]), row[1], bytes(row[2])
+                if time.monotonic() >= deadline:
+                    raise InFlight()
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            cursor.close()
+
+    def finish(self, key, record, ttl):
+        connection = self._db.connection
+        connection.rollback()
+        cursor = connection.cursor()
+        try:
+            if record is None:
+                cursor.execute("DELETE FROM idempotency_keys WHERE id = %s", (key,))
+            else:
+                fingerprint, status, body = record
+                cursor.execute("""
+                    UPDATE idempotency_keys
+                    SET fingerprint = %s, status = %s, body = %s, expires_at = NOW() + INTERVAL %s SECOND
+                    WHERE id = %s
+                """, (fingerprint, status, body, int(ttl), key))
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def prune(connection, batch_size=PRUNE_BATCH_SIZE):
+    """Deletes expired rows from the idempotency_keys table; returns how many."""
+    total = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= NOW() LIMIT %s", (batch_size,))
+            deleted = cursor.rowcount
+            connection.commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+    finally:
+        cursor.close()
+
+
+class IdempotencyStore:
+    """Remembers the response to each ``Idempotency-Key`` so retries do not write twice.
+
+    Keys are scoped to the user and endpoint and kept as a 16 byte digest
+    next to the status and body, for ``IDEMPOTENCY_TTL`` seconds. A duplicate
+    that arrives while the first request is still running waits up to
+    ``IDEMPOTENCY_WAIT`` seconds for its response. Server errors are not
+    stored, so the client can retry them. Set ``IDEMPOTENCY_BACKEND`` to
+    ``"sql"`` (the default), a redis:// URL, or ``"local"`` for development.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("IDEMPOTENCY_BACKEND", "sql")
+        app.config.setdefault("IDEMPOTENCY_CACHE_SIZE", 200000)
+        app.config.setdefault("IDEMPOTENCY_TTL", 24 * 3600)
+        app.config.setdefault("IDEMPOTENCY_WAIT", 10)
+        app.config.setdefault("IDEMPOTENCY_LEASE", 60)
+
+        setting = app.config["IDEMPOTENCY_BACKEND"]
+        if setting == "local":
+            backend = LocalStore(app.config["IDEMPOTENCY_CACHE_SIZE"])
+        elif setting == "sql":
+            backend = SQLStore(db)
+        elif setting.startswith(("redis://", "rediss://", "unix://")):
+            backend = RedisStore(setting, "idempotency:")
+        else:
+            raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {setting}")
+        app.extensions["idempotency"] = backend
+
+        @app.cli.command("prune-idempotency-keys")
+        def prune_idempotency_keys_command():
+            """Delete expired rows from the idempotency_keys table."""
+            click.echo(f"Deleted {prune(db.connection)} expired idempotency keys.")
+
+    def run(self, key, view, args, kwargs):
+        config = current_app.config
+        backend = current_app.extensions["idempotency"]
+        scoped = hashlib.sha256(f"{session['user']}\0{request.endpoint}\0{key}".encode()).digest()[:16]
+        fingerprint = hashlib.sha256(request.get_data()).digest()[:8]
+
+        try:
+            record = backend.claim(scoped, config["IDEMPOTENCY_WAIT"], config["IDEMPOTENCY_LEASE"])
+        except InFlight:
+            return jsonify({"success": False, "message": "This request is still being processed"}), 409
+
+        if record is not None:
+            stored_fingerprint, status, body = record
+            if stored_fingerprint != fingerprint:
+                return jsonify({"success": False, "message": "Idempotency-Key was used for a different request"}), 422
+            response = current_app.response_class(body, status=status, mimetype="application/json")
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        # Journaled writes store it with the entry, which also catches duplicates across workers
+        g.idempotency_key = scoped.hex()
+        record = None
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                record = (fingerprint, response.status_code, response.get_data())
+            return response
+        finally:
+            backend.finish(scoped, record, config["IDEMPOTENCY_TTL"])
+
+
+def idempotent(view):
+    """Makes POSTs to ``view`` that carry an ``Idempotency-Key`` header safe to retry."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if request.method != "POST" or not key or "user" not in session:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"success": False, "message": "Idempotency-Key is too long"}), 400
+        return idempotency.run(key, view, args, kwargs)
+    return wrapper
+
+
+idempotency = IdempotencyStore()
@@ -0,0 +1,243 @@
+import cProfile
+import functools
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import MySQLdb.cursors
+from flask import Response, abort, current_app, g, has_request_context, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and a tuple of label pairs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+        self.help = {}
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self.counters[(name, labels)] += amount
+
+    def totals(self, name):
+        """Returns ``{labels: (sum, count)}`` for every histogram called ``name``."""
+        with self._lock:
+            return {
+                labels: (histogram.sum, histogram.count)
+                for (metric, labels), histogram in self.histograms.items()
+                if metric == name
+            }
+
+    def render(self, gauges=()):
+        """Returns everything in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{_labels(labels)} {value}")
+        for name, value in gauges:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(query):
+    """Normalises a statement so every execution of the same query shares one label."""
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    query = re.sub(r"\s+", " ", query).strip()
+    query = re.sub(r"\(\s*%s(?:\s*,\s*%s)+\s*\)", "(...)", query)
+    query = re.sub(r"'(?:[^'\\]|\\.)*'", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    return query[:200]
+
+
+registry = Registry()
+
+
+def record_query(query, elapsed, rows):
+    statement = fingerprint(query)
+    registry.observe("db_query_duration_seconds", (("statement", statement),), elapsed)
+    if rows and rows > 0:
+        registry.inc("db_query_rows_total", (("statement", statement),), rows)
+    if has_request_context():
+        queries = g.setdefault("_queries", Counter())
+        queries[statement] += 1
+
+
+class InstrumentedCursor(MySQLdb.cursors.Cursor):
+    """Cursor that records latency, row count and fingerprint of every statement."""
+
+    _batching = False
+
+    def execute(self, query, args=None):
+        if self._batching:
+            return super().execute(query, args)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, args):
+        # MySQLdb runs non-INSERT batches through execute(); count them once here
+        started = time.perf_counter()
+        self._batching = True
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._batching = False
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+
+class InstrumentedSSCursor(MySQLdb.cursors.CursorUseResultMixIn, InstrumentedCursor):
+    """Unbuffered InstrumentedCursor; latency is recorded up to the first row."""
+
+
+_profile_lock = threading.Lock()
+
+
+def _before_request():
+    g._request_started = time.perf_counter()
+
+    rate = current_app.config["PROFILE_SAMPLE_RATE"]
+    if rate and random.random() < rate and _profile_lock.acquire(blocking=False):
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+
+def _teardown_request(exc):
+    # teardown_request (not after_request) so streamed bodies are included
+    profiler = g.pop("_profiler", None)
+    try:
+        _record_request()
+    finally:
+        if profiler is not None:
+            # Released even if recording failed, or no request would be profiled again
+            profiler.disable()
+            _profile_lock.release()
+            directory = current_app.config["PROFILE_DIR"]
+            os.makedirs(directory, exist_ok=True)
+            endpoint = request.endpoint or "unmatched"
+            profiler.dump_stats(os.path.join(directory, f"{endpoint}-{int(time.time() * 1000)}.prof"))
+
+
+def _record_request():
+    started = g.pop("_request_started", None)
+    if started is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    labels = (("endpoint", endpoint), ("method", request.method))
+    registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+
+    queries = g.pop("_queries", Counter())
+    registry.observe("http_request_queries", (("endpoint", endpoint),), sum(queries.values()), COUNT_BUCKETS)
+    threshold = current_app.config["REPEATED_QUERY_THRESHOLD"]
+    for statement, count in queries.items():
+        if count >= threshold:
+            registry.inc("http_request_repeated_queries_total", (("endpoint", endpoint), ("statement", statement)))
+            current_app.logger.debug("%s ran %r %d times", endpoint, statement, count)
+
+
+def metrics_allowed():
+    """Whether this request may read /metrics: from ``METRICS_ALLOWED_IPS`` or with ``METRICS_TOKEN``."""
+    config = current_app.config
+    if request.remote_addr in config["METRICS_ALLOWED_IPS"]:
+        return True
+    token = config["METRICS_TOKEN"]
+    if not token:
+        return False
+    scheme, _, presented = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(presented.encode(), token.encode())
+
+
+def init_app(app, db, recipients, hub):
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.config.setdefault("REPEATED_QUERY_THRESHOLD", 2)
+    app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+    app.config.setdefault("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+    # /metrics names every query and endpoint; scrapers come from these
+    # addresses (as seen by the worker) or send "Authorization: Bearer <token>"
+    app.config.setdefault("METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+    app.config.setdefault("METRICS_TOKEN", None)
+
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    app.config["MYSQL_CURSORCLASS"] = InstrumentedCursor
+    app.config["MYSQL_SS_CURSORCLASS"] = InstrumentedSSCursor
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+    def metrics():
+        if not metrics_allowed():
+            abort(403)
+        gauges = []
+        for name, value in db.metrics().items():
+            gauges.append((f"db_pool_{name}", value))
+        for name, value in recipients.metrics().items():
+            gauges.append((f"recipient_cache_{name}", value))
+        for name, value in hub.metrics().items():
+            gauges.append((f"event_streams_{name}", value))
+        return Response(registry.render(gauges), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,306 @@
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+import click
+import MySQLdb
+from flask import current_app
+
+from . import analytics
+from .db import db
+from .stats import RECORD_DEPOSIT, RECORD_WITHDRAWAL
+from .transfers import MAX_ATTEMPTS, RETRYABLE_ERRORS, transfer_failure
+
+# ER_DUP_ENTRY: an entry with this key is already in the journal
+DUPLICATE_ENTRY = 1062
+
+# Named lock held while posting, so only one process moves entries at a time
+POSTER_LOCK = "ledger_journal_poster"
+
+# The balance of users row ``u`` once everything still in the journal is posted
+PENDING_BALANCE = """(u.balance
+    + (SELECT COALESCE(SUM(CASE WHEN type = 'deposit' THEN amount ELSE -amount END), 0)
+       FROM ledger_journal WHERE account_number = u.account_number)
+    + (SELECT COALESCE(SUM(amount), 0) FROM ledger_journal WHERE recipient_account = u.account_number))"""
+
+# Changes whenever an entry touching users row ``u`` is appended, or posted (which bumps u.version)
+PENDING_VERSION = """CONCAT(u.version, '.', GREATEST(
+    COALESCE((SELECT MAX(id) FROM ledger_journal WHERE account_number = u.account_number), 0),
+    COALESCE((SELECT MAX(id) FROM ledger_journal WHERE recipient_account = u.account_number), 0)))"""
+
+# Locks only the sender's row; see append_transfer()
+LOCK_SENDER_WITH_PENDING = f"SELECT {PENDING_BALANCE} FROM users u WHERE u.account_number = %s FOR UPDATE"
+
+# Shared lock: the recipient cannot be deleted until the entry is in the journal
+ACCOUNT_EXISTS = "SELECT 1 FROM users WHERE account_number = %s FOR SHARE"
+
+APPEND_DEPOSIT = """
+    INSERT INTO ledger_journal (entry_key, account_number, amount, type)
+    SELECT %s, account_number, %s, 'deposit' FROM users WHERE account_number = %s FOR SHARE
+"""
+
+APPEND_TRANSFER = """
+    INSERT INTO ledger_journal (entry_key, account_number, recipient_account, amount, type)
+    VALUES (%s, %s, %s, %s, 'transfer')
+"""
+
+POST_LEDGER = """
+    INSERT INTO transactions (account_number, recipient_account, amount, type, created_at)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+PENDING_COLUMNS = "id, account_number, recipient_account, amount, type, created_at"
+
+UPDATE_CHUNK_SIZE = 500
+DEFAULT_BATCH_SIZE = 1000
+
+_start_lock = threading.Lock()
+
+
+class JournalBusy(Exception):
+    pass
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_journal (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            entry_key CHAR(32) NOT NULL,
+            account_number VARCHAR(20) NOT NULL,
+            recipient_account VARCHAR(20) NULL,
+            amount DECIMAL(15, 2) NOT NULL,
+            type VARCHAR(20) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_journal_entry_key (entry_key),
+            KEY idx_journal_account (account_number),
+            KEY idx_journal_recipient (recipient_account)
+        ) ENGINE=InnoDB
+    """)
+
+
+def append_deposit(connection, account_number, amount, key=None):
+    """Journals a deposit and commits; returns False if the account does not exist.
+
+    Appending the same ``key`` twice records the deposit once.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(APPEND_DEPOSIT, (key or uuid.uuid4().hex, amount, account_number))
+        appended = cursor.rowcount == 1
+        connection.commit()
+        return appended
+    except MySQLdb.IntegrityError as e:
+        connection.rollback()
+        if e.args[0] != DUPLICATE_ENTRY:
+            raise
+        return True
+    finally:
+        cursor.close()
+
+
+def append_transfer(connection, sender, recipient, amount, key=None, attempts=MAX_ATTEMPTS):
+    """Journaled ``transfers.transfer``: same checks and errors, but nothing is posted yet.
+
+    Funds are checked against the sender's balance plus its pending entries
+    while only the sender's row is locked for update and the recipient's is
+    only shared, so transfers into a popular account no longer queue on
+    each other.
+    """
+    key = key or uuid.uuid4().hex
+    amount = Decimal(str(amount))
+    for attempt in range(1, attempts + 1):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(LOCK_SENDER_WITH_PENDING, (sender,))
+            row = cursor.fetchone()
+            found = {sender} if row else set()
+            cursor.execute(ACCOUNT_EXISTS, (recipient,))
+            if cursor.fetchone():
+                found.add(recipient)
+
+            if len(found) != 2 or row[0] < amount:
+                connection.rollback()
+                raise transfer_failure(found, sender, recipient)
+
+            cursor.execute(APPEND_TRANSFER, (key, sender, recipient, amount))
+            connection.commit()
+            return
+        except MySQLdb.IntegrityError as e:
+            connection.rollback()
+            if e.args[0] != DUPLICATE_ENTRY:
+                raise
+            return
+        except MySQLdb.OperationalError as e:
+            connection.rollback()
+            if e.args[0] not in RETRYABLE_ERRORS or attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        finally:
+            cursor.close()
+
+
+def post_pending(connection, batch_size=DEFAULT_BATCH_SIZE, account_number=None, wait=0):
+    """Moves the oldest ``batch_size`` journal entries into the ledger; returns how many.
+
+    Each account's balance gets its net change in one grouped UPDATE, the
+    entries become ``transactions`` rows with their original timestamps and
+    leave the journal in the same commit. A crash therefore either posts the
+    whole batch or leaves it to be replayed. An entry whose sender or
+    recipient has been deleted since is dropped without moving any money.
+    With ``account_number`` only
+    entries touching that account are posted. Returns None if another
+    process is posting and did not finish within ``wait`` seconds.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (POSTER_LOCK, wait))
+        if cursor.fetchone()[0] != 1:
+            return None
+        try:
+            return _post_batch(connection, cursor, batch_size, account_number)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (POSTER_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _post_batch(connection, cursor, batch_size, account_number, attempts=MAX_ATTEMPTS):
+    for attempt in range(1, attempts + 1):
+        try:
+            if account_number is None:
+                cursor.execute(f"SELECT {PENDING_COLUMNS} FROM ledger_journal ORDER BY id LIMIT %s", (batch_size,))
+            else:
+                cursor.execute(f"""
+                    SELECT {PENDING_COLUMNS} FROM ledger_journal
+                    WHERE account_number = %s OR recipient_account = %s
+                    ORDER BY id LIMIT %s
+                """, (account_number, account_number, batch_size))
+            entries = cursor.fetchall()
+            if not entries:
+                connection.rollback()
+                return 0
+
+            # Sorted so the rows are locked in the same order as transfers.transfer() locks them
+            numbers = sorted({number for entry in entries for number in entry[1:3] if number is not None})
+            existing = set()
+            for offset in range(0, len(numbers), UPDATE_CHUNK_SIZE):
+                chunk = numbers[offset:offset + UPDATE_CHUNK_SIZE]
+                cursor.execute(
+                    f"SELECT account_number FROM users WHERE account_number IN ({', '.join(['%s'] * len(chunk))}) "
+                    "ORDER BY account_number FOR UPDATE",
+                    chunk,
+                )
+                existing.update(row[0] for row in cursor.fetchall())
+
+            changes = defaultdict(Decimal)
+            deposited = defaultdict(Decimal)
+            sent = defaultdict(Decimal)
+            posted = []
+            for entry in entries:
+                _, sender, recipient, amount, kind, _ = entry
+                if sender not in existing or (recipient is not None and recipient not in existing):
+                    # A party was deleted since the entry was appended: the whole
+                    # entry is dropped, so a surviving sender keeps the money
+                    if sender in existing:
+                        changes[sender] += 0
+                    continue
+                posted.append(entry[1:])
+                if kind == "deposit":
+                    changes[sender] += amount
+                    deposited[sender] += amount
+                else:
+                    changes[sender] -= amount
+                    changes[recipient] += amount
+                    sent[sender] += amount
+
+            # Accounts whose balance nets out still get a new version for their new history rows
+            numbers = sorted(changes)
+            for offset in range(0, len(numbers), UPDATE_CHUNK_SIZE):
+                chunk = numbers[offset:offset + UPDATE_CHUNK_SIZE]
+                cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+                placeholders = ", ".join(["%s"] * len(chunk))
+                params = [value for number in chunk for value in (number, changes[number])]
+                cursor.execute(
+                    f"UPDATE users SET balance = balance + CASE account_number {cases} END, version = version + 1 "
+                    f"WHERE account_number IN ({placeholders})",
+                    params + chunk,
+                )
+
+            if posted:
+                cursor.executemany(POST_LEDGER, posted)
+            if deposited:
+                cursor.executemany(RECORD_DEPOSIT, sorted(deposited.items()))
+            if sent:
+                cursor.executemany(RECORD_WITHDRAWAL, sorted(sent.items()))
+            analytics.record(cursor, posted)
+
+            ids = [entry[0] for entry in entries]
+            cursor.execute(f"DELETE FROM ledger_journal WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+            connection.commit()
+            return len(entries)
+        except MySQLdb.OperationalError as e:
+            connection.rollback()
+            if e.args[0] not in RETRYABLE_ERRORS or attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+def drain(connection, account_number=None, batch_size=DEFAULT_BATCH_SIZE, wait=30):
+    """Posts every pending entry (touching ``account_number``, if given); returns how many."""
+    total = 0
+    while True:
+        posted = post_pending(connection, batch_size, account_number, wait)
+        if posted is None:
+            raise JournalBusy(f"Journal poster still busy after {wait}s")
+        total += posted
+        if posted < batch_size:
+            return total
+
+
+def start(app):
+    """Starts this process's poster thread if the journal is enabled and it is not running yet."""
+    if not app.config["JOURNAL_ENABLED"]:
+        return
+    state = app.extensions["journal"]
+    if state["pid"] == os.getpid():
+        return
+    with _start_lock:
+        if state["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_run, args=(app,), name="journal-poster", daemon=True)
+        thread.start()
+        state["pid"] = os.getpid()
+
+
+def _run(app):
+    config = app.config
+    while True:
+        try:
+            with app.app_context():
+                posted = post_pending(db.connection, config["JOURNAL_BATCH_SIZE"])
+        except Exception:
+            app.logger.exception("posting the ledger journal failed")
+            posted = None
+        if not posted or posted < config["JOURNAL_BATCH_SIZE"]:
+            time.sleep(config["JOURNAL_POST_INTERVAL"])
+
+
+def init_app(app, db):
+    app.config.setdefault("JOURNAL_ENABLED", False)
+    app.config.setdefault("JOURNAL_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    app.config.setdefault("JOURNAL_POST_INTERVAL", 0.2)
+    app.extensions["journal"] = {"pid": None}
+
+    # Also replays whatever a crashed process left behind, on the first request
+    app.before_request(lambda: start(current_app._get_current_object()))
+
+    @app.cli.command("post-journal")
+    def post_journal_command():
+        """Post every pending journal entry to the ledger now."""
+        posted = drain(db.connection, batch_size=current_app.config["JOURNAL_BATCH_SIZE"])
+        click.echo(f"Posted {posted} journal entries.")
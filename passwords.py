@@ -0,0 +1,165 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import click
+from flask import current_app
+
+SCHEME = "scrypt"
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    # OpenSSL refuses anything over 32 MiB unless maxmem is raised explicitly
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n + 1024 * 1024, dklen=32)
+
+
+def make_hash(password, n, r, p):
+    salt = os.urandom(16)
+    return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def check_hash(password, stored, n, r, p):
+    """Returns ``(matches, needs_rehash)`` for a stored scrypt or legacy SHA-256 hash.
+
+    Legacy hashes are unsalted hex SHA-256 digests; a match always needs a rehash,
+    as do scrypt hashes made with cost parameters other than ``n, r, p``.
+    """
+    if not stored:
+        return False, False
+
+    if not stored.startswith(SCHEME + "$"):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        matches = hmac.compare_digest(legacy, stored)
+        return matches, matches
+
+    try:
+        _, stored_n, stored_r, stored_p, salt, digest = stored.split("$")
+        stored_n, stored_r, stored_p = int(stored_n), int(stored_r), int(stored_p)
+        expected = _unb64(digest)
+        actual = _scrypt(password, _unb64(salt), stored_n, stored_r, stored_p)
+    except ValueError:
+        return False, False
+    matches = hmac.compare_digest(expected, actual)
+    return matches, matches and (stored_n, stored_r, stored_p) != (n, r, p)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a bounded worker pool.
+
+    scrypt releases the GIL while it runs, so the default thread pool gives
+    real parallelism; ``PASSWORD_HASH_EXECUTOR = "process"`` isolates it further.
+    Either way at most ``PASSWORD_HASH_WORKERS`` hashes run at once, so a login
+    storm queues up here instead of starving every request worker of CPU and
+    memory. The cost is set by ``PASSWORD_SCRYPT_N``/``_R``/``_P``.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PASSWORD_SCRYPT_N", 2 ** 14)
+        app.config.setdefault("PASSWORD_SCRYPT_R", 8)
+        app.config.setdefault("PASSWORD_SCRYPT_P", 1)
+        app.config.setdefault("PASSWORD_HASH_EXECUTOR", "thread")
+        app.config.setdefault("PASSWORD_HASH_WORKERS", os.cpu_count() or 2)
+        app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+        app.extensions["password_hasher"] = {"executor": None, "pid": None, "dummy": None}
+
+        @app.cli.command("benchmark-passwords")
+        @click.option("--cost", "costs", default="14,15,16", help="Comma separated log2(N) values to try.")
+        @click.option("--seconds", default=3.0, help="How long to run each setting.")
+        @click.option("--concurrency", default=None, type=int, help="Parallel logins (default: worker count).")
+        def benchmark_passwords_command(costs, seconds, concurrency):
+            """Report logins/sec for each scrypt cost setting."""
+            config = current_app.config
+            concurrency = concurrency or config["PASSWORD_HASH_WORKERS"]
+            r, p = config["PASSWORD_SCRYPT_R"], config["PASSWORD_SCRYPT_P"]
+            for exponent in (int(c) for c in costs.split(",")):
+                n = 2 ** exponent
+                rate, latency = benchmark(n, r, p, seconds, concurrency, self._executor())
+                click.echo(
+                    f"N=2^{exponent} r={r} p={p}: {rate:8.1f} logins/s, "
+                    f"{latency * 1000:7.1f} ms each, {128 * r * n // (1024 * 1024)} MiB per hash"
+                )
+
+    def _state(self):
+        return current_app.extensions["password_hasher"]
+
+    def _executor(self):
+        state = self._state()
+        # Executors do not survive fork(); each worker process starts its own.
+        if state["executor"] is None or state["pid"] != os.getpid():
+            with self._lock:
+                if state["executor"] is None or state["pid"] != os.getpid():
+                    workers = current_app.config["PASSWORD_HASH_WORKERS"]
+                    if current_app.config["PASSWORD_HASH_EXECUTOR"] == "process":
+                        state["executor"] = ProcessPoolExecutor(max_workers=workers)
+                    else:
+                        state["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+                    state["pid"] = os.getpid()
+        return state["executor"]
+
+    def _cost(self):
+        config = current_app.config
+        return config["PASSWORD_SCRYPT_N"], config["PASSWORD_SCRYPT_R"], config["PASSWORD_SCRYPT_P"]
+
+    def hash(self, password):
+        future = self._executor().submit(make_hash, password, *self._cost())
+        return future.result(timeout=current_app.config["PASSWORD_HASH_TIMEOUT"])
+
+    def verify(self, password, stored):
+        """Returns ``(matches, needs_rehash)``. Pass ``stored=None`` for an unknown user.
+
+        An unknown user is checked against a throwaway hash so the response
+        takes as long as a wrong password would.
+        """
+        if stored is None:
+            state = self._state()
+            if state["dummy"] is None:
+                state["dummy"] = self.hash(os.urandom(16).hex())
+            stored = state["dummy"]
+            self._check(password, stored)
+            return False, False
+        return self._check(password, stored)
+
+    def _check(self, password, stored):
+        future = self._executor().submit(check_hash, password, stored, *self._cost())
+        return future.result(timeout=current_app.config["PASSWORD_HASH_TIMEOUT"])
+
+
+def benchmark(n, r, p, seconds, concurrency, executor):
+    """Verifies one password repeatedly for ``seconds``; returns ``(per_second, avg_latency)``."""
+    stored = make_hash("correct horse battery staple", n, r, p)
+    done = 0
+    busy = 0.0
+    deadline = time.monotonic() + seconds
+    started = time.monotonic()
+    while time.monotonic() < deadline:
+        submitted = time.monotonic()
+        futures = [
+            executor.submit(check_hash, "correct horse battery staple", stored, n, r, p)
+            for _ in range(concurrency)
+        ]
+        for future in futures:
+            future.result()
+        busy += time.monotonic() - submitted
+        done += concurrency
+    elapsed = time.monotonic() - started
+    return done / elapsed, busy / (done / concurrency)
+
+
+passwords = PasswordHasher()
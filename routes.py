@@ -1,20 +1,42 @@
-import os 
-import uuid
-from flask import Flask, Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, current_app, get_flashed_messages
+import json
+import math
+from collections import defaultdict
+from flask import Flask, Blueprint, Response, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, current_app, g, get_flashed_messages, stream_with_context
 from flask_cors import CORS
-from flask_mysqldb import MySQL
-from werkzeug.utils import secure_filename
-import hashlib
+
+from . import analytics
+from .archive import archived_before
+from .avatars import avatar_url, avatars, receive
+from .bootstrap import BOOTSTRAP_LIMIT, USER_SECTIONS, parse_fields, pick
+from .cache import recipients
+from .db import db
+from .events import hub
+from .export import FORMATS, export, export_args, gzip_chunks
+from .passwords import passwords
+from .history import (
+    ARCHIVE_TABLE, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, history_item, iter_history, page_args,
+    stream_history,
+)
+from .idempotency import idempotent
+from .journal import LOCK_SENDER_WITH_PENDING, append_deposit, append_transfer, drain
+from .statements import StatementError, forget_imports, progress_of, statements
+from .stats import account_totals, forget_account, spending_split
+from .transfers import (
+    LOCK_SENDER, MAX_DEPOSIT_LIMIT, AccountNotFound, TransferError, batch_transfer, deposit_amount, make_deposit,
+    transfer, transfer_request,
+)
+from .user_context import users
+from .versions import bump_counterparties, conditional
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 1 * 1024 * 1024
+MAX_BATCH_ITEMS = 10000
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True, origins=['localhost'])
 
 main = Blueprint("main", __name__)
 api = Blueprint("api", __name__, url_prefix="/api") 
-mysql = MySQL()
 
 @main.route("/")
 def index():
@@ -33,12 +55,11 @@ def register():
         email = request.form.get("email")
         password = request.form.get("password")             
 
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-
         try:
-            cursor = mysql.connection.cursor()
+            cursor = db.cursor()
             cursor.execute(
-                "SELECT email, account_number FROM users WHERE email = %s OR account_number = %s",
+                "SELECT email, account_number FROM users WHERE email = %s "
+                "UNION ALL SELECT email, account_number FROM users WHERE account_number = %s",
                 (email, account_number)
             )
             existing_user = cursor.fetchone()
@@ -54,15 +75,18 @@ def register():
                 cursor.close()
                 return redirect(url_for("main.register"))
 
+            password_hash = passwords.hash(password)
             cursor.execute( """
                 INSERT INTO users (name, account_number, transaction_pin, email, password_hash, balance)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (name, account_number, transaction_pin, email, password_hash, 0.00))
 
-            mysql.connection.commit()
+            db.connection.commit()
+            recipients.invalidate(account_number)
             cursor.close()
 
             session["user"] = email
+            session["user_account_number"] = account_number
             flash("Registration successful! Redirecting to dashboard...", "success")
             return redirect(url_for("main.dashboard"))
 
@@ -72,6 +96,27 @@ def register():
 
     return render_template("register.html")
 
+def authenticate(email, password, columns):
+    """Returns the requested columns of the user if the password matches, else None.
+
+    Users are looked up by email alone and the hash is checked off the request
+    thread. Legacy SHA-256 hashes are upgraded on a successful login.
+    """
+    cursor = db.cursor()
+    cursor.execute(f"SELECT password_hash, {columns} FROM users WHERE email = %s", (email,))
+    row = cursor.fetchone()
+
+    matches, needs_rehash = passwords.verify(password or "", row[0] if row else None)
+    if matches and needs_rehash:
+        cursor.execute(
+            "UPDATE users SET password_hash = %s WHERE email = %s",
+            (passwords.hash(password), email),
+        )
+        db.connection.commit()
+    cursor.close()
+
+    return row[1:] if matches else None
+
 @main.route("/login", methods=["GET", "POST"])
 def login():
     if "user" in session:
@@ -80,18 +125,14 @@ def login():
         email = request.form.get("email")
         password = request.form.get("password")
 
-        cursor = mysql.connection.cursor()
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        cursor.execute("SELECT * FROM users WHERE email = %s AND password_hash = %s", (email, password_hash))
-
-        user = cursor.fetchone()
-        cursor.close()
+        user = authenticate(email, password, "account_number")
 
         if user:
             if '_flashes' in session:
                 session.pop('_flashes', None)
 
             session["user"] = email  
+            session["user_account_number"] = user[0]
             flash("Login successful!", "success")
             return redirect(url_for("main.dashboard"))
         else:
@@ -106,16 +147,13 @@ def dashboard():
         flash("Please log in first!", "warning")
         return redirect(url_for("main.login"))
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT name, balance FROM users WHERE email = %s", (session["user"],))
-    user_data = cursor.fetchone()
-    cursor.close()
+    user = users.current("name", "balance")
 
-    if not user_data:
+    if not user:
         flash("User not found!", "danger")
         return redirect(url_for("main.logout"))
 
-    return render_template("dashboard.html", name=user_data[0], balance=user_data[1])
+    return render_template("dashboard.html", name=user["name"], balance=user["balance"])
 
 @main.route("/deposit", methods=["GET", "POST"])
 def deposit():
@@ -132,24 +170,18 @@ def deposit():
 
                 return render_template("deposit.html") 
             
-            MAX_DEPOSIT_LIMIT = 100000 
             if amount > MAX_DEPOSIT_LIMIT:
                 flash(f"Deposit amount exceeds the maximum limit of ${MAX_DEPOSIT_LIMIT:,.0f}!", "danger")
                 return render_template("deposit.html")
 
-            cursor = mysql.connection.cursor()
-            cursor.execute("UPDATE users SET balance = balance + %s WHERE email = %s", (amount, session["user"]))
+            account_number = users.account_number()
 
-            cursor.execute("SELECT account_number FROM users WHERE email = %s", (session["user"],))
-            account_number = cursor.fetchone()[0]
+            if not apply_deposit(account_number, amount):
+                flash("User not found!", "danger")
+                return redirect(url_for("main.logout"))
 
-            cursor.execute("""
-                INSERT INTO transactions (account_number, amount, type)
-                VALUES (%s, %s, 'deposit')
-            """, (account_number, amount))
-
-            mysql.connection.commit()
-            cursor.close()
+            users.invalidate(session["user"])
+            hub.publish(session["user"], "balance", {"type": "deposit", "amount": amount})
 
             flash(f"Successfully deposited ${amount:.2f}!", "success")
 
@@ -161,24 +193,60 @@ def deposit():
 
     return render_template("deposit.html")
 
+def load_recipient(account_number):
+    cursor = db.cursor()
+    cursor.execute("SELECT name, email FROM users WHERE account_number = %s", (account_number,))
+    row = cursor.fetchone()
+    cursor.close()
+    return {"name": row[0], "email": row[1]} if row else None
+
+def find_recipient(account_number):
+    return recipients.lookup(account_number, load_recipient)
+
+def publish_transfer(sender_email, recipient_email, sender_account, recipient_account, amount):
+    users.invalidate(sender_email, recipient_email)
+    hub.publish(sender_email, "balance", {"type": "transfer_out", "amount": amount, "account": recipient_account})
+    hub.publish(recipient_email, "balance", {"type": "transfer_in", "amount": amount, "account": sender_account})
+
+def journaled():
+    return current_app.config["JOURNAL_ENABLED"]
+
+def apply_deposit(account_number, amount):
+    """Records a deposit, through the journal when JOURNAL_ENABLED; False if the account is gone."""
+    if journaled():
+        return append_deposit(db.connection, account_number, amount, key=g.get("idempotency_key"))
+    return make_deposit(db.connection, account_number, amount)
+
+def apply_transfer(sender, recipient, amount):
+    if journaled():
+        return append_transfer(db.connection, sender, recipient, amount, key=g.get("idempotency_key"))
+    return transfer(db.connection, sender, recipient, amount)
+
+def history_page(cursor, account_number, limit, before=None):
+    rows = list(iter_history(
+        cursor, account_number, limit + 1, before,
+        columns="id, account_number, recipient_account, amount, type, created_at, recipient_account",
+        archived_before=archived_before(),
+    ))
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1][5], page[-1][0]) if len(rows) > limit else None
+    return page, next_cursor
+
 @main.route("/transactions", methods=["GET", "POST"])
 def transactions():
     if "user" not in session:
         flash("Please log in first!", "warning")
         return redirect(url_for("main.login"))
 
-    cursor = mysql.connection.cursor()
-    
-    cursor.execute("SELECT account_number, transaction_pin FROM users WHERE email = %s", (session["user"],))
-    result = cursor.fetchone()
+    fields = ("account_number", "transaction_pin") if request.method == "POST" else ("account_number",)
+    user = users.current(*fields)
+    cursor = db.cursor()
 
     transactions = []
     account_number = None
 
-    if result:
-        account_number = result[0] 
-        stored_pin = result[1]      
-        session['user_account_number'] = account_number
+    if user:
+        account_number = user["account_number"]
         
         if request.method == "POST":
             recipient_account = request.form.get("account_number")
@@ -188,14 +256,9 @@ def transactions():
             def render_error(msg, category="danger"):
                 flash(msg, category)
                 
-                cursor.execute("""
-                    SELECT * FROM transactions 
-                    WHERE account_number = %s OR recipient_account = %s
-                    ORDER BY created_at DESC
-                """, (account_number, account_number))
-                transactions = cursor.fetchall()
+                transactions, next_cursor = history_page(cursor, account_number, DEFAULT_PAGE_SIZE)
                 
-                return render_template("transactions.html", transactions=transactions, user_account=account_number)
+                return render_template("transactions.html", transactions=transactions, user_account=account_number, next_cursor=next_cursor)
 
             if not recipient_account or not amount_str or not entered_pin:
                 return render_error("Please fill in all fields.")
@@ -210,48 +273,38 @@ def transactions():
             if recipient_account == account_number:
                 return render_error("You cannot transfer money to your own account.")
 
-            cursor.execute("SELECT * FROM users WHERE account_number = %s", (recipient_account,))
-            recipient = cursor.fetchone()
+            recipient = find_recipient(recipient_account)
             if not recipient:
                 return render_error("Recipient account not found.")
 
-            if entered_pin != stored_pin:
+            if entered_pin != user["transaction_pin"]:
                 return render_error("Invalid transaction PIN!")
 
-            cursor.execute("SELECT balance FROM users WHERE account_number = %s", (account_number,))
-            sender_balance = cursor.fetchone()[0]
-            if sender_balance < amount:
-                return render_error("Insufficient balance.")
-
             try:
-                cursor.execute("UPDATE users SET balance = balance - %s WHERE account_number = %s", (amount, account_number))
-                cursor.execute("UPDATE users SET balance = balance + %s WHERE account_number = %s", (amount, recipient_account))
-
-                cursor.execute(
-                    "INSERT INTO transactions (account_number, recipient_account, amount, type) VALUES (%s, %s, %s, %s)",
-                    (account_number, recipient_account, amount, 'transfer'),
-                )
-                mysql.connection.commit()
+                apply_transfer(account_number, recipient_account, amount)
+                publish_transfer(session["user"], recipient["email"], account_number, recipient_account, amount)
                 flash("Transaction successful!", "success")
                 
                 return redirect(url_for("main.transactions"))
                 
+            except TransferError as e:
+                return render_error(str(e))
             except Exception as e:
-                mysql.connection.rollback() 
+                db.connection.rollback() 
                 return render_error(f"A database error occurred: {str(e)}")
 
+    next_cursor = None
     if account_number:
-        cursor.execute("""
-            SELECT id, account_number, recipient_account, amount, type, created_at, recipient_account
-            FROM transactions 
-            WHERE account_number = %s OR recipient_account = %s
-            ORDER BY created_at DESC
-        """, (account_number, account_number))
-        transactions = cursor.fetchall()
+        try:
+            limit, before = page_args(request.args)
+        except ValueError:
+            limit, before = DEFAULT_PAGE_SIZE, None
+
+        transactions, next_cursor = history_page(cursor, account_number, limit, before)
 
     cursor.close()
 
-    return render_template("transactions.html", transactions=transactions, user_account=account_number)
+    return render_template("transactions.html", transactions=transactions, user_account=account_number, next_cursor=next_cursor)
 
 
 @main.route("/balance")
@@ -260,42 +313,21 @@ def balance():
         flash("Please log in first!", "warning")
         return redirect(url_for("main.login"))
 
-    cursor = mysql.connection.cursor()
-
-    cursor.execute("SELECT account_number, balance FROM users WHERE email = %s", (session["user"],))
-    result = cursor.fetchone()
+    user = users.current("account_number", "balance")
 
-    if not result:
+    if not user:
         flash("User not found!", "danger")
         return redirect(url_for("main.logout"))
 
-    account_number, balance = result
-
-    cursor.execute("""
-        SELECT amount, created_at 
-        FROM transactions 
-        WHERE account_number = %s OR recipient_account = %s 
-        ORDER BY created_at DESC 
-        LIMIT 5
-    """, (account_number, account_number))
-    transactions = cursor.fetchall()
+    account_number, balance = user["account_number"], user["balance"]
 
-    cursor.execute("""
-        SELECT 
-            SUM(CASE WHEN type = 'deposit' THEN amount ELSE 0 END) AS total_deposit,
-            SUM(CASE WHEN type = 'withdrawal' OR type = 'transfer' THEN ABS(amount) ELSE 0 END) AS total_withdrawal
-        FROM transactions
-        WHERE account_number = %s
-    """, (account_number,))
+    cursor = db.cursor()
+    transactions = list(iter_history(
+        cursor, account_number, 5, columns="amount, created_at, id", archived_before=archived_before(),
+    ))
 
-
-    totals = cursor.fetchone()
-    total_deposit = totals[0] or 0
-    total_withdrawal = totals[1] or 0
-
-    total_money = total_deposit + total_withdrawal
-    spent_percent = round((total_withdrawal / total_money) * 100, 2) if total_money > 0 else 0
-    saved_percent = 100 - spent_percent if total_money > 0 else 0
+    total_deposit, total_withdrawal = account_totals(cursor, account_number, journaled())
+    spent_percent, saved_percent = spending_split(total_deposit, total_withdrawal)
 
     cursor.close()
 
@@ -315,16 +347,15 @@ def profile():
         flash("Please log in first!", "warning")
         return redirect(url_for("main.login"))
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT name, email, account_number, balance FROM users WHERE email = %s", (session["user"],))
-    user_data = cursor.fetchone()   
-    cursor.close()
+    user = users.current("name", "email", "account_number", "balance")
+    user_data = (user["name"], user["email"], user["account_number"], user["balance"]) if user else None
 
     return render_template("profile.html", user=user_data)
 
 @main.route("/logout")
 def logout():
     session.pop("user", None)
+    session.pop("user_account_number", None)
     flash("You have been logged out.", "info")
     return redirect(url_for("main.index"))
 
@@ -334,29 +365,35 @@ def delete_account():
         flash("Please log in first!", "warning")
         return redirect(url_for("main.login"))
 
-    cursor = mysql.connection.cursor()
-
-    cursor.execute("SELECT account_number FROM users WHERE email = %s", (session["user"],))
-    result = cursor.fetchone()
+    user = users.current("account_number")
 
-    if result:
-        account_number = result[0]
-
-        cursor.execute("""
-            DELETE FROM transactions 
-            WHERE account_number = %s OR recipient_account = %s
-        """, (account_number, account_number))
+    if user:
+        account_number = user["account_number"]
+        if journaled():
+            drain(db.connection, account_number)
+
+        cursor = db.cursor()
+        forget_account(cursor, account_number)
+        analytics.forget_account(cursor, account_number)
+        forget_imports(cursor, account_number)
+        bump_counterparties(cursor, account_number)
+        cursor.execute("DELETE FROM transactions WHERE account_number = %s", (account_number,))
+        cursor.execute("DELETE FROM transactions WHERE recipient_account = %s", (account_number,))
+        cursor.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE account_number = %s", (account_number,))
+        cursor.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE recipient_account = %s", (account_number,))
 
         cursor.execute("DELETE FROM users WHERE email = %s", (session["user"],))
 
-        mysql.connection.commit()
+        db.connection.commit()
+        recipients.invalidate(account_number)
+        users.invalidate(session["user"])
 
         cursor.close()
         session.pop("user", None)
+        session.pop("user_account_number", None)
         flash("Your account has been deleted permanently.", "info")
         return redirect(url_for("main.index"))
 
-    cursor.close()
     flash("User not found.", "danger")
     return redirect(url_for("main.profile"))
 
@@ -373,6 +410,44 @@ def api_get_flash_messages():
     return jsonify({"success": True, "messages": formatted_messages}), 200
 
 
+@api.route("/events", methods=["GET"])
+def api_events():
+    """Server-Sent Events stream of flash messages and balance changes for the current user."""
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    release = hub.claim_stream()
+    if release is None:
+        # Every stream slot of this worker is taken; the client polls /api/flash instead
+        return jsonify({"success": False, "message": "Too many open streams"}), 503, {"Retry-After": "30"}
+
+    # Hand over anything flashed before the stream opened; the session cookie
+    # is written with the response headers, before the body starts streaming.
+    pending = [{"message": message, "type": category}
+               for category, message in get_flashed_messages(with_categories=True)]
+    initial = [("flash", {"messages": pending})] if pending else []
+
+    response = Response(
+        hub.stream(session["user"], initial),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(release)
+    return response
+
+
+@api.after_request
+def push_flashes(response):
+    # Deliver flashes straight to the user's open event streams. If nobody is
+    # listening they stay in the session for the next /api/flash read.
+    flashes = session.get("_flashes") if "user" in session else None
+    if flashes:
+        messages = [{"message": message, "type": category} for category, message in flashes]
+        if hub.publish(session["user"], "flash", {"messages": messages}):
+            session.pop("_flashes", None)
+    return response
+
+
 @api.route("/login", methods=["POST"])
 def api_login():
     data = request.get_json()
@@ -383,15 +458,11 @@ def api_login():
         flash("Email and password are required.", "danger")
         return jsonify({"success": False}), 400
 
-    cursor = mysql.connection.cursor()
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
-    cursor.execute("SELECT id, name, email FROM users WHERE email = %s AND password_hash = %s",
-                   (email, password_hash))
-    user = cursor.fetchone()
-    cursor.close()
+    user = authenticate(email, password, "id, name, email, account_number")
 
     if user:
         session["user"] = email
+        session["user_account_number"] = user[3]
         flash("Login successful!", "success")
         return jsonify({
             "success": True,
@@ -419,12 +490,11 @@ def api_register():
         flash("All fields are required.", "danger")
         return jsonify({"success": False}), 400
 
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
-
     try:
-        cursor = mysql.connection.cursor()
+        cursor = db.cursor()
         cursor.execute(
-            "SELECT email, account_number FROM users WHERE email = %s OR account_number = %s",
+            "SELECT email, account_number FROM users WHERE email = %s "
+            "UNION ALL SELECT email, account_number FROM users WHERE account_number = %s",
             (email, account_number)
         )
         existing_user = cursor.fetchone()
@@ -439,15 +509,18 @@ def api_register():
             cursor.close()
             return jsonify({"success": False}), 409
 
+        password_hash = passwords.hash(password)
         cursor.execute( """
             INSERT INTO users (name, account_number, transaction_pin, email, password_hash, balance)
             VALUES (%s, %s, %s, %s, %s, %s)
         """, (name, account_number, transaction_pin, email, password_hash, 0.00))
 
-        mysql.connection.commit()
+        db.connection.commit()
+        recipients.invalidate(account_number)
         cursor.close()
 
         session["user"] = email
+        session["user_account_number"] = account_number
         flash("Registration successful!", "success")
         return jsonify({"success": True}), 201
 
@@ -457,176 +530,359 @@ def api_register():
 
 
 @api.route("/dashboard", methods=["GET"])
+@conditional
 def api_dashboard():
     # ... (GET method, no flash needed) ...
     if "user" not in session:
         return jsonify({"success": False, "message": "Unauthorized"}), 401
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT name, balance FROM users WHERE email = %s", (session["user"],))
-    user_data = cursor.fetchone()
-    cursor.close()
+    user = users.current("name", "balance")
 
-    if not user_data:
+    if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
 
     return jsonify({
         "success": True,
-        "name": user_data[0],
-        "balance": float(user_data[1]) 
+        "name": user["name"],
+        "balance": float(user["balance"]) 
     }), 200
 
 
 @api.route("/deposit", methods=["POST"])
+@idempotent
 def api_deposit():
     if "user" not in session:
         flash("Unauthorized access.", "danger")
         return jsonify({"success": False}), 401
 
     data = request.get_json()
-    amount = data.get("amount")
-
-    if not amount:
-        flash("Amount is required.", "danger")
-        return jsonify({"success": False}), 400
 
+    # Validation and the deposit itself are shared with the async API
     try:
-        amount = float(amount)
-        if amount <= 0:
-            flash("Amount must be greater than $0.", "danger")
-            return jsonify({"success": False}), 400
-        
-        MAX_DEPOSIT_LIMIT = 100000
-        if amount > MAX_DEPOSIT_LIMIT:
-            flash(f"Limit exceeded. Max: ${MAX_DEPOSIT_LIMIT:,.0f}", "danger")
-            return jsonify({"success": False}), 400
+        amount = deposit_amount(data.get("amount"))
+        account_number = users.account_number()
 
-        cursor = mysql.connection.cursor()
-        
-        cursor.execute("UPDATE users SET balance = balance + %s WHERE email = %s", (amount, session["user"]))
-        cursor.execute("SELECT account_number FROM users WHERE email = %s", (session["user"],))
-        account_number = cursor.fetchone()[0]
-
-        cursor.execute("""
-            INSERT INTO transactions (account_number, amount, type)
-            VALUES (%s, %s, 'deposit')
-        """, (account_number, amount))
+        if not apply_deposit(account_number, amount):
+            raise AccountNotFound("User not found.")
 
-        mysql.connection.commit()
-        cursor.close()
+        users.invalidate(session["user"])
+        hub.publish(session["user"], "balance", {"type": "deposit", "amount": amount})
 
         flash(f"Successfully deposited ${amount:.2f}!", "success")
         return jsonify({"success": True}), 200
 
-    except ValueError:
-        flash("Invalid amount format.", "danger")
-        return jsonify({"success": False}), 400
+    except TransferError as e:
+        flash(str(e), "danger")
+        return jsonify({"success": False}), e.status
     except Exception as e:
         flash(f"Error processing deposit: {str(e)}", "danger")
         return jsonify({"success": False}), 500
 
 
 @api.route("/transactions", methods=["GET", "POST"])
+@idempotent
+@conditional
 def api_transactions():
     if "user" not in session:
         return jsonify({"success": False, "message": "Unauthorized"}), 401
 
-    cursor = mysql.connection.cursor()
-
-    cursor.execute("SELECT account_number, transaction_pin FROM users WHERE email = %s", (session["user"],))
-    user_data = cursor.fetchone()
+    fields = ("account_number", "transaction_pin") if request.method == "POST" else ("account_number",)
+    user = users.current(*fields)
     
-    if not user_data:
+    if not user:
         flash("User not found.", "danger")
         return jsonify({"success": False}), 404
 
-    account_number = user_data[0]
-    stored_pin = user_data[1]
+    account_number = user["account_number"]
 
     # --- HANDLE TRANSFER (POST) ---
     if request.method == "POST":
         data = request.get_json()
-        recipient_account = data.get("recipient_account")
-        amount_str = data.get("amount")
-        entered_pin = data.get("transaction_pin")
-
-        if not all([recipient_account, amount_str, entered_pin]):
-            flash("All fields are required.", "danger")
-            return jsonify({"success": False}), 400
-
-        if recipient_account == account_number:
-            flash("Cannot transfer to yourself.", "danger")
-            return jsonify({"success": False}), 400
-        
-        if entered_pin != stored_pin:
-            flash("Invalid transaction PIN!", "danger")
-            return jsonify({"success": False}), 403
-
 
+        # Validation and the transfer itself are shared with the async API
         try:
-            amount = float(amount_str)
-            if amount <= 0:
-                flash("Amount must be positive.", "danger")
-                return jsonify({"success": False}), 400
-            
-            # Check Sender Balance
-            cursor.execute("SELECT balance FROM users WHERE account_number = %s", (account_number,))
-            sender_balance = cursor.fetchone()[0]
-
-            if sender_balance < amount:
-                flash("Insufficient balance.", "danger")
-                return jsonify({"success": False}), 400
+            recipient_account, amount = transfer_request(data, account_number, user["transaction_pin"])
 
             # Check Recipient Existence
-            cursor.execute("SELECT * FROM users WHERE account_number = %s", (recipient_account,))
-            if not cursor.fetchone():
-                flash("Recipient account not found.", "danger")
-                return jsonify({"success": False}), 404
-            cursor.execute("UPDATE users SET balance = balance - %s WHERE account_number = %s", (amount, account_number))
-            cursor.execute("UPDATE users SET balance = balance + %s WHERE account_number = %s", (amount, recipient_account))
-            
-            cursor.execute("""
-                INSERT INTO transactions (account_number, recipient_account, amount, type) 
-                VALUES (%s, %s, %s, 'transfer')
-            """, (account_number, recipient_account, amount))
-            
-            mysql.connection.commit()
-            cursor.close()
+            recipient = find_recipient(recipient_account)
+            if not recipient:
+                raise AccountNotFound()
+
+            # Balance check, debit and credit happen in one locked statement
+            apply_transfer(account_number, recipient_account, amount)
+            publish_transfer(session["user"], recipient["email"], account_number, recipient_account, amount)
             
             flash("Transaction successful!", "success")
             return jsonify({"success": True}), 200
 
-        except ValueError:
-            flash("Invalid amount.", "danger")
-            return jsonify({"success": False}), 400
+        except TransferError as e:
+            flash(str(e), "danger")
+            return jsonify({"success": False}), e.status
         except Exception as e:
-            mysql.connection.rollback()
+            db.connection.rollback()
             flash(f"A database error occurred: {str(e)}", "danger")
             return jsonify({"success": False}), 500
 
     # --- HANDLE HISTORY (GET) ---
-    cursor.execute("""
-        SELECT account_number, recipient_account, amount, type, created_at, id
-        FROM transactions 
-        WHERE account_number = %s OR recipient_account = %s
-        ORDER BY created_at DESC
-    """, (account_number, account_number))
-    
-    rows = cursor.fetchall()
+    try:
+        limit, before = page_args(request.args)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid cursor"}), 400
+
+    cursor = db.cursor()
+    horizon = archived_before()
+
+    def generate():
+        try:
+            rows = iter_history(cursor, account_number, limit + 1, before, archived_before=horizon)
+            yield from stream_history(rows, limit, my_account=account_number)
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/json"), 200
+
+def read_batch_body():
+    """Returns ``(pin, items)`` from a JSON body or an NDJSON stream of items.
+
+    NDJSON bodies carry the PIN in the ``X-Transaction-Pin`` header and are read
+    line by line. Raises ValueError on malformed input.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                items.append(json.loads(line))
+            if len(items) > MAX_BATCH_ITEMS:
+                break
+        return request.headers.get("X-Transaction-Pin"), items
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+        raise ValueError("Expected a JSON object with an items list")
+    return data.get("transaction_pin") or request.headers.get("X-Transaction-Pin"), data["items"]
+
+
+def batch_item(raw, account_number):
+    """Validates one batch item; returns ``(kind, recipient, amount)`` or raises ValueError."""
+    if not isinstance(raw, dict):
+        raise ValueError("Invalid item.")
+
+    kind = raw.get("type", "transfer")
+    if kind not in ("transfer", "deposit"):
+        raise ValueError("Type must be transfer or deposit.")
+
+    try:
+        amount = round(float(raw.get("amount")), 2)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid amount.")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("Amount must be positive.")
+
+    if kind == "deposit":
+        if amount > MAX_DEPOSIT_LIMIT:
+            raise ValueError(f"Limit exceeded. Max: ${MAX_DEPOSIT_LIMIT:,.0f}")
+        return kind, None, amount
+
+    recipient = raw.get("recipient_account")
+    if not recipient:
+        raise ValueError("Recipient account is required.")
+    recipient = str(recipient)
+    if recipient == account_number:
+        raise ValueError("Cannot transfer to yourself.")
+    return kind, recipient, amount
+
+
+@api.route("/transactions/batch", methods=["POST"])
+def api_transactions_batch():
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    user = users.current("account_number", "transaction_pin")
+
+    if not user:
+        flash("User not found.", "danger")
+        return jsonify({"success": False}), 404
+
+    account_number, stored_pin = user["account_number"], user["transaction_pin"]
+
+    try:
+        entered_pin, raw_items = read_batch_body()
+    except ValueError:
+        return jsonify({"success": False, "message": "Malformed batch body"}), 400
+
+    if not raw_items:
+        return jsonify({"success": False, "message": "No items to process"}), 400
+    if len(raw_items) > MAX_BATCH_ITEMS:
+        return jsonify({"success": False, "message": f"At most {MAX_BATCH_ITEMS} items per batch"}), 413
+
+    if entered_pin != stored_pin:
+        flash("Invalid transaction PIN!", "danger")
+        return jsonify({"success": False}), 403
+
+    results = {}
+    items = []
+    for index, raw in enumerate(raw_items):
+        try:
+            items.append((index, *batch_item(raw, account_number)))
+        except ValueError as e:
+            results[index] = (False, str(e))
+
+    try:
+        lock_sender = LOCK_SENDER_WITH_PENDING if journaled() else LOCK_SENDER
+        applied, recipients = batch_transfer(db.connection, account_number, items, lock_sender=lock_sender)
+    except TransferError as e:
+        flash(str(e), "danger")
+        return jsonify({"success": False}), e.status
+    except Exception as e:
+        db.connection.rollback()
+        flash(f"A database error occurred: {str(e)}", "danger")
+        return jsonify({"success": False}), 500
+    results.update(applied)
+    users.invalidate(session["user"], *recipients.values())
+
+    received = defaultdict(float)
+    for index, kind, recipient, amount in items:
+        if kind == "transfer" and results[index][0]:
+            received[recipient] += amount
+    for recipient, amount in received.items():
+        hub.publish(recipients[recipient], "balance", {"type": "transfer_in", "amount": amount, "account": account_number})
+
+    succeeded = sum(1 for ok, _ in results.values() if ok)
+    failed = len(results) - succeeded
+    if succeeded:
+        hub.publish(session["user"], "balance", {"type": "batch", "count": succeeded})
+    flash(f"Batch processed: {succeeded} succeeded, {failed} failed.", "success" if not failed else "warning")
+
+    return jsonify({
+        "success": True,
+        "applied": succeeded,
+        "failed": failed,
+        "results": [
+            {"index": index, "success": ok, "message": message}
+            for index, (ok, message) in sorted(results.items())
+        ],
+    }), 200
+
+
+@api.route("/export", methods=["GET"])
+def api_export():
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    user = users.current("account_number")
+
+    if not user:
+        return jsonify({"success": False, "message": "User not found"}), 404
+
+    try:
+        fmt, start, end = export_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    account_number = user["account_number"]
+
+    # A connection of its own: the unbuffered cursor ties it up until the last row is read
+    pool = db.pool
+    entry = pool.acquire()
+    cursor = db.streaming_cursor(entry.conn)
+    try:
+        chunks = export(entry.conn, cursor, account_number, fmt, start, end, archived_before())
+    except LookupError:
+        pool.release(entry, discard=True)
+        return jsonify({"success": False, "message": "User not found"}), 404
+    except Exception:
+        pool.release(entry, discard=True)
+        raise
+
+    finished = False
+
+    def generate():
+        nonlocal finished
+        yield from chunks
+        finished = True
+
+    def release():
+        # Closing the cursor early would first read every remaining row, so drop the connection instead
+        if not finished:
+            pool.release(entry, discard=True)
+            return
+        try:
+            cursor.close()
+            entry.conn.rollback()
+        except Exception:
+            pool.release(entry, discard=True)
+            return
+        pool.release(entry)
+
+    body = generate()
+    headers = {
+        "Content-Disposition": f'attachment; filename="statement-{account_number}-{start}-{end}.{fmt}"',
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding",
+    }
+    if request.accept_encodings["gzip"]:
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+
+    response = Response(body, mimetype=FORMATS[fmt], headers=headers)
+    response.call_on_close(release)
+    return response
+
+
+@api.route("/import", methods=["POST"])
+def api_import():
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    user = users.current("account_number", "transaction_pin")
+
+    if not user:
+        return jsonify({"success": False, "message": "User not found"}), 404
+
+    # A multipart "statement" file, or the raw CSV/OFX as the body
+    upload = request.files.get("statement")
+    entered_pin = request.headers.get("X-Transaction-Pin") or request.form.get("transaction_pin")
+    if entered_pin != user["transaction_pin"]:
+        flash("Invalid transaction PIN!", "danger")
+        return jsonify({"success": False}), 403
+
+    try:
+        path = statements.receive(upload.stream if upload else request.stream)
+    except StatementError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    filename = upload.filename if upload else request.headers.get("X-Filename", "")
+    import_id = statements.submit(path, user["account_number"], session["user"], filename or "", MAX_DEPOSIT_LIMIT)
+
+    # Parsing and loading run in the background; poll the status URL
+    return jsonify({
+        "success": True,
+        "import_id": import_id,
+        "status_url": url_for("api.api_import_status", import_id=import_id),
+    }), 202
+
+
+@api.route("/import/<int:import_id>", methods=["GET"])
+def api_import_status(import_id):
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    user = users.current("account_number")
+
+    if not user:
+        return jsonify({"success": False, "message": "User not found"}), 404
+
+    cursor = db.cursor()
+    progress = progress_of(cursor, import_id, user["account_number"])
     cursor.close()
 
-    history = []
-    for row in rows:
-        history.append({
-            "account_number": row[0],
-            "recipient_account": row[1],
-            "amount": float(row[2]),
-            "type": row[3],
-            "date": str(row[4]),
-            "id": row[5]
-        })
+    if not progress:
+        return jsonify({"success": False, "message": "Import not found"}), 404
+
+    progress["net_amount"] = float(progress["net_amount"])
+    return jsonify({"success": True, "import": progress}), 200
 
-    return jsonify({"success": True, "transactions": history, "my_account": account_number}), 200
 
 @api.route("/recipient_name", methods=["GET"])
 def api_recipient_name():
@@ -637,48 +893,34 @@ def api_recipient_name():
     if not account_number:
         return jsonify({"success": False, "message": "Account number is required"}), 400
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT name FROM users WHERE account_number = %s", (account_number,))
-    result = cursor.fetchone()
-    cursor.close()
+    result = find_recipient(account_number)
 
     if result:
-        return jsonify({"success": True, "name": result[0]}), 200
+        return jsonify({"success": True, "name": result["name"]}), 200
     else:
         return jsonify({"success": False, "message": "Account not found"}), 404
 
 
 @api.route("/balance", methods=["GET"])
+@conditional
 def api_balance_stats():
     if "user" not in session:
         return jsonify({"success": False, "message": "Unauthorized"}), 401
 
-    cursor = mysql.connection.cursor()
-    cursor.execute("SELECT account_number, balance FROM users WHERE email = %s", (session["user"],))
-    user_data = cursor.fetchone()
+    user = users.current("account_number", "balance")
 
-    if not user_data:
+    if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
 
-    account_number = user_data[0]
-    balance = float(user_data[1])
-
-    # Calculate Totals
-    cursor.execute("""
-        SELECT 
-            SUM(CASE WHEN type = 'deposit' THEN amount ELSE 0 END) AS total_deposit,
-            SUM(CASE WHEN type = 'withdrawal' OR type = 'transfer' THEN ABS(amount) ELSE 0 END) AS total_withdrawal
-        FROM transactions
-        WHERE account_number = %s
-    """, (account_number,))
-    
-    totals = cursor.fetchone()
-    total_deposit = float(totals[0] or 0)
-    total_withdrawal = float(totals[1] or 0)
+    account_number = user["account_number"]
+    balance = float(user["balance"])
 
-    total_money = total_deposit + total_withdrawal
-    spent_percent = round((total_withdrawal / total_money) * 100, 2) if total_money > 0 else 0
-    saved_percent = 100 - spent_percent if total_money > 0 else 0
+    # Totals are kept up to date by every deposit and transfer
+    cursor = db.cursor()
+    totals = account_totals(cursor, account_number, journaled())
+    total_deposit = float(totals[0])
+    total_withdrawal = float(totals[1])
+    spent_percent, saved_percent = spending_split(total_deposit, total_withdrawal)
     
     cursor.close()
 
@@ -692,33 +934,124 @@ def api_balance_stats():
     }), 200
 
 
+@api.route("/analytics", methods=["GET"])
+def api_analytics():
+    if "user" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    user = users.current("account_number")
+
+    if not user:
+        return jsonify({"success": False, "message": "User not found"}), 404
+
+    try:
+        start, end, period, top = analytics.range_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    cursor = db.cursor()
+    summary = analytics.summarize(cursor, user["account_number"], start, end, period, top)
+    cursor.close()
+
+    for counterparty in summary["top_counterparties"]:
+        recipient = find_recipient(counterparty["account"])
+        counterparty["name"] = recipient["name"] if recipient else None
+
+    return jsonify({"success": True, **summary}), 200
+
+
+@api.route("/bootstrap", methods=["GET"])
+def api_bootstrap():
+    """Everything the app shell loads on start, in one response; ``fields`` picks the parts."""
+    try:
+        wanted = parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    logged_in = "user" in session
+    data = {"success": True}
+    if "session" in wanted:
+        data["session"] = pick({"logged_in": logged_in}, wanted["session"])
+
+    if logged_in and any(section in wanted for section in USER_SECTIONS):
+        # One row read serves every section; none at all if the session holds all they need
+        needed = {"account_number", *wanted.get("profile", ())}
+        if "balance" in wanted:
+            needed.add("balance")
+        user = users.current(*needed)
+
+        if not user:
+            return jsonify({"success": False, "message": "User not found"}), 404
+
+        account_number = user["account_number"]
+
+        if "profile" in wanted:
+            profile = {field: user[field] for field in wanted["profile"]}
+            if "balance" in profile:
+                profile["balance"] = float(profile["balance"])
+            if "profile_pic_url" in profile:
+                size = request.args.get("size", type=int)
+                profile["profile_pic_url"] = avatar_url(user["profile_pic_url"], size) or "/default-profile.png"
+            data["profile"] = profile
+
+        if "balance" in wanted:
+            data["balance"] = float(user["balance"])
+
+        cursor = db.cursor() if "stats" in wanted or "transactions" in wanted else None
+        if "stats" in wanted:
+            totals = account_totals(cursor, account_number, journaled())
+            total_deposit = float(totals[0])
+            total_withdrawal = float(totals[1])
+            spent_percent, saved_percent = spending_split(total_deposit, total_withdrawal)
+            data["stats"] = pick({
+                "total_deposit": total_deposit,
+                "total_withdrawal": total_withdrawal,
+                "spent_percent": spent_percent,
+                "saved_percent": saved_percent,
+            }, wanted["stats"])
+
+        if "transactions" in wanted:
+            limit = max(1, min(request.args.get("limit", BOOTSTRAP_LIMIT, type=int), MAX_PAGE_SIZE))
+            rows = list(iter_history(cursor, account_number, limit + 1, archived_before=archived_before()))
+            last = rows[limit - 1] if len(rows) > limit else None
+            data["transactions"] = pick({
+                "items": [history_item(row) for row in rows[:limit]],
+                "next_cursor": encode_cursor(last[4], last[5]) if last else None,
+            }, wanted["transactions"])
+        if cursor:
+            cursor.close()
+
+    if "flashes" in wanted:
+        data["flashes"] = [{"message": message, "type": category}
+                           for category, message in get_flashed_messages(with_categories=True)]
+
+    return jsonify(data), 200
+
+
 @api.route("/profile", methods=["GET"])
+@conditional
 def api_profile():
     if "user" not in session:
         return jsonify({"success": False, "message": "Unauthorized"}), 401
 
-    cursor = mysql.connection.cursor()
-    cursor.execute(
-        "SELECT name, email, account_number, balance, profile_pic_url FROM users WHERE email = %s",
-        (session["user"],),
-    )
-    row = cursor.fetchone()
-    cursor.close()
+    user = users.current("name", "email", "account_number", "balance", "profile_pic_url")
 
-    if not row:
+    if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
 
-    name, email, account_number, balance, profile_pic_url = row
+    # Pixel width the client will display the picture at, e.g. ?size=64
+    size = request.args.get("size", type=int)
+
     return (
         jsonify(
             {
                 "success": True,
                 "user": {
-                    "name": name,
-                    "email": email,
-                    "account_number": account_number,
-                    "balance": float(balance),
-                    "profile_pic_url": profile_pic_url or "/default-profile.png",
+                    "name": user["name"],
+                    "email": user["email"],
+                    "account_number": user["account_number"],
+                    "balance": float(user["balance"]),
+                    "profile_pic_url": avatar_url(user["profile_pic_url"], size) or "/default-profile.png",
                 },
             }
         ),
@@ -748,73 +1081,28 @@ def api_upload_profile_picture():
             {"success": False, "message": "Invalid file type. Allowed: png, jpg, jpeg, gif"}
         ), 400
 
-    # Read bytes to check size (safe: limit is small)
-    file_bytes = file.read()
-    if len(file_bytes) > MAX_FILE_SIZE:
-        return jsonify({"success": False, "message": "File too large (max 1MB)"}), 400
-
-    frontend_static = os.path.abspath(
-        os.path.join(current_app.root_path, "..", "static")
-    )
-    upload_folder = os.path.join(frontend_static, "profile_pics")
-    os.makedirs(upload_folder, exist_ok=True)
-
     try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT profile_pic_url FROM users WHERE email = %s", (session["user"],))
-        old = cursor.fetchone()
-        old_url = old[0] if old else None
-
-        if old_url and "profile_pics" in old_url:
-            old_name = os.path.basename(old_url)
-            old_path = os.path.join(upload_folder, old_name)
-            if os.path.exists(old_path):
-                try:
-                    os.remove(old_path)
-                except OSError:
-                    # ignore removal errors (keep it simple)
-                    pass
-    except Exception:
-        # proceed anyway if DB read fails — will surface later on update
-        old_url = None
-    finally:
-        # do not close cursor here if we will reuse it below; ensure it's closed if created
-        try:
-            cursor.close()
-        except Exception:
-            pass
-
-    # Save new file with unique name
-    ext = secure_filename(filename).rsplit(".", 1)[1].lower()
-    user_prefix = session["user"].split("@", 1)[0]
-    unique_name = f"{user_prefix}_{uuid.uuid4().hex[:8]}.{ext}"
-    file_path = os.path.join(upload_folder, unique_name)
+        upload = receive(file.stream, current_app.config["AVATAR_FOLDER"], MAX_FILE_SIZE)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
     try:
-        # write bytes to disk
-        with open(file_path, "wb") as f:
-            f.write(file_bytes)
-
-        profile_pic_url = f"http://localhost:5000/static/profile_pics/{unique_name}"
-
-        # Update DB
-        cursor = mysql.connection.cursor()
-        cursor.execute(
-            "UPDATE users SET profile_pic_url = %s WHERE email = %s",
-            (profile_pic_url, session["user"]),
-        )
-        mysql.connection.commit()
-        cursor.close()
-
-        return jsonify(
-            {"success": True, "message": "Profile picture updated", "profile_pic_url": profile_pic_url}
-        ), 200
-
+        old = users.current("profile_pic_url")
+        profile_pic_url, ready = avatars.submit(upload, session["user"], old["profile_pic_url"] if old else None)
     except Exception as e:
         # keep response minimal and simple
         current_app.logger.error("upload_profile_picture error: %s", e)
         return jsonify({"success": False, "message": "Upload failed"}), 500
 
+    # Resizing runs in the background; the URL is final and starts working once it is done
+    if ready:
+        return jsonify(
+            {"success": True, "message": "Profile picture updated", "profile_pic_url": profile_pic_url}
+        ), 200
+    return jsonify(
+        {"success": True, "message": "Profile picture is being processed", "profile_pic_url": profile_pic_url}
+    ), 202
+
 
 @api.route("/delete_account", methods=["POST"])
 def api_delete_account():
@@ -822,36 +1110,41 @@ def api_delete_account():
         flash("Unauthorized access.", "danger")
         return jsonify({"success": False}), 401
 
-    cursor = mysql.connection.cursor()
-
-    try:
-        cursor.execute("SELECT account_number FROM users WHERE email = %s", (session["user"],))
-        result = cursor.fetchone()
-
-        if not result:
-            cursor.close()
-            flash("User not found.", "danger")
-            return jsonify({"success": False}), 404
+    user = users.current("account_number")
+    if not user:
+        flash("User not found.", "danger")
+        return jsonify({"success": False}), 404
 
-        account_number = result[0]
+    account_number = user["account_number"]
+    cursor = db.cursor()
 
-        cursor.execute("""
-            DELETE FROM transactions 
-            WHERE account_number = %s OR recipient_account = %s
-        """, (account_number, account_number))
+    try:
+        if journaled():
+            drain(db.connection, account_number)
+        forget_account(cursor, account_number)
+        analytics.forget_account(cursor, account_number)
+        forget_imports(cursor, account_number)
+        bump_counterparties(cursor, account_number)
+        cursor.execute("DELETE FROM transactions WHERE account_number = %s", (account_number,))
+        cursor.execute("DELETE FROM transactions WHERE recipient_account = %s", (account_number,))
+        cursor.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE account_number = %s", (account_number,))
+        cursor.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE recipient_account = %s", (account_number,))
 
         cursor.execute("DELETE FROM users WHERE email = %s", (session["user"],))
 
-        mysql.connection.commit()
+        db.connection.commit()
+        recipients.invalidate(account_number)
+        users.invalidate(session["user"])
         
         session.pop("user", None)
+        session.pop("user_account_number", None)
         flash("Account deleted permanently.", "info")
         
         return jsonify({"success": True}), 200
 
-    except Exception as e:
-        mysql.connection.rollback()
-        print("Error deleting account:", e)
+    except Exception:
+        db.connection.rollback()
+        current_app.logger.exception("deleting account %s failed", account_number)
         flash("An error occurred during deletion.", "danger")
         return jsonify({"success": False}), 500
 
@@ -862,6 +1155,7 @@ def api_delete_account():
 @api.route("/logout", methods=["POST"])
 def api_logout():
     session.pop("user", None)
+    session.pop("user_account_number", None)
     flash("You have been logged out.", "info")
     return jsonify({"success": True}), 200
 
@@ -0,0 +1,213 @@
+import click
+
+from . import analytics, archive, journal, sessions, stats
+from .history import ACCOUNT_ARCHIVED_BEFORE, history_query
+from .idempotency import LOAD_RECORD as LOAD_IDEMPOTENCY_RECORD, create_table as create_idempotency_table
+from .statements import create_tables as create_statement_tables
+from .user_context import JOURNALED_USER_QUERY
+from .versions import ACCOUNT_VERSION, JOURNALED_ACCOUNT_VERSION
+
+
+def _create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            account_number VARCHAR(20) NOT NULL,
+            transaction_pin VARCHAR(10) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            balance DECIMAL(15, 2) NOT NULL DEFAULT 0.00,
+            profile_pic_url VARCHAR(512) NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            account_number VARCHAR(20) NOT NULL,
+            recipient_account VARCHAR(20) NULL,
+            amount DECIMAL(15, 2) NOT NULL,
+            type VARCHAR(20) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+
+
+def _add_history_indexes(cursor):
+    add_index(cursor, "users", "uq_users_email", "email", unique=True)
+    add_index(cursor, "users", "uq_users_account_number", "account_number", unique=True)
+    add_index(cursor, "transactions", "idx_tx_account_history", "account_number, created_at, id")
+    add_index(cursor, "transactions", "idx_tx_recipient_history", "recipient_account, created_at, id")
+
+
+def _add_account_stats(cursor):
+    stats.create_table(cursor)
+    stats.backfill(cursor, "transactions")
+
+
+def _add_account_versions(cursor):
+    add_column(cursor, "users", "version", "BIGINT UNSIGNED NOT NULL DEFAULT 0")
+
+
+def _add_archive_horizons(cursor):
+    add_column(cursor, "account_stats", "archived_before", "DATETIME NULL")
+    cursor.execute(stats.ARCHIVE_HORIZONS)
+
+
+def _add_rollups(cursor):
+    analytics.create_tables(cursor)
+    cursor.execute(f"""
+        INSERT INTO daily_rollups (account_number, day, counterparty, income, outflow)
+        {analytics.LEDGER_ROLLUPS.format(ledger="transactions")}
+    """)
+
+
+# Applied in order; a migration's version is its position in this list.
+# Never edit or reorder an entry that has shipped, only append new ones.
+MIGRATIONS = [
+    ("create users and transactions", _create_tables),
+    ("add account history indexes", _add_history_indexes),
+    ("add account_stats summary", _add_account_stats),
+    ("add ledger_journal outbox", journal.create_table),
+    ("add analytics rollups", _add_rollups),
+    ("add transactions archive", archive.create_tables),
+    ("add statement imports", create_statement_tables),
+    ("add account versions", _add_account_versions),
+    ("add server-side sessions", sessions.create_table),
+    ("add idempotency keys", create_idempotency_table),
+    ("add per-account archive horizons", _add_archive_horizons),
+]
+
+
+def add_index(cursor, table, name, columns, unique=False):
+    """Creates an index unless one with the same name already exists."""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone():
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"CREATE {kind} {name} ON {table} ({columns})")
+
+
+def add_column(cursor, table, name, definition):
+    """Adds a column unless the table already has one with that name."""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone():
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def current_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def migrate(connection, target=None):
+    """Applies every pending migration up to ``target`` and returns the new version.
+
+    MySQL commits DDL implicitly, so each migration is recorded right after it
+    runs; a failure leaves the schema at the last migration that finished.
+    """
+    cursor = connection.cursor()
+    try:
+        version = current_version(cursor)
+        target = len(MIGRATIONS) if target is None else target
+
+        for number, (description, step) in enumerate(MIGRATIONS, start=1):
+            if number <= version or number > target:
+                continue
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (number, description),
+            )
+            connection.commit()
+            version = number
+
+        return version
+    finally:
+        cursor.close()
+
+
+HOT_TABLES = (
+    "users", "transactions", "transactions_archive", "account_stats", "ledger_journal", "daily_rollups",
+    "rollup_deltas", "sessions", "idempotency_keys",
+)
+
+
+def hot_queries():
+    """The statements every page view depends on, with placeholder parameters."""
+    history_sql, history_params = history_query("0000000000", 50)
+    keyset_sql, keyset_params = history_query("0000000000", 50, ("2000-01-01 00:00:00", 1))
+    archived_sql, archived_params = history_query("0000000000", 50, ("2000-01-01 00:00:00", 1), archived=True)
+    return [
+        ("user by email", "SELECT account_number, balance FROM users WHERE email = %s", ("nobody@example.com",)),
+        ("user by account number", "SELECT name FROM users WHERE account_number = %s", ("0000000000",)),
+        ("history first page", history_sql, history_params),
+        ("history next page", keyset_sql, keyset_params),
+        ("history page with archive", archived_sql, archived_params),
+        ("account archive horizon", ACCOUNT_ARCHIVED_BEFORE, ("0000000000",)),
+        ("account totals", "SELECT total_deposit, total_withdrawal FROM account_stats WHERE account_number = %s",
+         ("0000000000",)),
+        ("journaled user by email", JOURNALED_USER_QUERY, ("nobody@example.com",)),
+        ("account version", ACCOUNT_VERSION, ("0000000000",)),
+        ("journaled account version", JOURNALED_ACCOUNT_VERSION, ("0000000000",)),
+        ("analytics range", analytics.RANGE_TOTALS, ("0000000000", "2000-01-01", "2000-12-31") * 2),
+        ("session by id", sessions.LOAD_SESSION, ("0" * 43,)),
+        ("idempotency key", LOAD_IDEMPOTENCY_RECORD, (bytes(16),)),
+    ]
+
+
+def full_scans(connection):
+    """Runs EXPLAIN on every hot query and returns ``(query, table)`` pairs read with a full scan."""
+    cursor = connection.cursor()
+    offenders = []
+    try:
+        for name, sql, params in hot_queries():
+            cursor.execute("EXPLAIN " + sql, params)
+            columns = [col[0] for col in cursor.description]
+            for row in cursor.fetchall():
+                plan = dict(zip(columns, row))
+                if plan.get("type") == "ALL" and plan.get("table") in HOT_TABLES:
+                    offenders.append((name, plan["table"]))
+    finally:
+        cursor.close()
+    return offenders
+
+
+def init_app(app, db):
+    @app.cli.command("migrate-db")
+    @click.option("--target", type=int, default=None, help="Stop at this schema version.")
+    def migrate_db_command(target):
+        """Apply pending schema migrations."""
+        version = migrate(db.connection, target)
+        click.echo(f"Schema is at version {version}.")
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans_command():
+        """Fail if a hot query is planned as a full table scan."""
+        offenders = full_scans(db.connection)
+        for name, table in offenders:
+            click.echo(f"FULL SCAN: {name} reads {table} without an index", err=True)
+        if offenders:
+            raise click.ClickException(f"{len(offenders)} hot queries regressed to a full scan")
+        click.echo("All hot queries use an index.")
+
+    if app.config.get("AUTO_MIGRATE"):
+        with app.app_context():
+            migrate(db.connection)
@@ -0,0 +1,145 @@
+import os
+
+import click
+import MySQLdb
+from flask import current_app, jsonify
+
+from . import journal
+from .db import PoolTimeout, db
+from .events import hub
+
+# Backends whose "local" setting keeps their state inside one process
+PROCESS_LOCAL_BACKENDS = ("EVENTS_BACKEND", "IDEMPOTENCY_BACKEND", "SESSION_BACKEND")
+
+
+def default_workers():
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def process_local_backends(config):
+    """The ``*_BACKEND`` settings that would not be shared between worker processes."""
+    return [key for key in PROCESS_LOCAL_BACKENDS if config.get(key) == "local"]
+
+
+def worker_count(app, workers=None):
+    """How many workers to fork: ``workers``, else ``SERVER_WORKERS``, else ``default_workers()``.
+
+    The default drops to one worker, with a warning, while a backend is
+    process-local. Asking for more than one in that case raises ValueError:
+    events published in one worker would never reach streams held by another,
+    and a retried request could be applied twice.
+    """
+    local = process_local_backends(app.config)
+    workers = workers or app.config["SERVER_WORKERS"]
+    if workers is None:
+        if not local:
+            return default_workers()
+        app.logger.warning(
+            "%s = \"local\": serving with one worker; set them to a redis:// URL to run more",
+            ", ".join(local),
+        )
+        return 1
+    if workers > 1 and local:
+        raise ValueError(
+            f"{', '.join(local)} = \"local\" only works with one worker process; "
+            "set them to a redis:// URL or run with --workers 1"
+        )
+    return workers
+
+
+def options(app, bind=None, workers=None):
+    """Gunicorn settings for ``app``, taken from its ``SERVER_*`` config."""
+    config = app.config
+    settings = {
+        "bind": bind or config["SERVER_BIND"],
+        "workers": worker_count(app, workers),
+        "max_requests": config["SERVER_MAX_REQUESTS"],
+        "max_requests_jitter": config["SERVER_MAX_REQUESTS_JITTER"],
+        "graceful_timeout": config["SERVER_GRACEFUL_TIMEOUT"],
+        "timeout": config["SERVER_TIMEOUT"],
+        "preload_app": True,
+        "when_ready": lambda server: close_pool(app),
+        "post_fork": lambda server, worker: warm_up(app, worker),
+        "worker_exit": lambda server, worker: close_pool(app),
+    }
+    if config.get("ASYNC_API"):
+        settings["worker_class"] = "uvicorn.workers.UvicornWorker"
+    else:
+        settings["worker_class"] = "gthread"
+        settings["threads"] = config["SERVER_THREADS"]
+    return settings
+
+
+def close_pool(app):
+    # The master may have opened connections (AUTO_MIGRATE); workers must not share them
+    pool = app.extensions.get("db_pool")
+    if pool is not None and pool.pid == os.getpid():
+        pool.close()
+    app.extensions["db_pool"] = None
+
+
+def warm_up(app, worker):
+    """Opens this worker's own connection pool before it accepts requests."""
+    with app.app_context():
+        try:
+            db.pool
+        except (MySQLdb.Error, PoolTimeout) as e:
+            # Stay up; /ready reports 503 until the database is reachable
+            worker.log.warning("worker %s could not open its connection pool: %s", worker.pid, e)
+    # Replays anything a crashed worker left in the journal without waiting for a request
+    journal.start(app)
+
+
+def serve(app, **overrides):
+    from gunicorn.app.base import BaseApplication
+
+    if not app.config.get("ASYNC_API") and app.config["EVENTS_MAX_STREAMS"] is None:
+        # Each stream holds a gthread worker thread; keep one for everything else
+        hub.limit_streams(app, max(app.config["SERVER_THREADS"] - 1, 1))
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options(app, **overrides).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app.asgi_app if app.config.get("ASYNC_API") else app
+
+    Server().run()
+
+
+def init_app(app, db):
+    app.config.setdefault("SERVER_BIND", "0.0.0.0:8000")
+    app.config.setdefault("SERVER_WORKERS", None)
+    app.config.setdefault("SERVER_THREADS", 4)
+    app.config.setdefault("SERVER_MAX_REQUESTS", 10000)
+    app.config.setdefault("SERVER_MAX_REQUESTS_JITTER", 1000)
+    app.config.setdefault("SERVER_GRACEFUL_TIMEOUT", 30)
+    app.config.setdefault("SERVER_TIMEOUT", 30)
+
+    def ready():
+        """Readiness probe: 200 once this worker can reach MySQL through its pool."""
+        try:
+            db.connection.ping()
+        except (MySQLdb.Error, PoolTimeout) as e:
+            current_app.logger.warning("not ready: %s", e)
+            return jsonify({"ready": False}), 503
+        return jsonify({"ready": True, "pid": os.getpid()}), 200
+
+    app.add_url_rule("/ready", "ready", ready)
+
+    @app.cli.command("serve")
+    @click.option("--bind", default=None, help="Address to listen on (default: SERVER_BIND).")
+    @click.option("--workers", default=None, type=int, help="Worker processes (default: SERVER_WORKERS).")
+    def serve_command(bind, workers):
+        """Run the app under gunicorn with preforked, preloaded workers.
+
+        SIGHUP restarts the workers gracefully, SIGUSR2 then SIGWINCH and SIGQUIT
+        to the old master upgrades the code with no downtime.
+        """
+        app = current_app._get_current_object()
+        try:
+            workers = worker_count(app, workers)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        serve(app, bind=bind, workers=workers)
@@ -0,0 +1,270 @@
+import re
+import secrets
+from datetime import datetime, timedelta
+
+import click
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin, session_json_serializer
+
+from .cache import MISSING, LRUCache
+
+# secrets.token_urlsafe(32)
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{43}")
+
+PRUNE_BATCH_SIZE = 10000
+
+LOAD_SESSION = "SELECT data FROM sessions WHERE id = %s AND expires_at > NOW()"
+
+SAVE_SESSION = """
+    INSERT INTO sessions (id, data, expires_at) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE data = VALUES(data), expires_at = VALUES(expires_at)
+"""
+
+DELETE_SESSION = "DELETE FROM sessions WHERE id = %s"
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id CHAR(43) NOT NULL PRIMARY KEY,
+            data MEDIUMTEXT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            KEY idx_sessions_expires_at (expires_at)
+        ) ENGINE=InnoDB
+    """)
+
+
+class LocalStore:
+    """Sessions in a bounded LRU inside this process; only for a single worker."""
+
+    def __init__(self, max_size):
+        self._cache = LRUCache(max_size)
+
+    def load(self, sid):
+        payload = self._cache.get(sid)
+        return None if payload is MISSING else payload
+
+    def save(self, sid, payload, ttl):
+        self._cache.set(sid, payload, ttl)
+
+    def delete(self, sid):
+        self._cache.delete(sid)
+
+
+class RedisStore:
+    def __init__(self, url, prefix):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def load(self, sid):
+        payload = self._redis.get(self._prefix + sid)
+        return None if payload is None else payload.decode()
+
+    def save(self, sid, payload, ttl):
+        self._redis.set(self._prefix + sid, payload, ex=max(1, int(ttl)))
+
+    def delete(self, sid):
+        self._redis.delete(self._prefix + sid)
+
+
+class SQLStore:
+    """Sessions in the sessions table, shared by every worker.
+
+    Runs on the request's own connection, so a session costs no second
+    checkout from the pool. A write first rolls back whatever the view left
+    uncommitted, as the request teardown would have done, so committing the
+    session never commits half of a view's work.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    @staticmethod
+    def statement(operation, sid, payload=None, ttl=None):
+        """The SQL and parameters for ``load``, ``save`` or ``delete``, for callers with their own connection."""
+        if operation == "load":
+            return LOAD_SESSION, (sid,)
+        if operation == "save":
+            return SAVE_SESSION, (sid, payload, datetime.now() + timedelta(seconds=ttl))
+        return DELETE_SESSION, (sid,)
+
+    def load(self, sid):
+        cursor = self._db.connection.cursor()
+        try:
+            cursor.execute(*self.statement("load", sid))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return row[0] if row else None
+
+    def _write(self, sql, params):
+        connection = self._db.connection
+        connection.rollback()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            connection.commit()
+        finally:
+            cursor.close()
+
+    def save(self, sid, payload, ttl):
+        self._write(*self.statement("save", sid, payload, ttl))
+
+    def delete(self, sid):
+        self._write(*self.statement("delete", sid))
+
+
+def prune(connection, batch_size=PRUNE_BATCH_SIZE):
+    """Deletes expired rows from the sessions table; returns how many."""
+    total = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute("DELETE FROM sessions WHERE expires_at <= NOW() LIMIT %s", (batch_size,))
+            deleted = cursor.rowcount
+            connection.commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+    finally:
+        cursor.close()
+
+
+class ServerSideSession(SessionMixin):
+    """A session whose data stays in a store; the cookie carries only its id.
+
+    Nothing is read from the store until a key is first touched, and
+    ``modified`` is only set by writes, so requests that never use the
+    session, or only read it, cost no store round trip or write.
+    """
+
+    def __init__(self, store, sid=None):
+        self.store = store
+        self.sid = sid
+        self.modified = False
+        self.accessed = False
+        self.loaded_user = None
+        self._data = None
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            self.load(self.store.load(self.sid) if self.sid else None)
+        return self._data
+
+    def load(self, payload):
+        """Fills the session from a stored ``payload`` that the caller fetched itself."""
+        self._data = session_json_serializer.loads(payload) if payload else {}
+        self.loaded_user = self._data.get("user")
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps sessions in ``SESSION_BACKEND`` behind an opaque id cookie.
+
+    The session is saved only when a view changed it, and a login or logout
+    (a change of ``session["user"]``) moves it to a fresh id so a planted
+    cookie cannot be carried across. Stored sessions expire
+    ``SESSION_TTL`` seconds after their last write.
+    """
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and not SESSION_ID.fullmatch(sid):
+            sid = None
+        return ServerSideSession(app.extensions["session_store"], sid)
+
+    def save_session(self, app, session, response):
+        for operation, *args in self.changes(app, session, response):
+            getattr(session.store, operation)(*args)
+
+    def changes(self, app, session, response):
+        """Sets the cookie on ``response`` and returns the store calls that persist ``session``.
+
+        Each call is ``(operation, *args)`` for the store's ``delete`` or
+        ``save``; the async API makes them itself instead of blocking its loop.
+        """
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.modified:
+            return []
+
+        calls = []
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        rotate = session.sid is not None and session.get("user") != session.loaded_user
+        if session.sid is not None and (rotate or not session):
+            calls.append(("delete", session.sid))
+        if not session:
+            if session.sid is not None:
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+            return calls
+
+        if session.sid is None or rotate:
+            session.sid = secrets.token_urlsafe(32)
+        calls.append(("save", session.sid, session_json_serializer.dumps(dict(session)), app.config["SESSION_TTL"]))
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        return calls
+
+
+def init_app(app, db):
+    app.config.setdefault("SESSION_BACKEND", "cookie")
+    app.config.setdefault("SESSION_CACHE_SIZE", 100000)
+    app.config.setdefault("SESSION_TTL", int(app.permanent_session_lifetime.total_seconds()))
+
+    setting = app.config["SESSION_BACKEND"]
+    if setting == "cookie":
+        app.session_interface = SecureCookieSessionInterface()
+    else:
+        if setting == "local":
+            store = LocalStore(app.config["SESSION_CACHE_SIZE"])
+        elif setting == "sql":
+            store = SQLStore(db)
+        elif setting.startswith(("redis://", "rediss://", "unix://")):
+            store = RedisStore(setting, "session:")
+        else:
+            raise ValueError(f"Unknown SESSION_BACKEND: {setting}")
+        app.extensions["session_store"] = store
+        app.session_interface = ServerSideSessionInterface()
+
+    @app.cli.command("prune-sessions")
+    def prune_sessions_command():
+        """Delete expired sessions from the sessions table."""
+        click.echo(f"Deleted {prune(db.connection)} expired sessions.")
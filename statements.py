@@ -0,0 +1,480 @@
+import csv
+import hashlib
+import io
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import click
+import MySQLdb
+from flask import current_app
+
+from . import analytics
+from .db import db
+from .events import hub
+from .journal import DUPLICATE_ENTRY, PENDING_BALANCE
+from .stats import RECORD_DEPOSIT, RECORD_WITHDRAWAL
+from .user_context import users
+
+READ_SIZE = 64 * 1024
+CHUNK_ROWS = 1000
+
+CSV_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%m/%d/%Y", "%d.%m.%Y")
+CSV_COLUMNS = {
+    "date": ("date", "posted", "transaction date", "booking date"),
+    "amount": ("amount", "value"),
+    "credit": ("credit", "deposit", "money in"),
+    "debit": ("debit", "withdrawal", "money out"),
+    "description": ("description", "memo", "payee", "details", "name"),
+    "reference": ("reference", "id", "fitid", "transaction id"),
+}
+
+OFX_TAG = re.compile(r"^(/?[A-Z0-9.]+)>(.*)$", re.S)
+
+INSERT_LEDGER = """
+    INSERT INTO transactions (account_number, amount, type, created_at)
+    VALUES (%s, %s, %s, %s)
+"""
+
+INSERT_SEEN = "INSERT INTO imported_rows (account_number, content_hash) VALUES (%s, %s)"
+
+PROGRESS_COLUMNS = (
+    "id", "status", "format", "filename", "bytes_total", "bytes_read", "rows_read",
+    "rows_imported", "rows_duplicate", "rows_invalid", "net_amount", "error",
+)
+
+
+class StatementError(ValueError):
+    pass
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS imported_rows (
+            account_number VARCHAR(20) NOT NULL,
+            content_hash BINARY(16) NOT NULL,
+            PRIMARY KEY (account_number, content_hash)
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS statement_imports (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            account_number VARCHAR(20) NOT NULL,
+            filename VARCHAR(255) NOT NULL DEFAULT '',
+            format VARCHAR(8) NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',
+            bytes_total BIGINT NOT NULL DEFAULT 0,
+            bytes_read BIGINT NOT NULL DEFAULT 0,
+            rows_read INT NOT NULL DEFAULT 0,
+            rows_imported INT NOT NULL DEFAULT 0,
+            rows_duplicate INT NOT NULL DEFAULT 0,
+            rows_invalid INT NOT NULL DEFAULT 0,
+            net_amount DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            error VARCHAR(255) NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY idx_imports_account (account_number)
+        ) ENGINE=InnoDB
+    """)
+
+
+def receive(stream, directory, max_size):
+    """Copies an uploaded statement to a temp file chunk by chunk; returns its path.
+
+    Raises StatementError if it is over ``max_size`` bytes or is neither CSV nor OFX.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f".statement-{uuid.uuid4().hex}")
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = stream.read(READ_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise StatementError(f"File too large (max {max_size // (1024 * 1024)}MB)")
+                f.write(chunk)
+        if not size:
+            raise StatementError("The statement is empty")
+        detect_format(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def detect_format(path):
+    with open(path, "rb") as f:
+        head = f.read(1024).lstrip(b"\xef\xbb\xbf \t\r\n").upper()
+    if head.startswith((b"OFXHEADER", b"<OFX")) or (head.startswith(b"<?XML") and b"<OFX" in head):
+        return "ofx"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A read can end inside a multi-byte character
+        if e.start < len(head) - 3:
+            raise StatementError("Statements must be UTF-8 CSV or OFX")
+    return "csv"
+
+
+def parse_amount(text):
+    text = text.strip().replace(",", "").replace("$", "")
+    if text.startswith("(") and text.endswith(")"):
+        text = "-" + text[1:-1]
+    try:
+        amount = Decimal(text).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise StatementError(f"Invalid amount: {text!r}")
+    if not amount.is_finite():
+        raise StatementError(f"Invalid amount: {text!r}")
+    return amount
+
+
+def parse_csv_date(text):
+    text = text.strip()
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise StatementError(f"Invalid date: {text!r}")
+
+
+def parse_csv(f):
+    """Yields ``(posted, amount, description, reference)`` per CSV row, or a StatementError for bad rows.
+
+    Needs a header naming at least a date column and an amount column (or
+    credit and debit columns). Rows are read one at a time.
+    """
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    try:
+        yield from _csv_rows(csv.reader(text))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise StatementError(f"Unreadable CSV: {e}")
+    finally:
+        # Leave ``f`` open for the caller
+        text.detach()
+
+
+def _csv_rows(reader):
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        columns[field] = next((header.index(name) for name in names if name in header), None)
+    if columns["date"] is None or (columns["amount"] is None and columns["credit"] is None):
+        raise StatementError("CSV header needs a date column and an amount (or credit/debit) column")
+
+    def cell(row, field):
+        index = columns[field]
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        try:
+            if columns["amount"] is not None:
+                amount = parse_amount(cell(row, "amount"))
+            else:
+                amount = parse_amount(cell(row, "credit") or "0") - abs(parse_amount(cell(row, "debit") or "0"))
+            yield parse_csv_date(cell(row, "date")), amount, cell(row, "description"), cell(row, "reference")
+        except StatementError as e:
+            yield e
+
+
+def ofx_tokens(f):
+    """Yields ``(tag, text)`` for every tag of an OFX file, reading it in fixed-size chunks.
+
+    Handles both SGML OFX 1.x, where leaf tags are never closed, and XML OFX 2.x.
+    """
+    pending = ""
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            break
+        pending += chunk.decode("utf-8", errors="replace") if isinstance(chunk, bytes) else chunk
+        parts = pending.split("<")
+        pending = parts.pop()
+        for part in parts:
+            match = OFX_TAG.match(part.strip())
+            if match:
+                yield match[1].upper(), match[2].strip()
+    match = OFX_TAG.match(pending.strip())
+    if match:
+        yield match[1].upper(), match[2].strip()
+
+
+def parse_ofx_date(text):
+    digits = re.match(r"\d{8,14}", text)
+    if not digits:
+        raise StatementError(f"Invalid date: {text!r}")
+    if len(digits[0]) == 8:
+        return datetime.strptime(digits[0], "%Y%m%d")
+    return datetime.strptime(digits[0].ljust(14, "0"), "%Y%m%d%H%M%S")
+
+
+def parse_ofx(f):
+    """Yields ``(posted, amount, description, reference)`` per STMTTRN, or a StatementError."""
+    fields = None
+    for tag, text in ofx_tokens(f):
+        if tag == "STMTTRN":
+            fields = {}
+        elif tag == "/STMTTRN" and fields is not None:
+            try:
+                description = " ".join(filter(None, (fields.get("NAME"), fields.get("MEMO"))))
+                yield (parse_ofx_date(fields.get("DTPOSTED", "")), parse_amount(fields.get("TRNAMT", "")),
+                       description, fields.get("FITID", ""))
+            except StatementError as e:
+                yield e
+            fields = None
+        elif fields is not None and text and not tag.startswith("/"):
+            fields[tag] = text
+
+
+def content_hash(account_number, row, occurrence):
+    """16 byte digest of a statement row; ``occurrence`` tells identical rows in one file apart."""
+    posted, amount, description, reference = row
+    raw = f"{account_number}\0{posted:%Y-%m-%d %H:%M:%S}\0{amount}\0{description}\0{reference}\0{occurrence}"
+    return hashlib.sha256(raw.encode()).digest()[:16]
+
+
+class Progress:
+    """Writes an import's counters to statement_imports on its own autocommitted connection."""
+
+    def __init__(self, connection, import_id):
+        self.connection = connection
+        self.import_id = import_id
+        self.counts = {"bytes_read": 0, "rows_read": 0, "rows_imported": 0, "rows_duplicate": 0,
+                       "rows_invalid": 0, "net_amount": Decimal(0)}
+
+    def save(self, status, error=None):
+        assignments = ", ".join(f"{column} = %s" for column in self.counts)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE statement_imports SET status = %s, error = %s, {assignments} WHERE id = %s",
+                (status, error, *self.counts.values(), self.import_id),
+            )
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+
+def load(connection, account_number, f, fmt, progress, max_amount=None, journaled=False, chunk_rows=CHUNK_ROWS):
+    """Imports a statement into ``account_number`` in one transaction; returns the net amount.
+
+    Rows are parsed as the file is read and written ``chunk_rows`` at a time
+    with multi-row INSERTs. Rows imported before, by content hash, are
+    skipped. The balance, account_stats and rollups each get one update with
+    the net effect at the end, and nothing is committed unless the whole
+    file goes in. Raises StatementError if the import would overdraw the
+    account, counting pending journal entries when ``journaled``.
+    """
+    rows = parse_ofx(f) if fmt == "ofx" else parse_csv(f)
+    counts = progress.counts
+    occurrences = {}
+    deposited = Decimal(0)
+    withdrawn = Decimal(0)
+
+    cursor = connection.cursor()
+    try:
+        chunk = []
+        for row in rows:
+            counts["rows_read"] += 1
+            if isinstance(row, StatementError) or not row[1] or (max_amount and abs(row[1]) > max_amount):
+                counts["rows_invalid"] += 1
+            else:
+                digest = content_hash(account_number, row, 0)
+                occurrences[digest] = occurrences.get(digest, -1) + 1
+                chunk.append((content_hash(account_number, row, occurrences[digest]), row))
+
+            if len(chunk) >= chunk_rows:
+                deposited, withdrawn = _write_chunk(cursor, account_number, chunk, counts, deposited, withdrawn)
+                chunk = []
+                counts["bytes_read"] = f.tell()
+                progress.save("running")
+        if chunk:
+            deposited, withdrawn = _write_chunk(cursor, account_number, chunk, counts, deposited, withdrawn)
+
+        net = deposited - withdrawn
+        if deposited or withdrawn:
+            cursor.execute(
+                f"UPDATE users u SET u.balance = u.balance + %s, u.version = u.version + 1 "
+                f"WHERE u.account_number = %s AND {PENDING_BALANCE if journaled else 'u.balance'} + %s >= 0",
+                (net, account_number, net),
+            )
+            if cursor.rowcount != 1:
+                raise StatementError("Importing this statement would overdraw the account")
+        if deposited:
+            cursor.execute(RECORD_DEPOSIT, (account_number, deposited))
+        if withdrawn:
+            cursor.execute(RECORD_WITHDRAWAL, (account_number, withdrawn))
+        connection.commit()
+        counts["bytes_read"] = f.tell()
+        return net
+    except MySQLdb.IntegrityError as e:
+        connection.rollback()
+        if e.args[0] != DUPLICATE_ENTRY:
+            raise
+        # Another import inserted the same rows first and held them until it committed
+        raise StatementError("This statement is already being imported")
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _write_chunk(cursor, account_number, chunk, counts, deposited, withdrawn):
+    digests = [digest for digest, _ in chunk]
+    cursor.execute(
+        f"SELECT content_hash FROM imported_rows WHERE account_number = %s "
+        f"AND content_hash IN ({', '.join(['%s'] * len(digests))})",
+        (account_number, *digests),
+    )
+    seen = {row[0] for row in cursor.fetchall()}
+    fresh = [(digest, row) for digest, row in chunk if digest not in seen]
+    counts["rows_duplicate"] += len(chunk) - len(fresh)
+    if not fresh:
+        return deposited, withdrawn
+
+    ledger = []
+    for _, (posted, amount, _, _) in fresh:
+        kind = "deposit" if amount > 0 else "withdrawal"
+        ledger.append((account_number, abs(amount), kind, posted))
+        if amount > 0:
+            deposited += amount
+        else:
+            withdrawn -= amount
+
+    cursor.executemany(INSERT_SEEN, [(account_number, digest) for digest, _ in fresh])
+    cursor.executemany(INSERT_LEDGER, ledger)
+    analytics.record(cursor, [(number, None, amount, kind, posted) for number, amount, kind, posted in ledger])
+    counts["rows_imported"] += len(fresh)
+    counts["net_amount"] = deposited - withdrawn
+    return deposited, withdrawn
+
+
+def forget_imports(cursor, account_number):
+    cursor.execute("DELETE FROM imported_rows WHERE account_number = %s", (account_number,))
+    cursor.execute("DELETE FROM statement_imports WHERE account_number = %s", (account_number,))
+
+
+def progress_of(cursor, import_id, account_number):
+    """The status row of one of ``account_number``'s imports as a dict, or None."""
+    cursor.execute(
+        f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM statement_imports WHERE id = %s AND account_number = %s",
+        (import_id, account_number),
+    )
+    row = cursor.fetchone()
+    return dict(zip(PROGRESS_COLUMNS, row)) if row else None
+
+
+class StatementImporter:
+    """Runs statement imports on a small thread pool, reporting progress in statement_imports.
+
+    The request only streams the upload to a temp file and queues it; a
+    worker parses and loads it while the client polls the import's status.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("IMPORT_FOLDER", os.path.join(app.instance_path, "imports"))
+        app.config.setdefault("IMPORT_MAX_SIZE", 50 * 1024 * 1024)
+        app.config.setdefault("IMPORT_WORKERS", 1)
+        app.extensions["statement_imports"] = {"executor": None, "pid": None}
+
+        @app.cli.command("import-statement")
+        @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+        @click.option("--account", required=True, help="Account number to import into.")
+        def import_statement_command(path, account):
+            """Import a CSV or OFX bank statement into an account."""
+            import_id = self.create(db.connection, account, os.path.basename(path), detect_format(path),
+                                    os.path.getsize(path))
+            self.run(current_app._get_current_object(), import_id, account, path, delete=False)
+            cursor = db.cursor()
+            progress = progress_of(cursor, import_id, account)
+            cursor.close()
+            if progress["status"] != "done":
+                raise click.ClickException(progress["error"] or "Import failed")
+            click.echo(
+                f"Imported {progress['rows_imported']} rows ({progress['rows_duplicate']} already there, "
+                f"{progress['rows_invalid']} invalid); balance changed by {progress['net_amount']}."
+            )
+
+    def _executor(self):
+        state = current_app.extensions["statement_imports"]
+        if state["executor"] is None or state["pid"] != os.getpid():
+            with self._lock:
+                if state["executor"] is None or state["pid"] != os.getpid():
+                    state["executor"] = ThreadPoolExecutor(
+                        max_workers=current_app.config["IMPORT_WORKERS"], thread_name_prefix="import"
+                    )
+                    state["pid"] = os.getpid()
+        return state["executor"]
+
+    def create(self, connection, account_number, filename, fmt, size):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO statement_imports (account_number, filename, format, bytes_total)
+                VALUES (%s, %s, %s, %s)
+            """, (account_number, filename[:255], fmt, size))
+            connection.commit()
+            return cursor.lastrowid
+        finally:
+            cursor.close()
+
+    def receive(self, stream):
+        return receive(stream, current_app.config["IMPORT_FOLDER"], current_app.config["IMPORT_MAX_SIZE"])
+
+    def submit(self, path, account_number, email, filename, max_amount=None):
+        """Queues the statement at ``path``; returns the import id to poll."""
+        try:
+            import_id = self.create(db.connection, account_number, filename, detect_format(path),
+                                    os.path.getsize(path))
+        except Exception:
+            os.remove(path)
+            raise
+        self._executor().submit(
+            self.run, current_app._get_current_object(), import_id, account_number, path, email, max_amount
+        )
+        return import_id
+
+    def run(self, app, import_id, account_number, path, email=None, max_amount=None, delete=True):
+        with app.app_context():
+            entry = db.pool.acquire()
+            progress = Progress(entry.conn, import_id)
+            try:
+                progress.save("running")
+                with open(path, "rb") as f:
+                    net = load(db.connection, account_number, f, detect_format(path), progress, max_amount,
+                               app.config["JOURNAL_ENABLED"])
+                progress.save("done")
+                if email:
+                    users.invalidate(email)
+                    hub.publish(email, "balance", {"type": "import", "amount": float(net)})
+            except StatementError as e:
+                progress.save("failed", str(e)[:255])
+            except Exception:
+                app.logger.exception("statement import %s failed", import_id)
+                progress.save("failed", "Internal error")
+            finally:
+                db.pool.release(entry)
+                if delete:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+statements = StatementImporter()
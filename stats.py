@@ -0,0 +1,187 @@
+import click
+
+from .history import ALL_TRANSACTIONS, ARCHIVE_TABLE
+
+# Same definitions the /balance totals have always used: deposits into the
+# account, and transfers/withdrawals sent from it. ``{ledger}`` is the table
+# (or union) to total up.
+LEDGER_TOTALS = """
+    SELECT account_number,
+        SUM(CASE WHEN type = 'deposit' THEN amount ELSE 0 END) AS total_deposit,
+        SUM(CASE WHEN type = 'withdrawal' OR type = 'transfer' THEN ABS(amount) ELSE 0 END) AS total_withdrawal
+    FROM {ledger} ledger_rows
+    GROUP BY account_number
+"""
+
+RECORD_DEPOSIT = """
+    INSERT INTO account_stats (account_number, total_deposit, total_withdrawal)
+    VALUES (%s, %s, 0)
+    ON DUPLICATE KEY UPDATE total_deposit = total_deposit + VALUES(total_deposit)
+"""
+
+RECORD_WITHDRAWAL = """
+    INSERT INTO account_stats (account_number, total_deposit, total_withdrawal)
+    VALUES (%s, 0, %s)
+    ON DUPLICATE KEY UPDATE total_withdrawal = total_withdrawal + VALUES(total_withdrawal)
+"""
+
+# Every account's archived_before, from the rows already in the archive
+ARCHIVE_HORIZONS = f"""
+    INSERT INTO account_stats (account_number, archived_before)
+    SELECT account_number, MAX(created_at) + INTERVAL 1 SECOND FROM (
+        SELECT account_number, created_at FROM {ARCHIVE_TABLE}
+        UNION ALL
+        SELECT recipient_account, created_at FROM {ARCHIVE_TABLE} WHERE recipient_account IS NOT NULL
+    ) archived
+    GROUP BY account_number
+    ON DUPLICATE KEY UPDATE archived_before = VALUES(archived_before)
+"""
+
+ACCOUNT_TOTALS = "SELECT total_deposit, total_withdrawal FROM account_stats WHERE account_number = %s"
+
+# With JOURNAL_ENABLED: the summary plus the entries the journal has not posted yet
+JOURNALED_ACCOUNT_TOTALS = """
+    SELECT COALESCE(s.total_deposit, 0) + COALESCE(SUM(CASE WHEN j.type = 'deposit' THEN j.amount END), 0),
+           COALESCE(s.total_withdrawal, 0) + COALESCE(SUM(CASE WHEN j.type <> 'deposit' THEN j.amount END), 0)
+    FROM (SELECT %s AS account_number) a
+    LEFT JOIN account_stats s ON s.account_number = a.account_number
+    LEFT JOIN ledger_journal j ON j.account_number = a.account_number
+    GROUP BY s.total_deposit, s.total_withdrawal
+"""
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS account_stats (
+            account_number VARCHAR(20) PRIMARY KEY,
+            total_deposit DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            total_withdrawal DECIMAL(17, 2) NOT NULL DEFAULT 0.00,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+
+
+def backfill(cursor, ledger=ALL_TRANSACTIONS):
+    """Replaces the summary with totals computed from the ledger; returns the number of accounts."""
+    cursor.execute("DELETE FROM account_stats")
+    cursor.execute(f"""
+        INSERT INTO account_stats (account_number, total_deposit, total_withdrawal)
+        SELECT account_number, total_deposit, total_withdrawal FROM ({LEDGER_TOTALS.format(ledger=ledger)}) AS ledger
+    """)
+    count = cursor.rowcount
+    if ledger == ALL_TRANSACTIONS:
+        cursor.execute(ARCHIVE_HORIZONS)
+    return count
+
+
+def record_deposit(cursor, account_number, amount):
+    """Adds a deposit to the summary. Run it on the cursor that inserts the ledger row, before commit."""
+    cursor.execute(RECORD_DEPOSIT, (account_number, amount))
+
+
+def record_withdrawal(cursor, account_number, amount):
+    """Adds money sent from ``account_number`` to the summary, in the caller's transaction."""
+    cursor.execute(RECORD_WITHDRAWAL, (account_number, abs(amount)))
+
+
+def forget_account(cursor, account_number):
+    """Drops an account's summary and backs its incoming transfers out of the senders' totals.
+
+    Call it before the account's ledger rows are deleted, in the same transaction.
+    """
+    cursor.execute(f"""
+        UPDATE account_stats s
+        JOIN (
+            SELECT account_number, SUM(ABS(amount)) AS sent FROM (
+                SELECT account_number, amount, type FROM transactions WHERE recipient_account = %s
+                UNION ALL
+                SELECT account_number, amount, type FROM {ARCHIVE_TABLE} WHERE recipient_account = %s
+            ) incoming
+            WHERE type = 'withdrawal' OR type = 'transfer'
+            GROUP BY account_number
+        ) received ON received.account_number = s.account_number
+        SET s.total_withdrawal = s.total_withdrawal - received.sent
+    """, (account_number, account_number))
+    cursor.execute("DELETE FROM account_stats WHERE account_number = %s", (account_number,))
+
+
+def account_totals(cursor, account_number, journaled=False):
+    cursor.execute(JOURNALED_ACCOUNT_TOTALS if journaled else ACCOUNT_TOTALS, (account_number,))
+    row = cursor.fetchone()
+    if not row:
+        return 0, 0
+    return row[0], row[1]
+
+
+def spending_split(total_deposit, total_withdrawal):
+    """Returns ``(spent_percent, saved_percent)`` for the balance page."""
+    total_money = total_deposit + total_withdrawal
+    spent_percent = round((total_withdrawal / total_money) * 100, 2) if total_money > 0 else 0
+    saved_percent = 100 - spent_percent if total_money > 0 else 0
+    return spent_percent, saved_percent
+
+
+def rebuild(connection):
+    """Recomputes the whole summary from the ledger in one transaction."""
+    cursor = connection.cursor()
+    try:
+        count = backfill(cursor)
+        connection.commit()
+        return count
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def verify(connection):
+    """Compares the summary with the ledger and returns the rows that disagree.
+
+    Each mismatch is ``(account_number, ledger_deposit, ledger_withdrawal,
+    stats_deposit, stats_withdrawal)``; a missing side shows up as zeros.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT ledger.account_number,
+                   ledger.total_deposit, ledger.total_withdrawal,
+                   COALESCE(s.total_deposit, 0), COALESCE(s.total_withdrawal, 0)
+            FROM ({LEDGER_TOTALS.format(ledger=ALL_TRANSACTIONS)}) AS ledger
+            LEFT JOIN account_stats s ON s.account_number = ledger.account_number
+            WHERE s.account_number IS NULL
+               OR s.total_deposit <> ledger.total_deposit
+               OR s.total_withdrawal <> ledger.total_withdrawal
+            UNION ALL
+            SELECT s.account_number, 0, 0, s.total_deposit, s.total_withdrawal
+            FROM account_stats s
+            WHERE (s.total_deposit <> 0 OR s.total_withdrawal <> 0)
+              AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.account_number = s.account_number)
+              AND NOT EXISTS (SELECT 1 FROM {ARCHIVE_TABLE} a WHERE a.account_number = s.account_number)
+        """)
+        return list(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def init_app(app, db):
+    @app.cli.command("rebuild-account-stats")
+    def rebuild_account_stats_command():
+        """Recompute account_stats from the transactions ledger."""
+        count = rebuild(db.connection)
+        click.echo(f"Rebuilt stats for {count} accounts.")
+
+    @app.cli.command("verify-account-stats")
+    def verify_account_stats_command():
+        """Fail if account_stats has drifted from the transactions ledger."""
+        mismatches = verify(db.connection)
+        for account_number, ledger_dep, ledger_wd, stats_dep, stats_wd in mismatches:
+            click.echo(
+                f"{account_number}: ledger {ledger_dep}/{ledger_wd}, summary {stats_dep}/{stats_wd}",
+                err=True,
+            )
+        if mismatches:
+            raise click.ClickException(
+                f"{len(mismatches)} accounts out of sync; run `flask rebuild-account-stats`"
+            )
+        click.echo("account_stats matches the ledger.")
@@ -0,0 +1,125 @@
+import os
+
+import MySQLdb
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+from app import create_app, db
+from app.db import ConnectionPool
+from app.schema import migrate
+
+# TEST_MYSQL_HOST etc. point the database tests at a scratch server; they are
+# skipped when TEST_MYSQL_DB is unset or the server cannot be reached.
+MYSQL_SETTINGS = ("MYSQL_HOST", "MYSQL_PORT", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_DB")
+
+
+@pytest.fixture
+def app():
+    """The app with signed-cookie sessions, so requests that stay off the database need none."""
+    app = create_app()
+    app.testing = True
+    # The compactor thread would outlive the test and poll whatever pool it left behind
+    app.config["ROLLUP_COMPACT_INTERVAL"] = 0
+    app.session_interface = SecureCookieSessionInterface()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.statements.append((sql, params))
+        self.rows = list(self.conn.answer(sql, params) or [])
+        self.rowcount = len(self.rows) if sql.startswith("SELECT") else self.conn.rowcount(sql, params)
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size=1):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stands in for a MySQL connection. Statements are recorded with their
+    parameters; ``answer(sql, params)`` returns the rows a SELECT yields and
+    ``rowcount(sql, params)`` the rows any other statement changed."""
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+        self.answer = lambda sql, params: []
+        self.rowcount = lambda sql, params: 1
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def executed(self, prefix):
+        return [params for sql, params in self.statements if sql.startswith(prefix)]
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(app):
+    """Points the app's pool at one ``FakeConnection`` and returns it."""
+    conn = FakeConnection()
+    app.extensions["db_pool"] = ConnectionPool(lambda: conn, min_size=0)
+    return conn
+
+
+def log_in(client, email="a@example.com", account_number="1000000001"):
+    with client.session_transaction() as session:
+        session["user"] = email
+        session["user_account_number"] = account_number
+
+
+@pytest.fixture(scope="session")
+def mysql_app():
+    if not os.environ.get("TEST_MYSQL_DB"):
+        pytest.skip("TEST_MYSQL_DB is not set")
+    app = create_app()
+    for key in MYSQL_SETTINGS:
+        if f"TEST_{key}" in os.environ:
+            app.config[key] = os.environ[f"TEST_{key}"]
+    app.config["MYSQL_PORT"] = int(app.config["MYSQL_PORT"])
+    with app.app_context():
+        try:
+            migrate(db.connection)
+        except MySQLdb.OperationalError as e:
+            pytest.skip(f"MySQL is not reachable: {e}")
+    return app
@@ -0,0 +1,26 @@
+import MySQLdb
+
+from .conftest import log_in
+
+ROW = (1, "Ada", "a@example.com", "1000000001", 0, "1234", None, 3)
+
+
+def test_failed_deletes_are_logged_and_rolled_back(client, fake_db, caplog):
+    log_in(client)
+    fake_db.answer = lambda sql, params: [ROW] if sql.startswith("SELECT id, name") else []
+
+    def rowcount(sql, params):
+        if sql.startswith("DELETE FROM users"):
+            raise MySQLdb.OperationalError(1205, "Lock wait timeout exceeded")
+        return 0
+
+    fake_db.rowcount = rowcount
+
+    response = client.post("/api/delete_account")
+
+    assert response.status_code == 500
+    assert fake_db.commits == 0
+    record = next(r for r in caplog.records if r.getMessage() == "deleting account 1000000001 failed")
+    assert record.exc_info[0] is MySQLdb.OperationalError
+    with client.session_transaction() as session:
+        assert session["user"] == "a@example.com"
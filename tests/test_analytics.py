@@ -0,0 +1,134 @@
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app import analytics, db
+from app.analytics import LEDGER_ROLLUPS, bucket_start, ledger_deltas, next_bucket, range_args, summarize
+
+from .conftest import FakeConnection, log_in
+
+TODAY = date(2026, 3, 15)
+
+
+def test_ledger_deltas():
+    at = datetime(2026, 3, 1, 12)
+
+    assert ledger_deltas([
+        ("A", None, Decimal(10), "deposit", at),
+        ("A", "B", Decimal(-4), "transfer", at),
+        ("A", None, Decimal(-2), "withdrawal", None),
+    ]) == [
+        ("A", at, "", Decimal(10), 0),
+        ("A", at, "B", 0, Decimal(4)),
+        ("B", at, "A", Decimal(4), 0),
+        ("A", None, "", 0, Decimal(2)),
+    ]
+
+
+def test_range_args_defaults_to_the_last_30_days():
+    assert range_args(MultiDict(), today=TODAY) == (date(2026, 2, 14), TODAY, "day", 5)
+
+
+def test_range_args_clamps_top():
+    args = MultiDict({"start": "2026-01-01", "end": "2026-01-31", "period": "week", "top": "500"})
+    assert range_args(args) == (date(2026, 1, 1), date(2026, 1, 31), "week", 50)
+
+
+@pytest.mark.parametrize("args", [
+    {"period": "year"},
+    {"start": "2026-03-02", "end": "2026-03-01"},
+    {"start": "2010-01-01", "end": "2026-01-01"},
+    {"start": "yesterday"},
+])
+def test_range_args_rejects(args):
+    with pytest.raises(ValueError):
+        range_args(MultiDict(args), today=TODAY)
+
+
+@pytest.mark.parametrize("period, start, following", [
+    ("day", date(2026, 3, 15), date(2026, 3, 16)),
+    ("week", date(2026, 3, 9), date(2026, 3, 16)),
+    ("month", date(2026, 3, 1), date(2026, 4, 1)),
+])
+def test_buckets(period, start, following):
+    assert bucket_start(TODAY, period) == start
+    assert next_bucket(start, period) == following
+    assert next_bucket(date(2026, 12, 1), "month") == date(2027, 1, 1)
+
+
+def test_summarize_fills_empty_periods():
+    conn = FakeConnection()
+    totals = [(date(2026, 1, 5), Decimal(100), Decimal(20)), (date(2026, 1, 20), Decimal(0), Decimal(30)),
+              (date(2026, 3, 2), Decimal(50), Decimal(0))]
+    conn.answer = lambda sql, params: totals if "GROUP BY day" in sql else [("1000000002", Decimal(0), Decimal(30))]
+
+    summary = summarize(conn.cursor(), "1000000001", date(2026, 1, 1), date(2026, 3, 31), "month", 5)
+
+    assert summary["buckets"] == [
+        {"start": "2026-01-01", "income": 100.0, "outflow": 50.0, "net": 50.0},
+        {"start": "2026-02-01", "income": 0.0, "outflow": 0.0, "net": 0.0},
+        {"start": "2026-03-01", "income": 50.0, "outflow": 0.0, "net": 50.0},
+    ]
+    assert summary["totals"] == {"income": 150.0, "outflow": 50.0, "net": 100.0}
+    assert summary["top_counterparties"] == [{"account": "1000000002", "received": 0.0, "sent": 30.0}]
+
+
+def test_the_endpoint_names_counterparties(client, fake_db):
+    log_in(client)
+
+    def answer(sql, params):
+        if sql.startswith("SELECT id, name, email, account_number"):
+            return [(1, "Ada", "a@example.com", "1000000001", Decimal(0), "1234", None, 1)]
+        if sql.startswith("SELECT counterparty"):
+            return [("1000000002", Decimal(0), Decimal(30))]
+        if sql.startswith("SELECT name, email FROM users"):
+            return [("Bob", "b@example.com")]
+        return []
+    fake_db.answer = answer
+
+    response = client.get("/api/analytics?start=2026-01-01&end=2026-01-31&period=month")
+
+    assert response.status_code == 200
+    assert response.get_json()["top_counterparties"] == [
+        {"account": "1000000002", "name": "Bob", "received": 0.0, "sent": 30.0},
+    ]
+    assert client.get("/api/analytics?period=year").status_code == 400
+
+
+def test_compacted_deltas_match_a_rebuild_from_the_ledger(mysql_app):
+    prefix = "RT" + uuid.uuid4().hex[:6]
+    a, b = f"{prefix}01", f"{prefix}02"
+    entries = [
+        (a, None, Decimal("100.00"), "deposit", datetime(2026, 1, 5, 9)),
+        (a, b, Decimal("-25.50"), "transfer", datetime(2026, 1, 5, 10)),
+        (b, a, Decimal("-5.25"), "transfer", datetime(2026, 1, 6, 10)),
+        (a, b, Decimal("-1.00"), "transfer", datetime(2026, 1, 5, 23)),
+    ]
+    rebuilt = f"SELECT * FROM ({LEDGER_ROLLUPS.format(ledger='transactions')}) r WHERE account_number IN (%s, %s)"
+    rollups = "SELECT * FROM daily_rollups WHERE account_number IN (%s, %s)"
+
+    with mysql_app.app_context():
+        cursor = db.cursor()
+        try:
+            cursor.executemany(
+                "INSERT INTO transactions (account_number, recipient_account, amount, type, created_at) "
+                "VALUES (%s, %s, %s, %s, %s)", entries,
+            )
+            analytics.record(cursor, entries)
+            db.connection.commit()
+            while analytics.compact(db.connection, batch_size=2):
+                pass
+
+            cursor.execute(rollups, (a, b))
+            compacted = sorted(cursor.fetchall())
+            cursor.execute(rebuilt, (a, b))
+            assert compacted == sorted(cursor.fetchall())
+            assert len(compacted) == 5
+        finally:
+            for table in ("transactions", "daily_rollups", "rollup_deltas"):
+                cursor.execute(f"DELETE FROM {table} WHERE account_number LIKE %s", (prefix + "%",))
+            db.connection.commit()
+            cursor.close()
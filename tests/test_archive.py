@@ -0,0 +1,111 @@
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.archive import archive, cutoff
+from app.history import ARCHIVE_TABLE, HISTORY_COLUMNS, decode_cursor, encode_cursor, iter_history, needs_archive
+
+from .conftest import FakeConnection
+
+HORIZON = datetime(2025, 3, 1)
+
+
+def rows(*days):
+    return [("1000000001", None, Decimal(1), "deposit", datetime(2025, 3, day), day) for day in days]
+
+
+def test_cutoff_is_the_start_of_a_month():
+    assert cutoff(365, today=date(2026, 3, 15)) == datetime(2025, 3, 1)
+    assert cutoff(30, today=date(2026, 3, 31)) == datetime(2026, 3, 1)
+
+
+@pytest.mark.parametrize("page, limit, horizon, expected", [
+    (rows(20, 10), 2, None, False),
+    (rows(20, 10), 2, HORIZON, False),
+    (rows(20), 2, HORIZON, True),
+    (rows(20, 10), 2, datetime(2025, 3, 15), True),
+])
+def test_needs_archive(page, limit, horizon, expected):
+    assert needs_archive(page, limit, HISTORY_COLUMNS, horizon) is expected
+
+
+def test_cursors_round_trip():
+    token = encode_cursor(datetime(2025, 3, 1, 12, 30), 42)
+
+    assert decode_cursor(token) == ("2025-03-01 12:30:00", 42)
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor("bm9waXBl")
+
+
+def history_reads(conn):
+    """For each history query run: whether it read the archive table."""
+    return [ARCHIVE_TABLE in sql for sql, _ in conn.statements if "ORDER BY created_at DESC" in sql]
+
+
+def test_a_full_page_of_hot_rows_skips_the_archive():
+    conn = FakeConnection()
+    conn.answer = lambda sql, params: rows(20, 10)
+
+    assert list(iter_history(conn.cursor(), "1000000001", 2, archived_before=HORIZON)) == rows(20, 10)
+    assert history_reads(conn) == [False]
+    assert conn.executed("SELECT archived_before") == []
+
+
+def test_a_short_page_of_an_account_with_nothing_archived_skips_the_archive():
+    conn = FakeConnection()
+    conn.answer = lambda sql, params: [(None,)] if "archived_before" in sql else rows(20)
+
+    assert list(iter_history(conn.cursor(), "1000000001", 2, archived_before=HORIZON)) == rows(20)
+    assert history_reads(conn) == [False]
+    assert conn.executed("SELECT archived_before") == [("1000000001",)]
+
+
+def test_a_page_reaching_the_accounts_archived_rows_is_read_again_with_them():
+    conn = FakeConnection()
+
+    def answer(sql, params):
+        if "archived_before" in sql:
+            return [(datetime(2025, 2, 1),)]
+        if ARCHIVE_TABLE in sql:
+            return rows(20) + [("1000000001", None, Decimal(1), "deposit", datetime(2025, 1, 5), 1)]
+        return rows(20)
+    conn.answer = answer
+
+    page = list(iter_history(conn.cursor(), "1000000001", 2, archived_before=HORIZON))
+
+    assert [row[5] for row in page] == [20, 1]
+    assert history_reads(conn) == [False, True]
+
+
+def test_archived_rows_stay_in_the_history(mysql_app):
+    prefix = "AR" + uuid.uuid4().hex[:6]
+    account = f"{prefix}01"
+    old, new = datetime(2020, 1, 15), datetime.now().replace(microsecond=0) - timedelta(days=1)
+    before = cutoff(mysql_app.config["ARCHIVE_AFTER_DAYS"])
+
+    with mysql_app.app_context():
+        cursor = db.cursor()
+        try:
+            cursor.executemany(
+                "INSERT INTO transactions (account_number, amount, type, created_at) VALUES (%s, 1, 'deposit', %s)",
+                [(account, old), (account, new)],
+            )
+            db.connection.commit()
+
+            moved = archive(db.connection, before, chunk_size=1)
+
+            assert moved.get("2020-01-01", 0) >= 1
+            cursor.execute("SELECT created_at FROM transactions WHERE account_number = %s", (account,))
+            assert cursor.fetchall() == ((new,),)
+            cursor.execute("SELECT archived_before FROM account_stats WHERE account_number = %s", (account,))
+            assert cursor.fetchone() == (before,)
+            history = list(iter_history(cursor, account, 10, archived_before=before))
+            assert [row[4] for row in history] == [new, old]
+        finally:
+            for table in ("transactions", ARCHIVE_TABLE, "account_stats"):
+                cursor.execute(f"DELETE FROM {table} WHERE account_number LIKE %s", (prefix + "%",))
+            db.connection.commit()
+            cursor.close()
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Response
+from flask.sessions import SecureCookieSessionInterface
+
+from app import create_app
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+@pytest.fixture
+def asgi_app(release):
+    app = create_app(async_api=True)
+    app.config["ROLLUP_COMPACT_INTERVAL"] = 0
+    app.session_interface = SecureCookieSessionInterface()
+
+    def slow_stream():
+        def generate():
+            yield "first\n"
+            release.wait(5)
+            yield "last\n"
+        return Response(generate(), mimetype="text/plain")
+
+    app.add_url_rule("/test/stream", "test_stream", slow_stream)
+    app.add_url_rule("/test/ping", "test_ping", lambda: "pong")
+    return app
+
+
+def session_cookie(app, **values):
+    value = app.session_interface.get_signing_serializer(app).dumps(values)
+    return (b"cookie", f"{app.config['SESSION_COOKIE_NAME']}={value}".encode())
+
+
+class Client:
+    """Drives one ASGI request and records what the app sends back."""
+
+    def __init__(self, app, path, headers=()):
+        self.scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": list(headers),
+            "http_version": "1.1",
+            "scheme": "http",
+            "server": ("testserver", 80),
+        }
+        self.app = app
+        self.status = None
+        self.body = b""
+        self.finished = asyncio.Event()
+        self.chunk = asyncio.Event()
+        self.closed = asyncio.Event()
+        self._requested = False
+
+    async def receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.closed.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        else:
+            self.body += message.get("body", b"")
+            self.chunk.set()
+            if not message.get("more_body"):
+                self.finished.set()
+
+    def start(self):
+        return asyncio.ensure_future(self.app.asgi_app(self.scope, self.receive, self.send))
+
+
+def test_fallback_requests_run_beside_an_open_stream(asgi_app, release):
+    async def scenario():
+        stream = Client(asgi_app, "/test/stream")
+        stream_task = stream.start()
+        await asyncio.wait_for(stream.chunk.wait(), 2)
+
+        started = time.monotonic()
+        ping = Client(asgi_app, "/test/ping")
+        await asyncio.wait_for(ping.start(), 2)
+        assert (ping.status, ping.body) == (200, b"pong")
+        assert time.monotonic() - started < 1
+        assert not stream.finished.is_set()
+
+        release.set()
+        await asyncio.wait_for(stream_task, 2)
+        assert stream.body == b"first\nlast\n"
+
+    asyncio.run(scenario())
+
+
+def test_event_stream_is_served_without_a_thread(asgi_app):
+    async def scenario():
+        events = Client(asgi_app, "/api/events", [session_cookie(asgi_app, user="a@example.com")])
+        events_task = events.start()
+        await asyncio.wait_for(events.chunk.wait(), 2)
+        assert events.status == 200
+
+        ping = Client(asgi_app, "/test/ping")
+        await asyncio.wait_for(ping.start(), 2)
+        assert ping.body == b"pong"
+
+        events.chunk.clear()
+        with asgi_app.app_context():
+            from app.events import hub
+            assert hub.publish("a@example.com", "balance", {"amount": 5}) == 1
+        await asyncio.wait_for(events.chunk.wait(), 2)
+        assert b"event: balance" in events.body
+
+        events.closed.set()
+        await asyncio.wait_for(events_task, 2)
+        with asgi_app.app_context():
+            assert hub.publish("a@example.com", "balance", {"amount": 5}) == 0
+
+    asyncio.run(scenario())
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        self.conn.statements.append(" ".join(sql.split()))
+        self.row = (self.conn.stored,) if sql.startswith("SELECT data FROM sessions") else None
+
+    async def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, stored):
+        self.stored = stored
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        pass
+
+
+def test_sql_sessions_go_through_the_async_connection(asgi_app, monkeypatch):
+    from flask.sessions import session_json_serializer
+
+    from app.sessions import ServerSideSessionInterface, SQLStore
+
+    class BlockingStore(SQLStore):
+        def load(self, sid):
+            raise AssertionError("blocking session read on the event loop")
+
+        def save(self, sid, payload, ttl):
+            raise AssertionError("blocking session write on the event loop")
+
+        def delete(self, sid):
+            raise AssertionError("blocking session write on the event loop")
+
+    asgi_app.session_interface = ServerSideSessionInterface()
+    asgi_app.extensions["session_store"] = BlockingStore(None)
+    conn = FakeConnection(session_json_serializer.dumps({"user": "a@example.com", "_flashes": [("info", "Hi")]}))
+
+    async def acquire():
+        return conn
+
+    async def release(_):
+        pass
+
+    monkeypatch.setattr(asgi_app.asgi_app, "acquire", acquire)
+    monkeypatch.setattr(asgi_app.asgi_app, "release", release)
+    cookie = (b"cookie", f"{asgi_app.config['SESSION_COOKIE_NAME']}={'a' * 43}".encode())
+
+    async def scenario():
+        status = Client(asgi_app, "/api/session_status", [cookie])
+        await status.start()
+        assert (status.status, status.body) == (200, b'{"logged_in": true}')
+        assert conn.commits == 0
+
+        flashes = Client(asgi_app, "/api/flash", [cookie])
+        await flashes.start()
+        assert b'"Hi"' in flashes.body
+        assert conn.statements[-1].startswith("INSERT INTO sessions")
+        assert conn.commits == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,88 @@
+import gzip
+
+import pytest
+
+from app.assets import accepted_encodings, build
+
+SCRIPT = b"console.log('hello');\n" * 100
+
+
+@pytest.fixture
+def static(app, tmp_path):
+    app.static_folder = str(tmp_path)
+    (tmp_path / "app.js").write_bytes(SCRIPT)
+    (tmp_path / "app.js.gz").write_bytes(gzip.compress(SCRIPT))
+    (tmp_path / "app.0123456789.js").write_bytes(SCRIPT)
+    return tmp_path
+
+
+def test_files_are_sent_with_an_etag_and_must_be_revalidated(client, static):
+    response = client.get("/static/app.js")
+
+    assert response.status_code == 200
+    assert response.data == SCRIPT
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "Expires" not in response.headers
+
+    etag = response.headers["ETag"]
+    assert client.get("/static/app.js", headers={"If-None-Match": etag}).status_code == 304
+    last_modified = response.headers["Last-Modified"]
+    assert client.get("/static/app.js", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+
+def test_hashed_names_are_immutable(client, static):
+    response = client.get("/static/app.0123456789.js")
+
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+
+def test_range_requests_get_partial_content(client, static):
+    response = client.get("/static/app.js", headers={"Range": "bytes=0-9"})
+
+    assert response.status_code == 206
+    assert response.data == SCRIPT[:10]
+    assert response.headers["Content-Range"] == f"bytes 0-9/{len(SCRIPT)}"
+
+
+def test_precompressed_copies_go_to_clients_that_accept_them(client, static):
+    plain = client.get("/static/app.js")
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "br;q=0, gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == SCRIPT
+    assert response.headers["ETag"] != plain.headers["ETag"]
+
+
+@pytest.mark.parametrize("path", ["/static/app.js.gz", "/static/../conftest.py", "/static/missing.js"])
+def test_variants_and_missing_files_are_not_found(client, static, path):
+    assert client.get(path).status_code == 404
+
+
+def test_the_proxy_sends_the_bytes_with_x_accel_redirect(app, client, static):
+    app.config["STATIC_SENDFILE"] = "x-accel-redirect"
+
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["X-Accel-Redirect"] == "/_static/app.js.gz"
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.data == b""
+
+
+def test_accepted_encodings_skip_refused_ones():
+    assert accepted_encodings("gzip;q=0, br, deflate;q=0.5") == {"br", "deflate"}
+
+
+def test_build_publishes_hashed_compressed_copies(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "app.js").write_bytes(SCRIPT)
+    (source / "logo.png").write_bytes(b"png")
+
+    entries = build(str(source), str(tmp_path / "out"))
+
+    assert set(entries) == {"app.js", "logo.png"}
+    hashed = tmp_path / "out" / entries["app.js"]
+    assert hashed.read_bytes() == SCRIPT
+    assert gzip.decompress((tmp_path / "out" / (entries["app.js"] + ".gz")).read_bytes()) == SCRIPT
+    assert not (tmp_path / "out" / (entries["logo.png"] + ".gz")).exists()
@@ -0,0 +1,110 @@
+import io
+import os
+import re
+import time
+
+import pytest
+from PIL import Image
+
+from app import avatars
+from app.avatars import avatar_url, make_thumbnails, prune, receive
+
+DIGEST = "0123456789abcdef0123456789abcdef"
+
+
+def png(size=(300, 200), color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def folder(app, tmp_path):
+    app.config.update(AVATAR_FOLDER=str(tmp_path), AVATAR_FORMAT="JPEG", AVATAR_SIZES=(64, 256))
+    return tmp_path
+
+
+@pytest.mark.parametrize("stored, size, url", [
+    (f"/static/avatars/{DIGEST}-256.jpg", 48, f"/static/avatars/{DIGEST}-64.jpg"),
+    (f"/static/avatars/{DIGEST}-256.jpg", 64, f"/static/avatars/{DIGEST}-64.jpg"),
+    (f"/static/avatars/{DIGEST}-64.jpg", 100, f"/static/avatars/{DIGEST}-256.jpg"),
+    (f"/static/avatars/{DIGEST}-64.webp", 1000, f"/static/avatars/{DIGEST}-256.webp"),
+    (f"/static/avatars/{DIGEST}-256.jpg", None, f"/static/avatars/{DIGEST}-256.jpg"),
+    ("http://localhost:5000/static/profile_pics/me.png", 64, "/static/profile_pics/me.png"),
+    (None, 64, None),
+])
+def test_avatar_url(folder, app, stored, size, url):
+    with app.app_context():
+        assert avatar_url(stored, size) == url
+
+
+def test_receive_hashes_the_upload(tmp_path):
+    data = png()
+
+    upload = receive(io.BytesIO(data), str(tmp_path), max_size=len(data))
+
+    assert open(upload.path, "rb").read() == data
+    assert len(upload.digest) == 32
+    assert receive(io.BytesIO(data), str(tmp_path), max_size=len(data)).digest == upload.digest
+
+
+@pytest.mark.parametrize("data, max_size, message", [
+    (png(), 100, "File too large (max 0MB)"),
+    (b"GIF89a but not really", 1024, "Invalid image file"),
+])
+def test_receive_rejects_bad_uploads(tmp_path, data, max_size, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        receive(io.BytesIO(data), str(tmp_path), max_size)
+    assert os.listdir(tmp_path) == []
+
+
+def test_make_thumbnails_writes_one_square_per_size(tmp_path):
+    source = tmp_path / "source.png"
+    source.write_bytes(png())
+
+    paths = make_thumbnails(str(source), str(tmp_path), DIGEST, (64, 256), "JPEG")
+
+    assert [os.path.basename(p) for p in paths] == [f"{DIGEST}-256.jpg", f"{DIGEST}-64.jpg"]
+    for path, size in zip(paths, (256, 64)):
+        with Image.open(path) as image:
+            assert image.size == (size, size)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_uploads_are_processed_off_the_request(app, folder, fake_db):
+    with app.app_context():
+        upload = receive(io.BytesIO(png()), str(folder), max_size=10 ** 6)
+        url, ready = avatars.submit(upload, "a@example.com", None)
+        app.extensions["avatars"]["executor"].shutdown(wait=True)
+
+    assert (url, ready) == (f"/static/avatars/{upload.digest}-256.jpg", False)
+    assert sorted(os.listdir(folder)) == [f"{upload.digest}-256.jpg", f"{upload.digest}-64.jpg"]
+    assert fake_db.executed("UPDATE users SET profile_pic_url") == [(url, "a@example.com")]
+
+
+def test_a_known_image_is_ready_at_once(app, folder, fake_db):
+    with app.app_context():
+        first = receive(io.BytesIO(png()), str(folder), max_size=10 ** 6)
+        make_thumbnails(first.path, str(folder), first.digest, (64, 256), "JPEG")
+        os.remove(first.path)
+
+        again = receive(io.BytesIO(png()), str(folder), max_size=10 ** 6)
+        url, ready = avatars.submit(again, "a@example.com", None)
+
+    assert ready
+    assert app.extensions["avatars"]["executor"] is None
+    assert not os.path.exists(again.path)
+    assert fake_db.executed("UPDATE users SET profile_pic_url") == [(url, "a@example.com")]
+
+
+def test_prune_keeps_files_in_use_and_recent_ones(folder, fake_db):
+    other = "f" * 32
+    for name in (f"{DIGEST}-64.jpg", f"{other}-64.jpg", f"{'e' * 32}-64.jpg"):
+        (folder / name).write_bytes(b"x")
+    old = time.time() - 7200
+    os.utime(folder / f"{DIGEST}-64.jpg", (old, old))
+    os.utime(folder / f"{other}-64.jpg", (old, old))
+    fake_db.answer = lambda sql, params: [(f"/static/avatars/{DIGEST}-256.jpg",), ("/static/profile_pics/me.png",)]
+
+    assert prune(fake_db, str(folder), min_age=3600) == 1
+    assert sorted(os.listdir(folder)) == [f"{DIGEST}-64.jpg", f"{'e' * 32}-64.jpg"]
@@ -0,0 +1,91 @@
+import copy
+
+import click
+import pytest
+
+from app import bench, db
+from app.bench import DEFAULT_MIX, Budget, compare, parse_mix, percentile
+
+
+def report(rps=100.0, p95=0.010, p99=0.020, queries=3.0, errors=0):
+    return {
+        "settings": {"concurrency": 8, "mix": {"dashboard": 25}},
+        "requests": 1000,
+        "seconds": 10.0,
+        "requests_per_second": rps,
+        "ops": {"dashboard": {
+            "count": 1000, "errors": errors, "p50": 0.005, "p95": p95, "p99": p99,
+            "requests_per_second": rps, "queries_per_request": queries,
+        }},
+    }
+
+
+def test_percentile():
+    samples = sorted(range(1, 101))
+
+    assert percentile(samples, 0.50) == 50
+    assert percentile(samples, 0.99) == 99
+    assert percentile([7], 0.95) == 7
+    assert percentile([], 0.95) == 0.0
+
+
+def test_a_run_within_tolerance_passes():
+    assert compare(report(), report(rps=85.0, p95=0.0115), tolerance=0.2) == []
+
+
+@pytest.mark.parametrize("changes, problem", [
+    ({"rps": 70.0}, "throughput fell from 100.0 to 70.0 req/s"),
+    ({"p95": 0.013}, "dashboard p95 rose from 10.0 to 13.0 ms"),
+    ({"p99": 0.030}, "dashboard p99 rose from 20.0 to 30.0 ms"),
+    ({"queries": 4.0}, "dashboard went from 3.0 to 4.0 queries per request"),
+    ({"errors": 2}, "dashboard had 2 errors, baseline 0"),
+])
+def test_regressions_are_reported(changes, problem):
+    assert compare(report(), report(**changes), tolerance=0.2) == [problem]
+
+
+def test_runs_with_other_settings_are_not_compared():
+    other = report(rps=1.0)
+    other["settings"] = {"concurrency": 2, "mix": {"dashboard": 25}}
+
+    [problem] = compare(report(), other, tolerance=0.2)
+    assert problem.startswith("settings differ from the baseline")
+
+
+def test_operations_that_did_not_run_are_skipped():
+    idle = copy.deepcopy(report())
+    idle["ops"]["dashboard"].update(count=0, p95=1.0, errors=5)
+
+    assert compare(report(), idle, tolerance=0.2) == []
+
+
+def test_parse_mix():
+    assert parse_mix("dashboard=3, transfer") == {
+        "dashboard": (3, DEFAULT_MIX["dashboard"][1]),
+        "transfer": DEFAULT_MIX["transfer"],
+    }
+    with pytest.raises(click.BadParameter):
+        parse_mix("dashboard=3,deposit=1")
+
+
+def test_budget():
+    budget = Budget(2)
+    assert [budget.take() for _ in range(3)] == [True, True, False]
+    assert Budget(None).take()
+
+
+def test_bench_against_mysql(mysql_app):
+    config = mysql_app.config
+    password_hash = bench.make_hash(
+        bench.BENCH_PASSWORD, config["PASSWORD_SCRYPT_N"], config["PASSWORD_SCRYPT_R"], config["PASSWORD_SCRYPT_P"]
+    )
+    with mysql_app.app_context():
+        prefix, accounts = bench.seed(db.connection, users=4, transactions=3, password_hash=password_hash)
+        try:
+            result = bench.run(mysql_app, accounts, concurrency=2, duration=30.0, requests=40)
+        finally:
+            bench.cleanup(db.connection, prefix)
+
+    assert result["requests"] <= 40
+    assert all(stats["errors"] == 0 for stats in result["ops"].values())
+    assert compare(result, result, tolerance=0.0) == []
@@ -0,0 +1,104 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.bootstrap import SECTIONS, parse_fields, pick
+
+from .conftest import log_in
+
+USER_ROW = (1, "Ada", "a@example.com", "1000000001", Decimal("60.00"), "1234", None, 1)
+HISTORY_ROW = ("1000000001", None, Decimal("100.00"), "deposit", datetime(2026, 1, 5, 9), 7)
+
+
+def test_no_fields_selects_everything():
+    assert parse_fields(None) == {section: set(fields) for section, fields in SECTIONS.items()}
+    assert parse_fields("") == parse_fields(None)
+
+
+def test_fields_pick_sections_and_single_fields():
+    assert parse_fields("profile.name, profile.email,stats,flashes") == {
+        "profile": {"name", "email"},
+        "stats": set(SECTIONS["stats"]),
+        "flashes": set(),
+    }
+
+
+@pytest.mark.parametrize("text, message", [
+    ("wallet", "Unknown section: wallet"),
+    ("profile.pin", "Unknown field: profile.pin"),
+    ("profile.name,", "Unknown section: "),
+])
+def test_unknown_fields_are_rejected(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_fields(text)
+
+
+def test_pick():
+    assert pick({"name": "Ada", "email": "a@example.com"}, {"name"}) == {"name": "Ada"}
+
+
+def test_unknown_fields_get_a_400(client):
+    response = client.get("/api/bootstrap?fields=profile.transaction_pin")
+
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Unknown field: profile.transaction_pin"
+
+
+def test_logged_out_shells_get_the_session_and_flashes_only(client, fake_db):
+    with client.session_transaction() as session:
+        session["_flashes"] = [("info", "Welcome back")]
+
+    response = client.get("/api/bootstrap")
+
+    assert response.get_json() == {
+        "success": True,
+        "session": {"logged_in": False},
+        "flashes": [{"message": "Welcome back", "type": "info"}],
+    }
+    assert fake_db.statements == []
+
+
+def answer(sql, params):
+    if sql.startswith("SELECT id, name, email, account_number"):
+        return [USER_ROW]
+    if sql.startswith("SELECT total_deposit"):
+        return [(Decimal(100), Decimal(40))]
+    if "ORDER BY created_at DESC" in sql:
+        return [HISTORY_ROW]
+    return []
+
+
+def test_one_request_loads_the_whole_shell(client, fake_db):
+    log_in(client)
+    fake_db.answer = answer
+
+    data = client.get("/api/bootstrap").get_json()
+
+    assert data["profile"] == {
+        "name": "Ada", "email": "a@example.com", "account_number": "1000000001", "balance": 60.0,
+        "profile_pic_url": "/default-profile.png",
+    }
+    assert data["balance"] == 60.0
+    assert data["stats"] == {"total_deposit": 100.0, "total_withdrawal": 40.0, "spent_percent": 28.57,
+                             "saved_percent": 71.43}
+    assert [item["id"] for item in data["transactions"]["items"]] == [7]
+    assert data["transactions"]["next_cursor"] is None
+    assert len(fake_db.executed("SELECT id, name, email, account_number")) == 1
+
+
+def test_only_the_requested_parts_are_read(client, fake_db):
+    log_in(client)
+    fake_db.answer = answer
+
+    data = client.get("/api/bootstrap?fields=profile.name,balance").get_json()
+
+    assert data == {"success": True, "profile": {"name": "Ada"}, "balance": 60.0}
+    assert [sql.split()[:2] for sql, _ in fake_db.statements] == [["SELECT", "id,"]]
+
+
+def test_a_deleted_account_gets_a_404(client, fake_db):
+    log_in(client)
+
+    assert client.get("/api/bootstrap?fields=balance").status_code == 404
+    assert client.get("/api/bootstrap?fields=session").get_json() == {"success": True, "session": {"logged_in": True}}
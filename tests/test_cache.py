@@ -0,0 +1,82 @@
+import pytest
+
+from app import cache, recipients
+from app.cache import MISSING, LRUCache
+
+from .conftest import log_in
+
+LOOKUP = "SELECT name, email FROM users WHERE account_number = %s"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_own_ttl(clock):
+    lru = LRUCache()
+    lru.set("short", None, 30)
+    lru.set("long", {"name": "Ada"}, 300)
+
+    clock[0] += 31
+
+    assert lru.get("short") is MISSING
+    assert lru.get("long") == {"name": "Ada"}
+    assert len(lru) == 1
+
+
+def test_the_least_recently_used_entry_is_evicted():
+    lru = LRUCache(max_size=2)
+    lru.set("a", 1, 60)
+    lru.set("b", 2, 60)
+    lru.get("a")
+
+    lru.set("c", 3, 60)
+
+    assert lru.get("b") is MISSING
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+
+
+def test_misses_are_cached_for_the_negative_ttl(app, clock):
+    loads = []
+
+    def loader(account_number):
+        loads.append(account_number)
+        return None if account_number == "1999999999" else {"name": "Bob", "email": "b@example.com"}
+
+    with app.app_context():
+        for _ in range(2):
+            recipients.lookup("1999999999", loader)
+            recipients.lookup("1000000002", loader)
+        assert loads == ["1999999999", "1000000002"]
+
+        clock[0] += app.config["RECIPIENT_CACHE_NEGATIVE_TTL"] + 1
+        recipients.lookup("1999999999", loader)
+        recipients.lookup("1000000002", loader)
+        assert loads == ["1999999999", "1000000002", "1999999999"]
+
+        metrics = recipients.metrics()
+    assert (metrics["hits"], metrics["negative_hits"], metrics["misses"]) == (2, 1, 3)
+
+
+def test_registering_an_account_forgets_that_it_was_missing(client, fake_db):
+    log_in(client)
+
+    for _ in range(2):
+        assert client.get("/api/recipient_name?account_number=1000000003").status_code == 404
+    assert len(fake_db.executed(LOOKUP)) == 1
+
+    client.get("/logout")
+    client.post("/register", data={
+        "name": "Cy", "account_number": "1000000003", "transaction_pin": "1234",
+        "email": "c@example.com", "password": "correct horse",
+    })
+    assert fake_db.executed("INSERT INTO users") != []
+
+    fake_db.answer = lambda sql, params: [("Cy", "c@example.com")] if sql == LOOKUP else []
+    response = client.get("/api/recipient_name?account_number=1000000003")
+
+    assert response.get_json() == {"success": True, "name": "Cy"}
+    assert len(fake_db.executed(LOOKUP)) == 2
@@ -0,0 +1,208 @@
+import json
+import os
+import sys
+import threading
+import types
+from collections import defaultdict
+
+import pytest
+
+from app.db import ConnectionPool
+from app.events import LocalBackend, RedisBackend, hub
+
+from .conftest import log_in
+
+
+def open_stream(client):
+    response = client.get("/api/events")
+    chunks = response.iter_encoded()
+    if response.status_code == 200:
+        assert next(chunks) == b"retry: 5000\n\n"
+    return response, chunks
+
+
+def test_local_backend_delivers_to_subscribers_of_a_channel():
+    backend = LocalBackend()
+    first = backend.subscribe("a")
+    second = backend.subscribe("a")
+    other = backend.subscribe("b")
+
+    assert backend.publish("a", "hello") == 2
+    assert (first.get(0), second.get(0), other.get(0)) == ("hello", "hello", None)
+
+    first.close()
+    assert backend.publish("a", "again") == 1
+    second.close()
+    assert backend.publish("a", "gone") == 0
+    assert "a" not in backend._subscribers
+
+
+def test_publish_reports_a_failing_backend_as_no_receivers(app, monkeypatch):
+    def broken(channel, payload):
+        raise ConnectionError("down")
+
+    with app.app_context():
+        monkeypatch.setattr(hub.backend, "publish", broken)
+        assert hub.publish("a@example.com", "balance", {}) == 0
+
+
+def test_stream_requires_a_session(client):
+    assert client.get("/api/events").status_code == 401
+
+
+def test_stream_sends_pending_flashes_then_published_events(app, client):
+    log_in(client)
+    with client.session_transaction() as session:
+        session["_flashes"] = [("info", "Welcome back")]
+
+    response, chunks = open_stream(client)
+    assert response.mimetype == "text/event-stream"
+    assert next(chunks) == b'event: flash\ndata: {"messages": [{"message": "Welcome back", "type": "info"}]}\n\n'
+    with client.session_transaction() as session:
+        assert "_flashes" not in session
+
+    with app.app_context():
+        assert hub.publish("a@example.com", "balance", {"balance": 12.5}) == 1
+    assert next(chunks) == b'event: balance\ndata: {"balance": 12.5}\n\n'
+
+    response.close()
+    with app.app_context():
+        assert hub.publish("a@example.com", "balance", {"balance": 0}) == 0
+
+
+def test_flashes_go_to_open_streams_instead_of_the_session(app, client):
+    log_in(client)
+    with app.app_context():
+        subscription = hub.subscribe("a@example.com")
+    try:
+        client.post("/api/login", json={})
+        message = json.loads(subscription.get(1))
+    finally:
+        subscription.close()
+
+    assert message == {"event": "flash", "data": {"messages": [
+        {"message": "Email and password are required.", "type": "danger"},
+    ]}}
+    with client.session_transaction() as session:
+        assert "_flashes" not in session
+
+
+def test_flashes_stay_in_the_session_without_a_listener(client):
+    log_in(client)
+    client.post("/api/login", json={})
+
+    assert client.get("/api/flash").get_json()["messages"] == [
+        {"message": "Email and password are required.", "type": "danger"},
+    ]
+
+
+def test_streams_over_the_limit_are_turned_away(app, client, caplog):
+    hub.limit_streams(app, 1)
+    log_in(client)
+
+    first, _ = open_stream(client)
+    refused, _ = open_stream(client)
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == "30"
+    assert "all 1 slots of this worker are open" in caplog.text
+    with app.app_context():
+        assert hub.metrics() == {"open": 1, "limit": 1, "refused": 1}
+    app.extensions["db_pool"] = ConnectionPool(lambda: None, min_size=0)
+    assert "event_streams_refused 1" in client.get("/metrics").get_data(as_text=True)
+
+    first.close()
+    second, _ = open_stream(client)
+    assert second.status_code == 200
+    second.close()
+    with app.app_context():
+        assert hub.metrics()["open"] == 0
+
+
+def test_serve_leaves_a_thread_free_for_requests(app, monkeypatch):
+    from gunicorn.app.base import BaseApplication
+
+    from app.serve import serve
+
+    monkeypatch.setattr(BaseApplication, "run", lambda self: None)
+    app.config["SERVER_THREADS"] = 6
+    serve(app, workers=1)
+
+    with app.app_context():
+        assert hub.metrics()["limit"] == 5
+
+
+class FakeRedis:
+    """One Redis server shared by every client made from the same URL."""
+
+    servers = defaultdict(lambda: defaultdict(list))
+
+    def __init__(self, url):
+        self.channels = self.servers[url]
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(url)
+
+    def publish(self, channel, payload):
+        handlers = list(self.channels[channel])
+        for handler in handlers:
+            handler({"data": payload.encode()})
+        return len(handlers)
+
+    def pubsub(self, ignore_subscribe_messages):
+        return FakePubSub(self.channels)
+
+
+class FakePubSub:
+    def __init__(self, channels):
+        self.channels = channels
+        self.handlers = {}
+
+    def subscribe(self, **handlers):
+        self.handlers = handlers
+        for channel, handler in handlers.items():
+            self.channels[channel].append(handler)
+
+    def run_in_thread(self, sleep_time, daemon):
+        stopped = threading.Event()
+        stopped.stop = stopped.set
+        return stopped
+
+    def close(self):
+        for channel, handler in self.handlers.items():
+            self.channels[channel].remove(handler)
+
+
+def test_redis_backend_fans_out_to_every_worker(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", types.SimpleNamespace(Redis=FakeRedis))
+    FakeRedis.servers.clear()
+    worker_one = RedisBackend("redis://events")
+    worker_two = RedisBackend("redis://events")
+
+    first = worker_one.subscribe("a@example.com")
+    second = worker_two.subscribe("a@example.com")
+    assert worker_one.publish("a@example.com", '{"event": "balance"}') == 2
+    assert first.get(0) == second.get(0) == '{"event": "balance"}'
+
+    second.close()
+    assert second.thread.is_set()
+    assert worker_two.publish("a@example.com", "again") == 1
+    assert (first.get(0), second.get(0)) == ("again", None)
+    first.close()
+
+
+def test_redis_backend_against_a_server():
+    url = os.environ.get("TEST_REDIS_URL")
+    if not url:
+        pytest.skip("TEST_REDIS_URL is not set")
+    pytest.importorskip("redis")
+    backend = RedisBackend(url, prefix="test-events:")
+    subscription = backend.subscribe("a@example.com")
+    try:
+        for _ in range(50):
+            if backend.publish("a@example.com", "hello"):
+                break
+            threading.Event().wait(0.1)
+        assert subscription.get(5) == "hello"
+    finally:
+        subscription.close()
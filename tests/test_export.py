@@ -0,0 +1,145 @@
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.export import (
+    EXPORT_COLUMNS, encode_ndjson, export, export_args, export_rows, gzip_chunks, opening_balance,
+)
+from app.history import ARCHIVE_TABLE
+
+from .conftest import FakeConnection, log_in
+
+ACCOUNT = "1000000001"
+
+# id, created_at, type, account_number, recipient_account, amount
+LEDGER = [
+    (1, datetime(2026, 1, 5, 9), "deposit", ACCOUNT, None, Decimal("100.00")),
+    (2, datetime(2026, 1, 6, 9), "transfer", ACCOUNT, "1000000002", Decimal("-30.00")),
+    (3, datetime(2026, 1, 7, 9), "transfer", "1000000002", ACCOUNT, Decimal("-12.50")),
+]
+
+
+def bank(balance=Decimal("500.00"), changes=Decimal("82.50")):
+    """Today's balance, the sum of the changes since the start of the export and the ledger."""
+    conn = FakeConnection()
+
+    def answer(sql, params):
+        if sql.startswith("SELECT balance FROM users"):
+            return [(balance,)] if balance is not None else []
+        if sql.startswith("SELECT COALESCE(SUM(change_amount), 0)"):
+            return [(changes,)]
+        if sql.startswith("SELECT id, created_at"):
+            return LEDGER
+        return []
+    conn.answer = answer
+    return conn
+
+
+def test_export_args():
+    assert export_args(MultiDict(), today=date(2026, 3, 1)) == ("csv", date(1970, 1, 1), date(2026, 3, 1))
+    assert export_args(MultiDict({"format": "ndjson", "start": "2026-01-01", "end": "2026-01-31"})) == (
+        "ndjson", date(2026, 1, 1), date(2026, 1, 31),
+    )
+    for args in ({"format": "xlsx"}, {"start": "2026-02-01", "end": "2026-01-01"}):
+        with pytest.raises(ValueError):
+            export_args(MultiDict(args))
+
+
+def test_the_opening_balance_takes_back_every_change_since_the_start():
+    conn = bank()
+
+    assert opening_balance(conn.cursor(), ACCOUNT, date(2026, 1, 1)) == Decimal("417.50")
+    assert opening_balance(bank(balance=None).cursor(), ACCOUNT, date(2026, 1, 1)) is None
+
+
+def test_the_opening_balance_reads_the_archive_only_before_the_horizon():
+    conn = bank()
+    horizon = datetime(2025, 3, 1)
+
+    opening_balance(conn.cursor(), ACCOUNT, date(2026, 1, 1), horizon)
+    opening_balance(conn.cursor(), ACCOUNT, date(2024, 1, 1), horizon)
+
+    sums = [sql for sql, _ in conn.statements if sql.startswith("SELECT COALESCE")]
+    assert [ARCHIVE_TABLE in sql for sql in sums] == [False, True]
+
+
+def test_rows_carry_their_direction_and_running_balance():
+    conn = bank()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, created_at FROM transactions")
+
+    rows = list(export_rows(cursor, ACCOUNT, Decimal("417.50")))
+
+    assert [row[3:] for row in rows] == [
+        ("in", None, Decimal("100.00"), Decimal("517.50")),
+        ("out", "1000000002", Decimal("-30.00"), Decimal("487.50")),
+        ("in", "1000000002", Decimal("12.50"), Decimal("500.00")),
+    ]
+
+
+def test_the_closing_balance_reconciles_with_the_account():
+    chunks = export(bank(), bank().cursor(), ACCOUNT, "csv", date(2026, 1, 1), date(2026, 1, 31))
+
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    assert [row[-1] for row in rows[1:]] == ["517.50", "487.50", "500.00"]
+
+
+def test_the_export_runs_in_one_snapshot():
+    conn = bank()
+
+    export(conn, conn.cursor(), ACCOUNT, "csv", date(2026, 1, 1), date(2026, 1, 31))
+
+    assert [sql for sql, _ in conn.statements][:2] == [
+        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ",
+        "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY",
+    ]
+
+
+def test_an_unknown_account_is_a_lookup_error():
+    conn = bank(balance=None)
+
+    with pytest.raises(LookupError):
+        export(conn, conn.cursor(), ACCOUNT, "csv", date(2026, 1, 1), date(2026, 1, 31))
+
+
+def test_encode_ndjson():
+    row = (1, datetime(2026, 1, 5, 9), "deposit", "in", None, Decimal("100.00"), Decimal("517.50"))
+
+    [line] = "".join(encode_ndjson([row])).splitlines()
+
+    assert json.loads(line) == {
+        "id": 1, "date": "2026-01-05 09:00:00", "type": "deposit", "direction": "in",
+        "counterparty": None, "amount": "100.00", "balance": "517.50",
+    }
+
+
+def test_gzip_chunks():
+    assert gzip.decompress(b"".join(gzip_chunks(["a,b\n", "", "1,2\n"]))) == b"a,b\n1,2\n"
+
+
+def test_the_endpoint_streams_a_gzipped_statement(client, fake_db):
+    log_in(client)
+    statement = bank()
+    user_row = (1, "Ada", "a@example.com", ACCOUNT, Decimal("500.00"), "1234", None, 1)
+    fake_db.answer = lambda sql, params: (
+        [user_row] if sql.startswith("SELECT id, name, email, account_number") else statement.answer(sql, params)
+    )
+
+    response = client.get("/api/export?start=2026-01-01&end=2026-01-31", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Disposition"] == (
+        f'attachment; filename="statement-{ACCOUNT}-2026-01-01-2026-01-31.csv"'
+    )
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert len(lines) == 4 and lines[-1].endswith(",500.00")
+    assert client.get("/api/export?format=xlsx").status_code == 400
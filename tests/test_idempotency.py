@@ -0,0 +1,162 @@
+import os
+
+import pytest
+from flask import jsonify, request
+
+from app import db
+from app.idempotency import LOAD_RECORD, LocalStore, SQLStore, idempotent, prune
+
+from .conftest import log_in
+
+
+class KeyTable:
+    """The idempotency_keys table in memory, with a clock standing in for NOW()."""
+
+    def __init__(self):
+        self.rows = {}
+        self.now = 0
+
+    def answer(self, sql, params):
+        if sql == " ".join(LOAD_RECORD.split()):
+            row = self.rows.get(params[0])
+            return [tuple(row[:3])] if row else []
+        return []
+
+    def rowcount(self, sql, params):
+        if sql.startswith("INSERT IGNORE INTO idempotency_keys"):
+            key, lease = params
+            if key in self.rows:
+                return 0
+            self.rows[key] = [None, None, None, self.now + lease]
+            return 1
+        if sql.startswith("UPDATE idempotency_keys SET fingerprint = NULL"):
+            lease, key = params
+            if self.rows[key][3] > self.now:
+                return 0
+            self.rows[key] = [None, None, None, self.now + lease]
+            return 1
+        if sql.startswith("UPDATE idempotency_keys SET fingerprint = %s"):
+            fingerprint, status, body, ttl, key = params
+            self.rows[key] = [fingerprint, status, body, self.now + ttl]
+            return 1
+        if sql.startswith("DELETE FROM idempotency_keys WHERE id"):
+            return 1 if self.rows.pop(params[0], None) else 0
+        return 0
+
+
+@pytest.fixture(params=["local", "sql"])
+def store(request, app, fake_db):
+    """Runs each test on the in-process store and on the SQL one."""
+    app.config["IDEMPOTENCY_WAIT"] = 0
+    if request.param == "local":
+        app.extensions["idempotency"] = LocalStore(100)
+    else:
+        table = KeyTable()
+        fake_db.answer, fake_db.rowcount = table.answer, table.rowcount
+        app.extensions["idempotency"] = SQLStore(db)
+    return request.param
+
+
+@pytest.fixture
+def calls(app, client):
+    """A POST /charge view that records each run; it can retry itself by posting ``nested``."""
+    calls = []
+
+    @idempotent
+    def charge():
+        data = request.get_json()
+        calls.append(data)
+        if "nested" in data:
+            nested = client.post("/charge", json=data["nested"], headers={"Idempotency-Key": "k1"})
+            return jsonify(nested.get_json()), nested.status_code
+        return jsonify({"charged": data["amount"]}), data.get("status", 200)
+
+    app.add_url_rule("/charge", view_func=charge, methods=["POST"])
+    log_in(client)
+    return calls
+
+
+def post(client, body, key="k1"):
+    return client.post("/charge", json=body, headers={"Idempotency-Key": key})
+
+
+def test_a_retry_gets_the_first_response_back(store, client, calls):
+    first = post(client, {"amount": 5})
+    retry = post(client, {"amount": 5})
+
+    assert (retry.status_code, retry.get_json()) == (first.status_code, {"charged": 5})
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert calls == [{"amount": 5}]
+
+
+def test_a_key_reused_for_another_body_is_refused(store, client, calls):
+    post(client, {"amount": 5})
+    response = post(client, {"amount": 6})
+
+    assert response.status_code == 422
+    assert calls == [{"amount": 5}]
+
+
+def test_a_duplicate_of_a_running_request_gets_a_409(store, client, calls):
+    response = post(client, {"amount": 5, "nested": {"amount": 5}})
+
+    assert response.status_code == 409
+    assert response.get_json()["message"] == "This request is still being processed"
+    assert len(calls) == 1
+
+
+def test_server_errors_are_not_stored(store, client, calls):
+    assert post(client, {"amount": 5, "status": 503}).status_code == 503
+    assert post(client, {"amount": 5, "status": 503}).status_code == 503
+    assert len(calls) == 2
+
+
+def test_keys_are_scoped_to_the_user(store, client, calls):
+    post(client, {"amount": 5})
+    log_in(client, email="b@example.com", account_number="1000000002")
+    post(client, {"amount": 5})
+
+    assert len(calls) == 2
+
+
+def test_requests_without_a_key_always_run(store, client, calls):
+    for _ in range(2):
+        client.post("/charge", json={"amount": 5})
+    assert post(client, {"amount": 5}, key="k" * 256).status_code == 400
+    assert len(calls) == 2
+
+
+def test_an_abandoned_claim_is_taken_over_after_its_lease(app, fake_db):
+    table = KeyTable()
+    fake_db.answer, fake_db.rowcount = table.answer, table.rowcount
+    store = SQLStore(db)
+    key = b"k" * 16
+
+    with app.app_context():
+        assert store.claim(key, wait=0, lease=60) is None
+        table.now = 61
+        assert store.claim(key, wait=0, lease=60) is None
+        store.finish(key, (b"f" * 8, 200, b"{}"), ttl=3600)
+        assert store.claim(key, wait=0, lease=60) == (b"f" * 8, 200, b"{}")
+
+
+def test_prune_deletes_in_batches(fake_db):
+    counts = iter([3, 3, 1])
+    fake_db.rowcount = lambda sql, params: next(counts)
+
+    assert prune(fake_db, batch_size=3) == 7
+    assert fake_db.commits == 3
+
+
+def test_sql_store_against_mysql(mysql_app):
+    store = SQLStore(db)
+    key = os.urandom(16)
+
+    with mysql_app.app_context():
+        assert store.claim(key, wait=0, lease=60) is None
+        store.finish(key, (b"f" * 8, 200, b"{}"), ttl=60)
+        assert store.claim(key, wait=0, lease=60) == (b"f" * 8, 200, b"{}")
+        store.finish(key, None, ttl=60)
+        assert store.claim(key, wait=0, lease=60) is None
+        store.finish(key, None, ttl=60)
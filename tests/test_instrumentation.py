@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from app.instrumentation import Registry, _profile_lock, fingerprint, registry
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT * FROM users WHERE id = 42", "SELECT * FROM users WHERE id = ?"),
+    ("SELECT  name\n  FROM users WHERE email = 'a@b.c'", "SELECT name FROM users WHERE email = ?"),
+    ("SELECT a FROM t WHERE n IN (%s, %s, %s)", "SELECT a FROM t WHERE n IN (...)"),
+    (b"DELETE FROM t WHERE id = 7", "DELETE FROM t WHERE id = ?"),
+])
+def test_fingerprints_share_one_label_per_statement(query, expected):
+    assert fingerprint(query) == expected
+
+
+def test_registry_renders_prometheus_text():
+    metrics = Registry()
+    metrics.observe("latency", (("endpoint", "x"),), 0.003, buckets=(0.001, 0.01))
+    metrics.inc("errors", (("endpoint", 'say "hi"'),))
+
+    assert metrics.render([("pool_size", 2)]).splitlines() == [
+        "# TYPE latency histogram",
+        'latency_bucket{endpoint="x",le="0.001"} 0',
+        'latency_bucket{endpoint="x",le="0.01"} 1',
+        'latency_bucket{endpoint="x",le="+Inf"} 1',
+        'latency_sum{endpoint="x"} 0.003',
+        'latency_count{endpoint="x"} 1',
+        "# TYPE errors counter",
+        'errors{endpoint="say \\"hi\\""} 1',
+        "# TYPE pool_size gauge",
+        "pool_size 2",
+    ]
+
+
+def test_metrics_are_served_to_allowed_addresses(client, fake_db):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "db_pool_size" in response.get_data(as_text=True)
+
+
+def test_metrics_are_refused_to_other_addresses(client, fake_db):
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "203.0.113.9"}).status_code == 403
+
+
+def test_metrics_token(app, client, fake_db):
+    app.config["METRICS_TOKEN"] = "s3cret"
+    remote = {"REMOTE_ADDR": "203.0.113.9"}
+
+    assert client.get("/metrics", environ_base=remote, headers={"Authorization": "Bearer s3cret"}).status_code == 200
+    assert client.get("/metrics", environ_base=remote, headers={"Authorization": "Bearer guess"}).status_code == 403
+
+
+def test_sampled_requests_are_profiled(app, client, tmp_path):
+    app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=str(tmp_path))
+
+    client.get("/api/session_status")
+
+    assert [name.split("-")[0] for name in os.listdir(tmp_path)] == ["api.api_session_status"]
+    assert not _profile_lock.locked()
+
+
+def test_the_profiler_is_released_when_recording_fails(app, client, tmp_path, monkeypatch):
+    app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=str(tmp_path))
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("broken histogram")
+
+    monkeypatch.setattr(registry, "observe", broken)
+    with pytest.raises(RuntimeError):
+        client.get("/api/session_status")
+
+    assert not _profile_lock.locked()
+    assert len(os.listdir(tmp_path)) == 1
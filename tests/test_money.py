@@ -0,0 +1,254 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import aiomysql
+import MySQLdb
+import pytest
+from flask.sessions import SecureCookieSessionInterface
+
+from app import create_app
+from app.analytics import RECORD_DELTA
+from app.db import ConnectionPool
+from app.stats import RECORD_DEPOSIT, RECORD_WITHDRAWAL
+from app.transfers import CREDIT, DEPOSIT_LEDGER, FIND_PARTIES, TRANSFER, TRANSFER_LEDGER
+from app.user_context import USER_QUERY
+
+from .conftest import FakeConnection
+
+
+def normal(sql):
+    return " ".join(sql.split())
+
+
+class Bank:
+    """Two accounts in memory, answering the statements of deposits and transfers."""
+
+    def __init__(self):
+        self.accounts = {
+            "1000000001": {"name": "Ada", "email": "a@example.com", "balance": Decimal(100), "pin": "1234"},
+            "1000000002": {"name": "Bob", "email": "b@example.com", "balance": Decimal(0), "pin": "9999"},
+        }
+        self.conn = FakeConnection()
+        self.conn.answer = self.answer
+        self.conn.rowcount = self.rowcount
+
+    def balances(self):
+        return {number: account["balance"] for number, account in self.accounts.items()}
+
+    def writes(self):
+        return [sql for sql, _ in self.conn.statements if not sql.startswith("SELECT")]
+
+    def answer(self, sql, params):
+        if sql == normal(USER_QUERY):
+            return [
+                (1, a["name"], a["email"], number, a["balance"], a["pin"], None, 1)
+                for number, a in self.accounts.items() if a["email"] == params[0]
+            ]
+        if sql == "SELECT name, email FROM users WHERE account_number = %s":
+            account = self.accounts.get(params[0])
+            return [(account["name"], account["email"])] if account else []
+        if sql == normal(FIND_PARTIES):
+            return [(number,) for number in params if number in self.accounts]
+        return []
+
+    def rowcount(self, sql, params):
+        if sql == normal(CREDIT):
+            amount, number = params
+            if number not in self.accounts:
+                return 0
+            self.accounts[number]["balance"] += Decimal(str(amount))
+            return 1
+        if sql == normal(TRANSFER):
+            sender, amount, _, _, recipient, _, _ = params
+            amount = Decimal(str(amount))
+            matched = [n for n in (sender, recipient) if n in self.accounts]
+            if sender in matched and self.accounts[sender]["balance"] < amount:
+                matched.remove(sender)
+            if len(matched) == 2:
+                self.accounts[sender]["balance"] -= amount
+                self.accounts[recipient]["balance"] += amount
+            return len(matched)
+        return 1
+
+
+class AsyncCursor:
+    """aiomysql's face on a FakeCursor."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        self.cursor.execute(sql, params)
+
+    async def executemany(self, sql, seq):
+        self.cursor.executemany(sql, seq)
+
+    async def fetchone(self):
+        return self.cursor.fetchone()
+
+    async def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class AsyncConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return AsyncCursor(self.conn.cursor())
+
+    async def commit(self):
+        self.conn.commit()
+
+    async def rollback(self):
+        self.conn.rollback()
+
+
+def session_data(app, cookie):
+    return app.session_interface.get_signing_serializer(app).loads(cookie)
+
+
+def flask_post(app, bank, path, body):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user="a@example.com", user_account_number="1000000001")
+    response = client.post(path, json=body)
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+    return response.status_code, session_data(app, cookie).get("_flashes", [])
+
+
+def asgi_post(app, bank, path, body):
+    name = app.config["SESSION_COOKIE_NAME"]
+    login = app.session_interface.get_signing_serializer(app).dumps(
+        {"user": "a@example.com", "user_account_number": "1000000001"}
+    )
+    scope = {
+        "type": "http", "method": "POST", "path": path, "query_string": b"", "http_version": "1.1",
+        "scheme": "http", "server": ("testserver", 80),
+        "headers": [(b"content-type", b"application/json"), (b"cookie", f"{name}={login}".encode())],
+    }
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def acquire():
+        return AsyncConnection(bank.conn)
+
+    async def release(conn):
+        pass
+
+    app.asgi_app.acquire = acquire
+    app.asgi_app.release = release
+    asyncio.run(asyncio.wait_for(app.asgi_app(scope, receive, send), 5))
+
+    headers = dict(sent[0]["headers"])
+    cookie = headers[b"set-cookie"].decode().split(";")[0].split("=", 1)[1]
+    return sent[0]["status"], session_data(app, cookie).get("_flashes", [])
+
+
+@pytest.fixture(params=["flask", "asgi"])
+def post(request):
+    """Posts as a@example.com through the Flask view or the async API, which must agree."""
+    asgi = request.param == "asgi"
+    app = create_app(async_api=asgi)
+    app.testing = True
+    app.config["ROLLUP_COMPACT_INTERVAL"] = 0
+    app.session_interface = SecureCookieSessionInterface()
+    bank = Bank()
+    app.extensions["db_pool"] = ConnectionPool(lambda: bank.conn, min_size=0)
+
+    def post(path, body):
+        return (asgi_post if asgi else flask_post)(app, bank, path, body)
+
+    post.bank = bank
+    post.error = aiomysql.OperationalError if asgi else MySQLdb.OperationalError
+    return post
+
+
+@pytest.mark.parametrize("body, status, message", [
+    ({}, 400, "Amount is required."),
+    ({"amount": "lots"}, 400, "Invalid amount format."),
+    ({"amount": -5}, 400, "Amount must be greater than $0."),
+    ({"amount": 100001}, 400, "Limit exceeded. Max: $100,000"),
+])
+def test_invalid_deposits(post, body, status, message):
+    assert post("/api/deposit", body) == (status, [("danger", message)])
+    assert post.bank.writes() == []
+
+
+def test_deposit(post):
+    assert post("/api/deposit", {"amount": 25}) == (200, [("success", "Successfully deposited $25.00!")])
+
+    assert post.bank.balances() == {"1000000001": 125, "1000000002": 0}
+    assert post.bank.writes() == [normal(CREDIT), normal(DEPOSIT_LEDGER), normal(RECORD_DEPOSIT), normal(RECORD_DELTA)]
+    assert post.bank.conn.commits == 1
+
+
+def test_deposit_into_a_deleted_account(post):
+    del post.bank.accounts["1000000001"]
+
+    assert post("/api/deposit", {"amount": 25}) == (404, [("danger", "User not found.")])
+    assert post.bank.writes() == [normal(CREDIT)]
+
+
+TRANSFER_BODY = {"recipient_account": "1000000002", "amount": "40", "transaction_pin": "1234"}
+
+
+@pytest.mark.parametrize("changes, status, message", [
+    ({"transaction_pin": None}, 400, "All fields are required."),
+    ({"recipient_account": "1000000001"}, 400, "Cannot transfer to yourself."),
+    ({"transaction_pin": "0000"}, 403, "Invalid transaction PIN!"),
+    ({"amount": "forty"}, 400, "Invalid amount."),
+    ({"amount": "-1"}, 400, "Amount must be positive."),
+    ({"recipient_account": "1999999999"}, 404, "Recipient account not found."),
+    ({"amount": "100.01"}, 400, "Insufficient balance."),
+])
+def test_rejected_transfers(post, changes, status, message):
+    assert post("/api/transactions", {**TRANSFER_BODY, **changes}) == (status, [("danger", message)])
+
+    assert post.bank.balances() == {"1000000001": 100, "1000000002": 0}
+    assert post.bank.conn.commits == 0
+
+
+def test_transfer(post):
+    assert post("/api/transactions", TRANSFER_BODY) == (200, [("success", "Transaction successful!")])
+
+    assert post.bank.balances() == {"1000000001": 60, "1000000002": 40}
+    assert post.bank.writes() == [
+        normal(TRANSFER), normal(TRANSFER_LEDGER), normal(RECORD_WITHDRAWAL), normal(RECORD_DELTA),
+        normal(RECORD_DELTA),
+    ]
+    assert post.bank.conn.commits == 1
+
+
+def test_deadlocked_transfers_are_retried(post):
+    rowcount = post.bank.rowcount
+    errors = [post.error(1213, "Deadlock found when trying to get lock")]
+
+    def deadlock_once(sql, params):
+        if sql == normal(TRANSFER) and errors:
+            raise errors.pop()
+        return rowcount(sql, params)
+
+    post.bank.conn.rowcount = deadlock_once
+
+    assert post("/api/transactions", TRANSFER_BODY) == (200, [("success", "Transaction successful!")])
+    assert post.bank.balances() == {"1000000001": 60, "1000000002": 40}
+    assert post.bank.writes().count(normal(TRANSFER)) == 2
+    assert post.bank.conn.commits == 1
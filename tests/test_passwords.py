@@ -0,0 +1,80 @@
+import hashlib
+
+import pytest
+
+from app import passwords
+from app.passwords import SCHEME, check_hash, make_hash
+
+COST = (2 ** 4, 8, 1)
+LOOKUP = "SELECT password_hash, id, name, email, account_number FROM users WHERE email = %s"
+
+
+@pytest.fixture
+def cheap(app):
+    app.config.update(PASSWORD_SCRYPT_N=COST[0], PASSWORD_SCRYPT_R=COST[1], PASSWORD_SCRYPT_P=COST[2])
+    return app
+
+
+def test_scrypt_hashes_are_salted_and_verified():
+    first, second = make_hash("hunter2", *COST), make_hash("hunter2", *COST)
+
+    assert first.startswith(SCHEME + "$16$8$1$")
+    assert first != second
+    assert check_hash("hunter2", first, *COST) == (True, False)
+    assert check_hash("hunter3", first, *COST) == (False, False)
+
+
+def test_hashes_with_an_old_cost_need_a_rehash():
+    stored = make_hash("hunter2", 2 ** 3, 8, 1)
+
+    assert check_hash("hunter2", stored, *COST) == (True, True)
+    assert check_hash("hunter3", stored, *COST) == (False, False)
+
+
+def test_legacy_sha256_hashes_match_and_need_a_rehash():
+    stored = hashlib.sha256(b"hunter2").hexdigest()
+
+    assert check_hash("hunter2", stored, *COST) == (True, True)
+    assert check_hash("hunter3", stored, *COST) == (False, False)
+
+
+@pytest.mark.parametrize("stored", [None, "", "scrypt$16$8$1$nope", "scrypt$x$8$1$c2FsdA$ZGlnZXN0"])
+def test_missing_or_malformed_hashes_never_match(stored):
+    assert check_hash("hunter2", stored, *COST) == (False, False)
+
+
+def test_unknown_users_are_checked_against_a_throwaway_hash(cheap):
+    with cheap.app_context():
+        assert passwords.verify("hunter2", None) == (False, False)
+        dummy = cheap.extensions["password_hasher"]["dummy"]
+        assert dummy.startswith(SCHEME + "$")
+        passwords.verify("hunter2", None)
+        assert cheap.extensions["password_hasher"]["dummy"] == dummy
+
+
+def log_in_with(client, fake_db, stored, password="hunter2"):
+    row = (stored, 1, "Ada", "a@example.com", "1000000001")
+    fake_db.answer = lambda sql, params: [row] if sql == LOOKUP else []
+    response = client.post("/api/login", json={"email": "a@example.com", "password": password})
+    with client.session_transaction() as session:
+        assert response.status_code == (200 if "user" in session else 401)
+        return session.get("user")
+
+
+def test_login_upgrades_a_legacy_hash(cheap, client, fake_db):
+    assert log_in_with(client, fake_db, hashlib.sha256(b"hunter2").hexdigest()) == "a@example.com"
+
+    [(new_hash, email)] = fake_db.executed("UPDATE users SET password_hash")
+    assert email == "a@example.com"
+    assert check_hash("hunter2", new_hash, *COST) == (True, False)
+    assert fake_db.commits == 1
+
+
+def test_login_keeps_a_current_hash(cheap, client, fake_db):
+    assert log_in_with(client, fake_db, make_hash("hunter2", *COST)) == "a@example.com"
+    assert fake_db.executed("UPDATE users SET password_hash") == []
+
+
+def test_a_wrong_password_neither_logs_in_nor_rehashes(cheap, client, fake_db):
+    assert log_in_with(client, fake_db, hashlib.sha256(b"hunter2").hexdigest(), "hunter3") is None
+    assert fake_db.executed("UPDATE users SET password_hash") == []
@@ -0,0 +1,26 @@
+from app import db
+from app.schema import MIGRATIONS, current_version, full_scans
+
+
+def test_migrations_are_all_applied(mysql_app):
+    with mysql_app.app_context():
+        cursor = db.cursor()
+        try:
+            assert current_version(cursor) == len(MIGRATIONS)
+        finally:
+            cursor.close()
+
+
+def test_hot_queries_use_an_index(mysql_app):
+    with mysql_app.app_context():
+        assert full_scans(db.connection) == []
+
+
+def test_check_query_plans_fails_on_a_full_scan(app, monkeypatch):
+    monkeypatch.setattr("app.schema.full_scans", lambda connection: [("user by email", "users")])
+    monkeypatch.setattr(type(db), "connection", None)
+
+    result = app.test_cli_runner().invoke(args=["check-query-plans"])
+
+    assert result.exit_code == 1
+    assert "FULL SCAN: user by email reads users without an index" in result.output
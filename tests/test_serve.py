@@ -0,0 +1,87 @@
+import logging
+import os
+
+import pytest
+
+from app.db import ConnectionPool, db
+from app.serve import default_workers, options, worker_count
+
+from .conftest import FakeConnection
+
+
+class Worker:
+    pid = 4242
+    log = logging.getLogger("test.worker")
+
+
+def test_local_backends_get_one_worker_by_default(app, caplog):
+    assert app.config["EVENTS_BACKEND"] == "local"
+
+    assert worker_count(app) == 1
+    assert "EVENTS_BACKEND" in caplog.text
+
+
+def test_shared_backends_get_the_default_worker_count(app):
+    app.config.update(EVENTS_BACKEND="redis://events", IDEMPOTENCY_BACKEND="sql", SESSION_BACKEND="sql")
+
+    assert worker_count(app) == default_workers()
+    assert worker_count(app, 3) == 3
+
+
+@pytest.mark.parametrize("setting", [{"SERVER_WORKERS": 4}, {}])
+def test_several_workers_with_a_local_backend_are_refused(app, setting):
+    app.config.update(setting)
+
+    with pytest.raises(ValueError, match="EVENTS_BACKEND"):
+        worker_count(app, None if setting else 4)
+
+
+def test_serve_command_starts_with_the_shipped_config(app, monkeypatch):
+    started = {}
+    monkeypatch.setattr("app.serve.serve", lambda app, **overrides: started.update(overrides))
+
+    result = app.test_cli_runner().invoke(args=["serve"])
+
+    assert result.exit_code == 0, result.output
+    assert started == {"bind": None, "workers": 1}
+
+
+def test_post_fork_opens_the_workers_own_pool(app, monkeypatch):
+    conn = FakeConnection()
+
+    def create_pool(config):
+        pool = ConnectionPool(lambda: conn, min_size=1)
+        pool.fill()
+        return pool
+
+    monkeypatch.setattr(db, "create_pool", create_pool)
+    # Inherited from the master through fork()
+    app.extensions["db_pool"] = ConnectionPool(lambda: conn, min_size=0)
+    app.extensions["db_pool"].pid = os.getpid() + 1
+
+    options(app)["post_fork"](None, Worker())
+
+    pool = app.extensions["db_pool"]
+    assert pool.pid == os.getpid()
+    assert pool.metrics()["idle"] == 1
+
+
+def test_post_fork_stays_up_without_a_database(app, caplog):
+    options(app)["post_fork"](None, Worker())
+
+    assert "could not open its connection pool" in caplog.text
+    assert app.extensions["db_pool"] is None
+
+
+def test_ready_once_the_database_answers(client, fake_db):
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.get_json() == {"ready": True, "pid": os.getpid()}
+
+
+def test_not_ready_without_a_database(client):
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.get_json() == {"ready": False}
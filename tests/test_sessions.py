@@ -0,0 +1,138 @@
+import pytest
+from flask import jsonify, session
+
+from app import db
+from app.sessions import SESSION_ID, LocalStore, ServerSideSessionInterface, SQLStore
+
+
+class RecordingStore(LocalStore):
+    def __init__(self):
+        super().__init__(100)
+        self.calls = []
+
+    def load(self, sid):
+        self.calls.append(("load", sid))
+        return super().load(sid)
+
+    def save(self, sid, payload, ttl):
+        self.calls.append(("save", sid))
+        super().save(sid, payload, ttl)
+
+    def delete(self, sid):
+        self.calls.append(("delete", sid))
+        super().delete(sid)
+
+
+@pytest.fixture
+def store(app):
+    store = RecordingStore()
+    app.extensions["session_store"] = store
+    app.session_interface = ServerSideSessionInterface()
+
+    @app.route("/t/login/<email>")
+    def t_login(email):
+        session["user"] = email
+        return ""
+
+    @app.route("/t/note/<text>")
+    def t_note(text):
+        session["note"] = text
+        return ""
+
+    @app.route("/t/read")
+    def t_read():
+        return jsonify(user=session.get("user"), note=session.get("note"))
+
+    @app.route("/t/logout")
+    def t_logout():
+        session.clear()
+        return ""
+
+    @app.route("/t/nothing")
+    def t_nothing():
+        return ""
+
+    return store
+
+
+def sid(client, app):
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"])
+    return cookie.value if cookie else None
+
+
+def test_the_cookie_only_carries_an_opaque_id(app, client, store):
+    client.get("/t/note/hello")
+
+    assert SESSION_ID.fullmatch(sid(client, app))
+    assert client.get("/t/read").get_json() == {"user": None, "note": "hello"}
+
+
+def test_unused_or_read_only_sessions_are_not_written(app, client, store):
+    client.get("/t/note/hello")
+    store.calls.clear()
+
+    client.get("/t/nothing")
+    assert store.calls == []
+
+    response = client.get("/t/read")
+    assert store.calls == [("load", sid(client, app))]
+    assert "Cookie" in response.headers["Vary"]
+
+
+def test_logging_in_moves_the_session_to_a_new_id(app, client, store):
+    client.get("/t/note/hello")
+    anonymous = sid(client, app)
+
+    client.get("/t/login/a@example.com")
+    logged_in = sid(client, app)
+
+    assert logged_in != anonymous
+    assert ("delete", anonymous) in store.calls
+    assert store.load(anonymous) is None
+    assert client.get("/t/read").get_json() == {"user": "a@example.com", "note": "hello"}
+
+    store.calls.clear()
+    client.get("/t/note/again")
+    assert sid(client, app) == logged_in
+    assert store.calls[-1] == ("save", logged_in)
+
+
+def test_logging_out_deletes_the_session_and_the_cookie(app, client, store):
+    client.get("/t/login/a@example.com")
+    logged_in = sid(client, app)
+
+    client.get("/t/logout")
+
+    assert sid(client, app) is None
+    assert store.load(logged_in) is None
+
+
+def test_a_planted_session_id_is_not_kept_across_a_login(app, client, store):
+    planted = "p" * 43
+    store.save(planted, '{"note": "planted"}', 60)
+    client.set_cookie(app.config["SESSION_COOKIE_NAME"], planted)
+
+    client.get("/t/login/a@example.com")
+
+    assert sid(client, app) != planted
+    assert store.load(planted) is None
+
+
+def test_malformed_cookies_are_ignored(app, client, store):
+    client.set_cookie(app.config["SESSION_COOKIE_NAME"], "../../etc/passwd")
+
+    assert client.get("/t/read").get_json() == {"user": None, "note": None}
+    assert store.calls == []
+
+
+def test_sql_store_statements(app, fake_db):
+    fake_db.answer = lambda sql, params: [('{"user": "a@example.com"}',)] if sql.startswith("SELECT data") else []
+    store = SQLStore(db)
+
+    with app.app_context():
+        assert store.load("s" * 43) == '{"user": "a@example.com"}'
+        store.save("s" * 43, "{}", 60)
+        store.delete("s" * 43)
+
+    assert [sql.split()[0] for sql, _ in fake_db.statements] == ["SELECT", "INSERT", "DELETE"]
+    assert fake_db.commits == 2
@@ -0,0 +1,175 @@
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app.statements import (
+    INSERT_LEDGER, INSERT_SEEN, Progress, StatementError, content_hash, detect_format, load, parse_amount,
+    parse_csv, parse_ofx,
+)
+
+from .conftest import FakeConnection
+
+OFX_SGML = b"""OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20260105120000.000[-5:EST]<TRNAMT>250.00<FITID>A1<NAME>Payroll
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260106<TRNAMT>-42.10<FITID>A2<NAME>Grocer<MEMO>weekly
+</STMTTRN>
+<STMTTRN><DTPOSTED>never<TRNAMT>1<FITID>A3
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+OFX_XML = b"""<?xml version="1.0"?><?OFX OFXHEADER="200"?>
+<OFX><STMTTRN><DTPOSTED>20260105</DTPOSTED><TRNAMT>10.5</TRNAMT><FITID>X</FITID><NAME>Ada</NAME></STMTTRN></OFX>
+"""
+
+
+@pytest.mark.parametrize("text, amount", [
+    ("12.5", Decimal("12.50")), ("$1,234.567", Decimal("1234.57")), ("(3.00)", Decimal("-3.00")), (" -7 ", Decimal(-7)),
+])
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == amount
+
+
+@pytest.mark.parametrize("text", ["", "ten", "NaN", "Infinity"])
+def test_parse_amount_rejects(text):
+    with pytest.raises(StatementError):
+        parse_amount(text)
+
+
+def test_parse_csv_with_an_amount_column():
+    data = "\ufeffDate,Amount,Memo,Reference\n2026-01-05,250.00,Payroll,r1\n\n01/06/2026,-42.10,Grocer,r2\nsoon,1,,\n"
+
+    rows = list(parse_csv(io.BytesIO(data.encode())))
+
+    assert rows[:2] == [
+        (datetime(2026, 1, 5), Decimal("250.00"), "Payroll", "r1"),
+        (datetime(2026, 1, 6), Decimal("-42.10"), "Grocer", "r2"),
+    ]
+    assert isinstance(rows[2], StatementError) and len(rows) == 3
+
+
+def test_parse_csv_with_credit_and_debit_columns():
+    data = b"Posted,Money In,Money Out,Payee\n05.01.2026,100,,Ada\n06.01.2026,,30,Bob\n"
+
+    assert [row[1] for row in parse_csv(io.BytesIO(data))] == [Decimal(100), Decimal(-30)]
+
+
+def test_parse_csv_needs_a_header():
+    with pytest.raises(StatementError, match="CSV header"):
+        list(parse_csv(io.BytesIO(b"when,what\n2026-01-05,1\n")))
+
+
+def test_parse_ofx_sgml():
+    rows = list(parse_ofx(io.BytesIO(OFX_SGML)))
+
+    assert rows[:2] == [
+        (datetime(2026, 1, 5, 12), Decimal("250.00"), "Payroll", "A1"),
+        (datetime(2026, 1, 6), Decimal("-42.10"), "Grocer weekly", "A2"),
+    ]
+    assert isinstance(rows[2], StatementError) and len(rows) == 3
+
+
+def test_parse_ofx_xml():
+    assert list(parse_ofx(io.BytesIO(OFX_XML))) == [(datetime(2026, 1, 5), Decimal("10.50"), "Ada", "X")]
+
+
+@pytest.mark.parametrize("data, fmt", [(OFX_SGML, "ofx"), (OFX_XML, "ofx"), (b"date,amount\n", "csv")])
+def test_detect_format(tmp_path, data, fmt):
+    path = tmp_path / "statement"
+    path.write_bytes(data)
+    assert detect_format(str(path)) == fmt
+
+
+def test_detect_format_rejects_binary_files(tmp_path):
+    path = tmp_path / "statement"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(range(128, 256)) * 4)
+    with pytest.raises(StatementError):
+        detect_format(str(path))
+
+
+class Account:
+    """An account with ``balance`` and the imported_rows table, in memory."""
+
+    def __init__(self, balance):
+        self.balance = Decimal(balance)
+        self.seen = set()
+        self.conn = FakeConnection()
+        self.conn.answer = self.answer
+        self.conn.rowcount = self.rowcount
+
+    def answer(self, sql, params):
+        if sql.startswith("SELECT content_hash FROM imported_rows"):
+            return [(digest,) for digest in params[1:] if digest in self.seen]
+        return []
+
+    def rowcount(self, sql, params):
+        if sql == INSERT_SEEN:
+            self.seen.add(params[1])
+        elif sql.startswith("UPDATE users u SET u.balance"):
+            net = params[0]
+            if self.balance + net < 0:
+                return 0
+            self.balance += net
+        return 1
+
+    def load(self, data, **kwargs):
+        progress = Progress(FakeConnection(), 1)
+        net = load(self.conn, "1000000001", io.BytesIO(data), "csv", progress, **kwargs)
+        return net, progress.counts
+
+    def ledger(self):
+        return self.conn.executed(" ".join(INSERT_LEDGER.split()))
+
+
+STATEMENT = b"date,amount,description\n2026-01-05,100,Pay\n2026-01-06,-30,Food\n2026-01-06,-30,Food\n"
+
+
+def test_load_imports_every_row_once():
+    account = Account(0)
+
+    net, counts = account.load(STATEMENT)
+
+    assert net == Decimal(40) and account.balance == 40
+    assert (counts["rows_imported"], counts["rows_duplicate"]) == (3, 0)
+    assert len(account.ledger()) == 3
+    assert account.conn.commits == 1
+
+    net, counts = account.load(STATEMENT + b"2026-01-07,5,Refund\n", chunk_rows=2)
+
+    assert net == Decimal(5) and account.balance == 45
+    assert (counts["rows_read"], counts["rows_imported"], counts["rows_duplicate"]) == (4, 1, 3)
+    assert len(account.ledger()) == 4
+
+
+def test_load_counts_invalid_rows():
+    account = Account(0)
+
+    net, counts = account.load(b"date,amount\n2026-01-05,100\n2026-01-05,0\nlater,1\n2026-01-05,900\n",
+                               max_amount=Decimal(500))
+
+    assert net == Decimal(100)
+    assert (counts["rows_imported"], counts["rows_invalid"]) == (1, 3)
+
+
+def test_load_refuses_to_overdraw_and_writes_nothing():
+    account = Account(10)
+
+    with pytest.raises(StatementError, match="overdraw"):
+        account.load(b"date,amount\n2026-01-05,-30\n2026-01-06,15\n")
+
+    assert account.balance == 10
+    assert account.conn.commits == 0
+
+
+def test_identical_rows_get_their_own_hash():
+    row = (datetime(2026, 1, 6), Decimal(-30), "Food", "")
+
+    assert content_hash("1", row, 0) != content_hash("1", row, 1)
+    assert content_hash("1", row, 0) != content_hash("2", row, 0)
+    assert len(content_hash("1", row, 0)) == 16
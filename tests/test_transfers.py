@@ -0,0 +1,204 @@
+import random
+import threading
+from decimal import Decimal
+
+import MySQLdb
+import pytest
+
+from app import db, transfers
+from app.transfers import AccountNotFound, InsufficientFunds, transfer
+
+
+class Ledger:
+    """The users table in memory. A transaction holds one lock until it commits
+    or rolls back, standing in for the row locks InnoDB keeps until then."""
+
+    def __init__(self, balances):
+        self.balances = {number: Decimal(balance) for number, balance in balances.items()}
+        self.opening = dict(self.balances)
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def total(self):
+        return sum(self.balances.values())
+
+    def replayed(self):
+        expected = dict(self.opening)
+        for sender, recipient, amount in self.rows:
+            expected[sender] -= amount
+            expected[recipient] += amount
+        return expected
+
+
+class LedgerConnection:
+    def __init__(self, ledger, errors=()):
+        self.ledger = ledger
+        self.errors = list(errors)
+        self.changes = None
+        self.rollbacks = 0
+
+    def cursor(self):
+        return LedgerCursor(self)
+
+    def begin(self):
+        if self.changes is None:
+            self.ledger.lock.acquire()
+            self.changes = ({}, [])
+
+    def commit(self):
+        if self.changes is not None:
+            balances, rows = self.changes
+            self.ledger.balances.update(balances)
+            self.ledger.rows.extend(rows)
+            self._end()
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.changes is not None:
+            self._end()
+
+    def _end(self):
+        self.changes = None
+        self.ledger.lock.release()
+
+
+class LedgerCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        self.rows = []
+        if sql == transfers.FIND_PARTIES:
+            # A plain read: sees committed rows and takes no locks
+            self.rows = [(number,) for number in params if number in self.conn.ledger.balances]
+            self.rowcount = len(self.rows)
+            return
+        self.conn.begin()
+        balances, rows = self.conn.changes
+        if sql == transfers.TRANSFER:
+            if self.conn.errors:
+                raise MySQLdb.OperationalError(self.conn.errors.pop(0), "injected")
+            current = {**self.conn.ledger.balances, **balances}
+            sender, amount, _, _, recipient, _, _ = params
+            matched = [
+                number for number in (sender, recipient)
+                if number in current and (number == recipient or current[number] >= amount)
+            ]
+            for number in matched:
+                balances[number] = current[number] + (amount if number == recipient else -amount)
+            self.rowcount = len(matched)
+        elif sql == transfers.TRANSFER_LEDGER:
+            rows.append(params)
+            self.rowcount = 1
+        else:
+            # account_stats and rollup_deltas bookkeeping
+            self.rowcount = 1
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(transfers.time, "sleep", calls.append)
+    return calls
+
+
+def test_concurrent_transfers_lose_no_money(sleeps):
+    numbers = [f"A{i}" for i in range(6)]
+    ledger = Ledger({number: 500 for number in numbers})
+    failures = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = LedgerConnection(ledger)
+        for _ in range(300):
+            sender, recipient = rng.sample(numbers, 2)
+            if rng.random() < 0.1:
+                conn.errors = [rng.choice(transfers.RETRYABLE_ERRORS)]
+            try:
+                transfer(conn, sender, recipient, Decimal(rng.randint(1, 30000)) / 100)
+            except InsufficientFunds:
+                pass
+            except Exception as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert failures == []
+    assert ledger.total() == 500 * len(numbers)
+    assert all(balance >= 0 for balance in ledger.balances.values())
+    assert ledger.balances == ledger.replayed()
+    assert sleeps
+
+
+@pytest.mark.parametrize("errno", transfers.RETRYABLE_ERRORS)
+def test_deadlocks_are_retried(errno, sleeps):
+    ledger = Ledger({"A": 100, "B": 0})
+    conn = LedgerConnection(ledger, errors=[errno])
+
+    transfer(conn, "A", "B", Decimal(40))
+
+    assert ledger.balances == {"A": 60, "B": 40}
+    assert ledger.rows == [("A", "B", Decimal(40))]
+    assert conn.rollbacks == 1
+    assert len(sleeps) == 1
+
+
+def test_retries_give_up_after_the_last_attempt(sleeps):
+    ledger = Ledger({"A": 100, "B": 0})
+    conn = LedgerConnection(ledger, errors=[1213] * transfers.MAX_ATTEMPTS)
+
+    with pytest.raises(MySQLdb.OperationalError):
+        transfer(conn, "A", "B", Decimal(40))
+
+    assert ledger.balances == {"A": 100, "B": 0}
+    assert len(sleeps) == transfers.MAX_ATTEMPTS - 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    ledger = Ledger({"A": 100, "B": 0})
+    conn = LedgerConnection(ledger, errors=[2013])
+
+    with pytest.raises(MySQLdb.OperationalError):
+        transfer(conn, "A", "B", Decimal(40))
+
+    assert sleeps == []
+    assert ledger.rows == []
+
+
+@pytest.mark.parametrize("sender, recipient, amount, error", [
+    ("A", "B", Decimal(101), InsufficientFunds),
+    ("A", "Z", Decimal(1), AccountNotFound),
+    ("Z", "B", Decimal(1), AccountNotFound),
+])
+def test_failed_transfers_change_nothing(sender, recipient, amount, error):
+    ledger = Ledger({"A": 100, "B": 0})
+
+    with pytest.raises(error):
+        transfer(LedgerConnection(ledger), sender, recipient, amount)
+
+    assert ledger.balances == {"A": 100, "B": 0}
+    assert ledger.rows == []
+
+
+def test_stress_against_mysql(mysql_app):
+    with mysql_app.app_context():
+        counts, problems = transfers.stress(db.pool, accounts=6, threads=8, transfers=800)
+
+    assert problems == []
+    assert counts["ok"] > 0
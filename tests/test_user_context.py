@@ -0,0 +1,52 @@
+import pytest
+from flask import session
+
+from app.user_context import USER_COLUMNS, USER_QUERY, users
+
+from .conftest import log_in
+
+ROW = (1, "Ada", "a@example.com", "1000000001", 250, "1234", None, 3)
+
+
+@pytest.mark.parametrize("path", ["/api/analytics", "/api/export", "/api/import/1"])
+def test_other_sessions_of_a_deleted_account_are_turned_away(client, fake_db, path):
+    log_in(client)
+
+    response = client.get(path)
+
+    assert response.status_code == 404
+    assert response.get_json()["message"] == "User not found"
+    assert fake_db.executed("SELECT id, name") == [("a@example.com",)]
+
+
+def test_the_row_is_read_once_per_request(app, fake_db):
+    fake_db.answer = lambda sql, params: [ROW] if sql.startswith("SELECT id, name") else []
+
+    with app.test_request_context():
+        session["user"] = "a@example.com"
+        assert users.current("account_number")["account_number"] == "1000000001"
+        assert users.current("name", "balance") == dict(zip(USER_COLUMNS, ROW))
+
+    assert len(fake_db.statements) == 1
+    assert fake_db.statements[0][0] == " ".join(USER_QUERY.split())
+
+
+def test_writes_take_the_account_number_from_the_session(app, fake_db):
+    with app.test_request_context():
+        assert users.account_number() is None
+        session["user"] = "a@example.com"
+        session["user_account_number"] = "1000000001"
+        assert users.account_number() == "1000000001"
+
+    assert fake_db.statements == []
+
+
+def test_deposits_notice_a_deleted_account_by_their_rowcount(client, fake_db):
+    log_in(client)
+    fake_db.rowcount = lambda sql, params: 0
+
+    response = client.post("/api/deposit", json={"amount": 10})
+
+    assert response.status_code == 404
+    assert fake_db.executed("UPDATE users SET balance")[0][1] == "1000000001"
+    assert fake_db.commits == 0
@@ -0,0 +1,61 @@
+from flask import jsonify
+
+from app.user_context import users
+from app.versions import ACCOUNT_VERSION, conditional
+
+from .conftest import log_in
+
+
+def serve_versions(app, fake_db, versions):
+    def view():
+        return jsonify(version=users.current("version")["version"])
+
+    def answer(sql, params):
+        if sql == " ".join(ACCOUNT_VERSION.split()):
+            return versions[-1:]
+        return [(1, "Ada", "a@example.com", "1000000001", 0, "1234", None, version) for version, in versions[-1:]]
+
+    app.add_url_rule("/test/versioned", "test_versioned", conditional(view))
+    fake_db.answer = answer
+
+
+def test_unchanged_accounts_get_a_304(app, client, fake_db):
+    serve_versions(app, fake_db, [(5,)])
+    log_in(client)
+
+    first = client.get("/test/versioned")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"5-')
+
+    again = client.get("/test/versioned", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+
+def test_the_version_is_read_from_mysql_not_the_user_cache(app, client, fake_db):
+    versions = [(5,)]
+    serve_versions(app, fake_db, versions)
+    app.config["USER_CACHE_TTL"] = 60
+    log_in(client)
+    etag = client.get("/test/versioned").headers["ETag"]
+
+    # Another worker applies a transfer; this worker's cached row is stale
+    versions.append((6,))
+    response = client.get("/test/versioned", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"].startswith('W/"6-')
+    assert response.get_json() == {"version": 5}
+
+
+def test_deleted_accounts_fall_through_to_the_view(app, client, fake_db):
+    serve_versions(app, fake_db, [])
+    log_in(client)
+
+    app.add_url_rule("/test/gone", "test_gone", conditional(lambda: ("", 404)))
+
+    response = client.get("/test/gone", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
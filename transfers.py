@@ -0,0 +1,444 @@
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+import click
+import MySQLdb
+
+from . import analytics
+from .analytics import RECORD_DELTA, ledger_deltas
+from .stats import RECORD_DEPOSIT, RECORD_WITHDRAWAL, record_deposit, record_withdrawal
+
+# ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT: InnoDB rolled the statement back,
+# so the whole transfer can safely be tried again.
+RETRYABLE_ERRORS = (1213, 1205)
+MAX_ATTEMPTS = 5
+
+MAX_DEPOSIT_LIMIT = 100000
+
+# The balance check, debit and credit of a transfer in one statement; see transfer()
+TRANSFER = """
+    UPDATE users
+    SET balance = balance + CASE WHEN account_number = %s THEN -%s ELSE %s END, version = version + 1
+    WHERE account_number IN (%s, %s)
+      AND (account_number = %s OR balance >= %s)
+"""
+
+TRANSFER_LEDGER = """
+    INSERT INTO transactions (account_number, recipient_account, amount, type)
+    VALUES (%s, %s, %s, 'transfer')
+"""
+
+DEPOSIT_LEDGER = """
+    INSERT INTO transactions (account_number, amount, type)
+    VALUES (%s, %s, 'deposit')
+"""
+
+FIND_PARTIES = "SELECT account_number FROM users WHERE account_number IN (%s, %s)"
+
+LOCK_SENDER = "SELECT balance FROM users WHERE account_number = %s FOR UPDATE"
+
+CREDIT = "UPDATE users SET balance = balance + %s, version = version + 1 WHERE account_number = %s"
+
+# Yielded by the step generators below to roll back the open transaction
+ROLLBACK = "ROLLBACK"
+
+BATCH_CHUNK_SIZE = 500
+LOOKUP_CHUNK_SIZE = 1000
+
+
+class TransferError(Exception):
+    status = 400
+    message = "Transfer failed."
+
+    def __init__(self, message=None):
+        super().__init__(message or self.message)
+
+
+class InsufficientFunds(TransferError):
+    message = "Insufficient balance."
+
+
+class AccountNotFound(TransferError):
+    status = 404
+    message = "Recipient account not found."
+
+
+class InvalidPin(TransferError):
+    status = 403
+    message = "Invalid transaction PIN!"
+
+
+def deposit_amount(raw):
+    """Validates the amount of an /api/deposit request; raises TransferError with the message to show."""
+    if not raw:
+        raise TransferError("Amount is required.")
+    try:
+        amount = float(raw)
+    except (TypeError, ValueError):
+        raise TransferError("Invalid amount format.")
+    if amount <= 0:
+        raise TransferError("Amount must be greater than $0.")
+    if amount > MAX_DEPOSIT_LIMIT:
+        raise TransferError(f"Limit exceeded. Max: ${MAX_DEPOSIT_LIMIT:,.0f}")
+    return amount
+
+
+def transfer_request(data, sender, pin):
+    """Validates a POST /api/transactions body for ``sender``, whose PIN is ``pin``.
+
+    Returns ``(recipient_account, amount)``, or raises TransferError with the
+    message and status to show.
+    """
+    recipient = data.get("recipient_account")
+    amount = data.get("amount")
+    entered_pin = data.get("transaction_pin")
+
+    if not all([recipient, amount, entered_pin]):
+        raise TransferError("All fields are required.")
+    if recipient == sender:
+        raise TransferError("Cannot transfer to yourself.")
+    if entered_pin != pin:
+        raise InvalidPin()
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise TransferError("Invalid amount.")
+    if amount <= 0:
+        raise TransferError("Amount must be positive.")
+    return recipient, amount
+
+
+def deposit_steps(account_number, amount):
+    """A deposit as statements; returns False if the account does not exist.
+
+    Like every ``*_steps`` generator it yields ``(sql, params)``, or ``(sql,
+    [params, ...])`` to run one statement per tuple, and is sent back
+    ``(rowcount, rows)``. ``run_steps`` drives it on a MySQLdb connection
+    and the async API on aiomysql, so both write exactly the same rows.
+    """
+    rowcount, _ = yield CREDIT, (amount, account_number)
+    if rowcount != 1:
+        yield ROLLBACK
+        return False
+
+    yield DEPOSIT_LEDGER, (account_number, amount)
+    yield RECORD_DEPOSIT, (account_number, amount)
+    yield RECORD_DELTA, ledger_deltas([(account_number, None, amount, "deposit", None)])
+    return True
+
+
+def transfer_steps(sender, recipient, amount):
+    """A transfer as statements; see ``deposit_steps``.
+
+    The balance check, debit and credit are one UPDATE over both rows. InnoDB
+    walks the unique account_number index in key order, so two opposite
+    transfers lock the same rows in the same order instead of deadlocking.
+    Raises ``InsufficientFunds`` or ``AccountNotFound`` after rolling back.
+    """
+    rowcount, _ = yield TRANSFER, transfer_params(sender, recipient, amount)
+    if rowcount != 2:
+        yield ROLLBACK
+        _, rows = yield FIND_PARTIES, (sender, recipient)
+        raise transfer_failure({row[0] for row in rows}, sender, recipient)
+
+    yield TRANSFER_LEDGER, (sender, recipient, amount)
+    yield RECORD_WITHDRAWAL, (sender, amount)
+    yield RECORD_DELTA, ledger_deltas([(sender, recipient, amount, "transfer", None)])
+
+
+def retry_delay(error, attempt, attempts=MAX_ATTEMPTS):
+    """Seconds to back off before another attempt after ``error``, or None to give up."""
+    if error.args[0] not in RETRYABLE_ERRORS or attempt == attempts:
+        return None
+    return random.uniform(0, 0.01 * 2 ** attempt)
+
+
+def run_steps(connection, make_steps, attempts=MAX_ATTEMPTS):
+    """Runs the generator returned by ``make_steps()`` on ``connection`` and commits.
+
+    A generator that ends on ``ROLLBACK`` has nothing left to commit. A
+    deadlock or lock wait timeout rolls back and starts over with a fresh
+    generator, with backoff. Returns what the generator returns.
+    """
+    for attempt in range(1, attempts + 1):
+        cursor = connection.cursor()
+        try:
+            steps = make_steps()
+            reply = None
+            pending = False
+            while True:
+                try:
+                    step = steps.send(reply)
+                except StopIteration as done:
+                    if pending:
+                        connection.commit()
+                    return done.value
+                if step is ROLLBACK:
+                    connection.rollback()
+                    reply, pending = None, False
+                    continue
+                pending = True
+                sql, params = step
+                if isinstance(params, list):
+                    cursor.executemany(sql, params)
+                else:
+                    cursor.execute(sql, params)
+                reply = cursor.rowcount, cursor.fetchall()
+        except MySQLdb.OperationalError as e:
+            connection.rollback()
+            delay = retry_delay(e, attempt, attempts)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        finally:
+            cursor.close()
+
+
+def make_deposit(connection, account_number, amount):
+    """Credits a deposit and commits; returns False if the account does not exist."""
+    return run_steps(connection, lambda: deposit_steps(account_number, amount))
+
+
+def transfer(connection, sender, recipient, amount, attempts=MAX_ATTEMPTS):
+    """Moves ``amount`` from ``sender`` to ``recipient`` and commits; see ``transfer_steps``.
+
+    Raises ``InsufficientFunds`` or ``AccountNotFound`` without changing anything.
+    """
+    run_steps(connection, lambda: transfer_steps(sender, recipient, amount), attempts)
+
+
+def transfer_params(sender, recipient, amount):
+    return (sender, amount, amount, sender, recipient, recipient, amount)
+
+
+def transfer_failure(found, sender, recipient):
+    """Picks the error for a transfer that matched fewer than two rows, given the accounts that exist."""
+    if recipient not in found:
+        return AccountNotFound()
+    if sender not in found:
+        return AccountNotFound("Sender account not found.")
+    return InsufficientFunds()
+
+
+def lookup_accounts(connection, account_numbers):
+    """Returns ``{account_number: email}`` for the accounts that exist, one IN query per chunk."""
+    found = {}
+    numbers = sorted(account_numbers)
+    cursor = connection.cursor()
+    try:
+        for start in range(0, len(numbers), LOOKUP_CHUNK_SIZE):
+            chunk = numbers[start:start + LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT account_number, email FROM users WHERE account_number IN ({placeholders})", chunk)
+            found.update(cursor.fetchall())
+    finally:
+        cursor.close()
+    return found
+
+
+def batch_transfer(connection, sender, items, chunk_size=BATCH_CHUNK_SIZE, lock_sender=LOCK_SENDER):
+    """Applies many deposits and transfers from ``sender``, ``chunk_size`` items per transaction.
+
+    ``items`` are ``(index, kind, recipient, amount)`` tuples with ``kind`` either
+    ``"deposit"`` or ``"transfer"``. Items are applied in order against the
+    sender's running balance, so a transfer fails on its own if earlier items
+    used up the funds. Returns ``({index: (ok, message)}, {account_number: email})``
+    with the emails of every recipient that was found. ``lock_sender`` reads
+    the sender's spendable balance and locks its row.
+    """
+    recipients = lookup_accounts(connection, {item[2] for item in items if item[1] == "transfer"})
+    results = {}
+    pending = []
+    for item in items:
+        if item[1] == "transfer" and item[2] not in recipients:
+            results[item[0]] = (False, AccountNotFound.message)
+        else:
+            pending.append(item)
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        while chunk:
+            missing = _apply_chunk(connection, sender, chunk, results, lock_sender)
+            if not missing:
+                break
+            # A recipient was deleted after the lookup; drop its items and redo the chunk.
+            for item in chunk:
+                if item[1] == "transfer" and item[2] in missing:
+                    results[item[0]] = (False, AccountNotFound.message)
+                    recipients.pop(item[2], None)
+            chunk = [item for item in chunk if item[0] not in results]
+
+    return results, recipients
+
+
+def _apply_chunk(connection, sender, chunk, results, lock_sender, attempts=MAX_ATTEMPTS):
+    for attempt in range(1, attempts + 1):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(lock_sender, (sender,))
+            row = cursor.fetchone()
+            if not row:
+                connection.rollback()
+                raise AccountNotFound("Sender account not found.")
+            balance = row[0]
+
+            outcome = {}
+            ledger = []
+            credits = defaultdict(Decimal)
+            deposited = Decimal(0)
+            sent = Decimal(0)
+            for index, kind, recipient, amount in chunk:
+                amount = Decimal(str(amount))
+                if kind == "deposit":
+                    balance += amount
+                    deposited += amount
+                    ledger.append((sender, None, amount, "deposit"))
+                elif balance >= amount:
+                    balance -= amount
+                    sent += amount
+                    credits[recipient] += amount
+                    ledger.append((sender, recipient, amount, "transfer"))
+                else:
+                    outcome[index] = (False, InsufficientFunds.message)
+                    continue
+                outcome[index] = (True, None)
+
+            if ledger:
+                cursor.execute(CREDIT, (deposited - sent, sender))
+                # Sorted so concurrent batches lock recipient rows in the same order
+                credit_rows = [(credits[number], number) for number in sorted(credits)]
+                cursor.executemany(CREDIT, credit_rows)
+                if cursor.rowcount != len(credit_rows):
+                    connection.rollback()
+                    missing = set(credits) - set(lookup_accounts(connection, credits))
+                    if not missing:
+                        raise TransferError("Could not credit every recipient.")
+                    return missing
+
+                cursor.executemany("""
+                    INSERT INTO transactions (account_number, recipient_account, amount, type)
+                    VALUES (%s, %s, %s, %s)
+                """, ledger)
+                if deposited:
+                    record_deposit(cursor, sender, deposited)
+                if sent:
+                    record_withdrawal(cursor, sender, sent)
+                analytics.record(cursor, [(*entry, None) for entry in ledger])
+
+            connection.commit()
+            results.update(outcome)
+            return set()
+        except MySQLdb.OperationalError as e:
+            connection.rollback()
+            delay = retry_delay(e, attempt, attempts)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        finally:
+            cursor.close()
+
+
+def stress(pool, accounts=10, threads=8, transfers=2000, opening_balance=1000):
+    """Runs random concurrent transfers between throwaway accounts and checks the books.
+
+    Returns a list of problems; an empty list means no money was created or
+    lost, no balance went negative and every balance matches its ledger rows.
+    """
+    run_id = uuid.uuid4().hex[:6]
+    numbers = [f"ST{run_id}{i:04d}" for i in range(accounts)]
+
+    entry = pool.acquire()
+    conn = entry.conn
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO users (name, account_number, transaction_pin, email, password_hash, balance)
+            VALUES (%s, %s, '0000', %s, '', %s)
+        """, [(f"Stress {n}", n, f"{n.lower()}@stress.invalid", opening_balance) for n in numbers])
+        conn.commit()
+
+        counts = {"ok": 0, "insufficient": 0}
+        lock = threading.Lock()
+
+        def worker(count):
+            worker_entry = pool.acquire()
+            try:
+                for _ in range(count):
+                    sender, recipient = random.sample(numbers, 2)
+                    amount = round(random.uniform(1, opening_balance / 2), 2)
+                    try:
+                        transfer(worker_entry.conn, sender, recipient, amount)
+                        outcome = "ok"
+                    except InsufficientFunds:
+                        outcome = "insufficient"
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                pool.release(worker_entry)
+
+        per_thread = transfers // threads
+        workers = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        placeholders = ", ".join(["%s"] * len(numbers))
+        cursor.execute(f"SELECT account_number, balance FROM users WHERE account_number IN ({placeholders})", numbers)
+        balances = dict(cursor.fetchall())
+        cursor.execute(f"""
+            SELECT account_number, recipient_account, amount FROM transactions
+            WHERE account_number IN ({placeholders})
+        """, numbers)
+        expected = {n: opening_balance for n in numbers}
+        for sender, recipient, amount in cursor.fetchall():
+            expected[sender] -= amount
+            expected[recipient] += amount
+
+        problems = []
+        total = sum(balances.values())
+        if total != opening_balance * accounts:
+            problems.append(f"total balance is {total}, expected {opening_balance * accounts}")
+        for number in numbers:
+            if balances[number] < 0:
+                problems.append(f"{number} went negative: {balances[number]}")
+            if balances[number] != expected[number]:
+                problems.append(f"{number} balance {balances[number]} does not match ledger {expected[number]}")
+        if counts["ok"] + counts["insufficient"] != per_thread * threads:
+            problems.append(f"only {counts['ok'] + counts['insufficient']} of {per_thread * threads} transfers finished")
+        return counts, problems
+    finally:
+        placeholders = ", ".join(["%s"] * len(numbers))
+        cursor.execute(f"DELETE FROM transactions WHERE account_number IN ({placeholders})", numbers)
+        cursor.execute(f"DELETE FROM account_stats WHERE account_number IN ({placeholders})", numbers)
+        cursor.execute(f"DELETE FROM rollup_deltas WHERE account_number IN ({placeholders})", numbers)
+        cursor.execute(f"DELETE FROM daily_rollups WHERE account_number IN ({placeholders})", numbers)
+        cursor.execute(f"DELETE FROM users WHERE account_number IN ({placeholders})", numbers)
+        conn.commit()
+        cursor.close()
+        pool.release(entry)
+
+
+def init_app(app, db):
+    @app.cli.command("stress-transfers")
+    @click.option("--accounts", default=10, help="Number of throwaway accounts.")
+    @click.option("--threads", default=8, help="Concurrent connections issuing transfers.")
+    @click.option("--transfers", default=2000, help="Total number of transfers to attempt.")
+    def stress_transfers_command(accounts, threads, transfers):
+        """Hammer the transfer path concurrently and check for lost updates."""
+        started = time.monotonic()
+        counts, problems = stress(db.pool, accounts, threads, transfers)
+        elapsed = time.monotonic() - started
+        click.echo(
+            f"{counts['ok']} transfers, {counts['insufficient']} rejected for funds "
+            f"in {elapsed:.1f}s ({(counts['ok'] + counts['insufficient']) / elapsed:.0f}/s)"
+        )
+        for problem in problems:
+            click.echo(problem, err=True)
+        if problems:
+            raise click.ClickException("ledger and balances disagree")
+        click.echo("No lost updates.")
@@ -0,0 +1,104 @@
+from flask import current_app, g, session
+
+from .cache import MISSING, LRUCache
+from .db import db
+from .journal import PENDING_BALANCE, PENDING_VERSION
+
+USER_COLUMNS = ("id", "name", "email", "account_number", "balance", "transaction_pin", "profile_pic_url", "version")
+USER_QUERY = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE email = %s"
+
+# The same row, with a balance that includes entries the journal has not posted yet
+JOURNALED_USER_QUERY = f"""
+    SELECT u.id, u.name, u.email, u.account_number, {PENDING_BALANCE} AS balance,
+           u.transaction_pin, u.profile_pic_url, {PENDING_VERSION} AS version
+    FROM users u WHERE u.email = %s
+"""
+
+
+
+class UserContext:
+    """Loads the logged-in user's row at most once per request.
+
+    ``current(*fields)`` names the fields a view needs; the first call reads
+    the whole row and keeps it on ``g`` for the rest of the request, so a
+    deleted account is noticed even by its other sessions. Writes that check
+    their own rowcount can use ``account_number()`` instead. With
+    ``USER_CACHE_TTL`` above zero rows are also kept across requests for that
+    many seconds. Writes that change a user's row must call ``invalidate`` for
+    every user they touch. The cache is per process, so other workers may serve
+    a row up to the TTL old, which is why it is off by default.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("USER_CACHE_TTL", 0)
+        app.config.setdefault("USER_CACHE_SIZE", 10000)
+        app.extensions["user_cache"] = LRUCache(app.config["USER_CACHE_SIZE"])
+
+    def current(self, *fields):
+        """Returns a dict holding at least ``fields`` for the session user, or None."""
+        email = session.get("user")
+        if email is None:
+            return None
+
+        user = g.get("_user", MISSING)
+        if user is MISSING:
+            user = g._user = self._load(email)
+            if user is not None and session.get("user_account_number") != user["account_number"]:
+                session["user_account_number"] = user["account_number"]
+        return user
+
+    def account_number(self):
+        """The session user's account number, from the session when it holds one.
+
+        The account may have been deleted since, so only use it for a write
+        that fails on its own when no row matches (an UPDATE whose rowcount is
+        checked). Returns None for a logged-out session.
+        """
+        if "user" in session and "user_account_number" in session:
+            return session["user_account_number"]
+        user = self.current("account_number")
+        return user["account_number"] if user else None
+
+    def _load(self, email):
+        user = self.cached(email)
+        if user is not MISSING:
+            return user
+
+        cursor = db.cursor()
+        cursor.execute(self.query(), (email,))
+        row = cursor.fetchone()
+        cursor.close()
+        return self.remember(email, row)
+
+    def query(self):
+        """``USER_QUERY``, or ``JOURNALED_USER_QUERY`` when writes go through the journal."""
+        return JOURNALED_USER_QUERY if current_app.config.get("JOURNAL_ENABLED") else USER_QUERY
+
+    def cached(self, email):
+        """Returns the row kept across requests, or ``MISSING``."""
+        if not current_app.config["USER_CACHE_TTL"]:
+            return MISSING
+        return current_app.extensions["user_cache"].get(email)
+
+    def remember(self, email, row):
+        """Turns a ``query()`` row into the user dict, caching it if enabled."""
+        if row is None:
+            return None
+        user = dict(zip(USER_COLUMNS, row))
+        ttl = current_app.config["USER_CACHE_TTL"]
+        if ttl:
+            current_app.extensions["user_cache"].set(email, user, ttl)
+        return user
+
+    def invalidate(self, *emails):
+        g.pop("_user", None)
+        cache = current_app.extensions["user_cache"]
+        for email in emails:
+            cache.delete(email)
+
+
+users = UserContext()
@@ -0,0 +1,91 @@
+import functools
+import hashlib
+
+from flask import current_app, make_response, request, session
+
+from .db import db
+from .history import ARCHIVE_TABLE
+from .journal import PENDING_VERSION
+from .user_context import users
+
+# Read straight from MySQL, never from the per-process user cache, so every
+# worker stops answering 304 as soon as the account changes
+ACCOUNT_VERSION = "SELECT u.version FROM users u WHERE u.account_number = %s"
+
+# The same, also changed by entries the journal has not posted yet
+JOURNALED_ACCOUNT_VERSION = f"SELECT {PENDING_VERSION} FROM users u WHERE u.account_number = %s"
+
+# Accounts that sent to or received from ``%s``, in both ledger tables
+COUNTERPARTIES = f"""
+    SELECT recipient_account FROM transactions WHERE account_number = %s AND recipient_account IS NOT NULL
+    UNION SELECT account_number FROM transactions WHERE recipient_account = %s
+    UNION SELECT recipient_account FROM {ARCHIVE_TABLE} WHERE account_number = %s AND recipient_account IS NOT NULL
+    UNION SELECT account_number FROM {ARCHIVE_TABLE} WHERE recipient_account = %s
+"""
+
+
+def bump_counterparties(cursor, account_number):
+    """Bumps the version of every account whose history shares rows with ``account_number``.
+
+    Run it before deleting the account's ledger rows, in the same transaction.
+    """
+    cursor.execute(
+        f"UPDATE users SET version = version + 1 WHERE account_number IN (SELECT * FROM ({COUNTERPARTIES}) c)",
+        (account_number,) * 4,
+    )
+
+
+def version_query():
+    """``ACCOUNT_VERSION``, or ``JOURNALED_ACCOUNT_VERSION`` when writes go through the journal."""
+    return JOURNALED_ACCOUNT_VERSION if current_app.config.get("JOURNAL_ENABLED") else ACCOUNT_VERSION
+
+
+def account_version(account_number):
+    """The account's current version, or None if it no longer exists."""
+    cursor = db.cursor()
+    try:
+        cursor.execute(version_query(), (account_number,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return row[0] if row else None
+
+
+def account_etag(version, account_number, endpoint, query_string):
+    """Weak ETag value for one account's view of ``endpoint`` with the given query string."""
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode("latin-1")
+    digest = hashlib.sha256(f"{account_number}\0{endpoint}\0{query_string}".encode()).hexdigest()[:16]
+    return f"{version}-{digest}"
+
+
+def conditional(view):
+    """Gives GET responses of ``view`` a weak ETag from the account's version.
+
+    A request whose If-None-Match still matches is answered with a 304 after
+    one indexed read of the account's version. The version is read before
+    the view runs, so a write that lands in between can only make the tag
+    older than the body, never the reverse.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET" or "user" not in session:
+            return view(*args, **kwargs)
+        account_number = users.account_number()
+        version = account_version(account_number) if account_number else None
+        if version is None:
+            return view(*args, **kwargs)
+
+        etag = account_etag(version, account_number, request.endpoint, request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    wrapper.conditional = True
+    return wrapper